@@ -5,6 +5,7 @@ from django.contrib.auth.forms import ReadOnlyPasswordHashField
 from django.core.exceptions import ValidationError
 from .models import User, Client, Contract, ContractStatus, Event
 from .constants import SELLING_TEAM_NAME, SUPPORT_TEAM_NAME
+from .teams import get_team_member_ids, is_team_member
 
 
 class UserCreationForm(forms.ModelForm):
@@ -61,10 +62,25 @@ class UserAdmin(BaseUserAdmin):
     filter_horizontal = ()
 
 
+class MineListFilter(admin.SimpleListFilter):
+    """ Lets a teammate only display their own records (see 'OwnedQuerySet'). """
+    title = "owner"
+    parameter_name = "mine"
+
+    def lookups(self, request, model_admin):
+        return (("1", "Mine"),)
+
+    def queryset(self, request, queryset):
+        if self.value() == "1":
+            return queryset.owned_by(request.user)
+        return queryset
+
+
 class ClientAdmin(admin.ModelAdmin):
+    list_filter = (MineListFilter,)
+
     def get_queryset(self, request):
         queryset = super(ClientAdmin, self).get_queryset(request)
-        print("\n\n\n", request.resolver_match.func.__name__, "\n\n\n")
         if request.user.is_superuser:
             return queryset
         elif request.resolver_match.func.__name__ in ["changelist_view", "change_view"]:
@@ -79,27 +95,28 @@ class ClientAdmin(admin.ModelAdmin):
         if obj:
             if user.is_superuser:
                 has_permission = True
-            elif user.groups.filter(name=SELLING_TEAM_NAME).exists() and user.id == obj.contact.id:
+            elif is_team_member(user, SELLING_TEAM_NAME) and user.id == obj.contact_id:
                 has_permission = True
 
         return has_permission
 
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == "contact":
-            kwargs["queryset"] = User.objects.filter(groups__name=SELLING_TEAM_NAME)
+            kwargs["queryset"] = User.objects.filter(id__in=get_team_member_ids(SELLING_TEAM_NAME))
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
 class ContractAdmin(admin.ModelAdmin):
+    list_filter = (MineListFilter, "current_state", "current_is_accepted")
+
     def get_queryset(self, request):
         queryset = super(ContractAdmin, self).get_queryset(request)
-        print("\n\n\n", request.resolver_match.func.__name__, "\n\n\n")
         if request.user.is_superuser:
             return queryset
         elif request.resolver_match.func.__name__ in ["changelist_view", "change_view"]:
             return queryset
         else:
-            return queryset.filter(client__contact=request.user)
+            return queryset.filter(selling_contact=request.user)
 
     def has_change_permission(self, request, obj=None):
         user = request.user
@@ -108,22 +125,23 @@ class ContractAdmin(admin.ModelAdmin):
         if obj:
             if user.is_superuser:
                 has_permission = True
-            elif user.groups.filter(name=SELLING_TEAM_NAME).exists() and user.id == obj.client.contact.id:
+            elif is_team_member(user, SELLING_TEAM_NAME) and user.id == obj.selling_contact_id:
                 has_permission = True
 
         return has_permission
 
 
 class ContractStatusAdmin(admin.ModelAdmin):
+    list_filter = (MineListFilter,)
+
     def get_queryset(self, request):
         queryset = super(ContractStatusAdmin, self).get_queryset(request)
-        print("\n\n\n", request.resolver_match.func.__name__, "\n\n\n")
         if request.user.is_superuser:
             return queryset
         elif request.resolver_match.func.__name__ in ["changelist_view", "change_view"]:
             return queryset
         else:
-            return queryset.filter(contract__client__contact=request.user)
+            return queryset.filter(contract__selling_contact=request.user)
 
     def has_change_permission(self, request, obj=None):
         user = request.user
@@ -132,22 +150,23 @@ class ContractStatusAdmin(admin.ModelAdmin):
         if obj:
             if user.is_superuser:
                 has_permission = True
-            elif user.groups.filter(name=SELLING_TEAM_NAME).exists() and user.id == obj.contract.client.contact.id:
+            elif is_team_member(user, SELLING_TEAM_NAME) and user.id == obj.contract.selling_contact_id:
                 has_permission = True
 
         return has_permission
 
 
 class EventAdmin(admin.ModelAdmin):
+    list_filter = (MineListFilter,)
+
     def get_queryset(self, request):
         queryset = super(EventAdmin, self).get_queryset(request)
-        print("\n\n\n", request.resolver_match.func.__name__, "\n\n\n")
         if request.user.is_superuser:
             return queryset
         elif request.resolver_match.func.__name__ in ["changelist_view", "change_view"]:
             return queryset
         else:
-            return queryset.filter(contract__client__contact=request.user)
+            return queryset.filter(selling_contact=request.user)
 
     def has_change_permission(self, request, obj=None):
         user = request.user
@@ -156,16 +175,16 @@ class EventAdmin(admin.ModelAdmin):
         if obj:
             if user.is_superuser:
                 has_permission = True
-            elif user.groups.filter(name=SELLING_TEAM_NAME).exists() and user.id == obj.contract.client.contact.id:
+            elif is_team_member(user, SELLING_TEAM_NAME) and user.id == obj.selling_contact_id:
                 has_permission = True
-            elif user.groups.filter(name=SUPPORT_TEAM_NAME).exists() and user.id == obj.support_contact.id:
+            elif is_team_member(user, SUPPORT_TEAM_NAME) and user.id == obj.support_contact_id:
                 has_permission = True
 
         return has_permission
 
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == "support_contact":
-            kwargs["queryset"] = User.objects.filter(groups__name=SUPPORT_TEAM_NAME)
+            kwargs["queryset"] = User.objects.filter(id__in=get_team_member_ids(SUPPORT_TEAM_NAME))
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
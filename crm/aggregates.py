@@ -0,0 +1,183 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DateField, F, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import User, Client, ClientSales, Contract, Event, MonthlyEventLoad, MonthlySales
+
+
+SIGNED = Q(current_is_accepted=True)
+ZERO = Decimal("0.00")
+
+
+# KEYS ------------------------------------------------------------------------
+# The monthly summaries touched by a write are identified by (owner id, month) keys : the selling contact and the
+# creation month of a contract, the support contact and the start month of an event.
+
+def get_month(value):
+    """ First day of the month of a date, in the current time zone (like 'TruncMonth'). """
+    return timezone.localtime(value).date().replace(day=1)
+
+
+def get_keys(owners_and_dates):
+    """ Keys of the (owner id, date) pairs, without the ones missing their owner or date. """
+    return {
+        (owner_id, get_month(value)) for owner_id, value in owners_and_dates
+        if owner_id is not None and value is not None
+    }
+
+
+def get_rows_filter(owner_field, date_field, keys):
+    """ Filter the rows of the (owner id, month) keys, with a date range per key (to use their date indexes). """
+    conditions = []
+    for owner_id, month in keys:
+        next_month = (month + timedelta(days=31)).replace(day=1)
+        conditions.append(Q(**{
+            owner_field: owner_id,
+            f"{date_field}__gte": timezone.make_aware(datetime.combine(month, time())),
+            f"{date_field}__lt": timezone.make_aware(datetime.combine(next_month, time())),
+        }))
+    return reduce(or_, conditions)
+
+
+def get_summaries_filter(owner_field, keys):
+    return reduce(or_, (Q(**{owner_field: owner_id, "month": month}) for owner_id, month in keys))
+
+
+# REFRESH ---------------------------------------------------------------------
+# Only the summary rows touched by a write are refreshed : they are deleted and inserted again from one grouped query
+# over the rows they summarize, in one transaction. Given no keys, the whole table is rebuilt.
+# The owners of the summaries (users and clients) are locked first, so that two writes refreshing the same summaries
+# wait for each other, the second one reading what the first one committed (otherwise both could insert the same
+# summary, or the last one commit totals missing the rows of the other one). The clients are always locked before
+# the users, and the rows in the order of their ids, not to deadlock. The locks are 'FOR NO KEY UPDATE' : they don't
+# wait for the transactions inserting rows referencing the owners.
+
+def lock_owners(model, ids=None):
+    """ Lock the given rows of the model (all of them given None) until the end of the transaction. """
+    owners = model.objects.select_for_update(no_key=True).order_by("pk")
+    if ids is not None:
+        owners = owners.filter(pk__in=ids)
+    list(owners.values_list("pk"))
+
+
+def replace_rows(summaries, rows):
+    summaries.delete()
+    summaries.model.objects.bulk_create(rows, batch_size=settings.API_BULK_BATCH_SIZE)
+
+
+def refresh_monthly_sales(keys=None):
+    """ Refresh the monthly sales of the (selling contact id, month) keys. """
+    contracts = Contract.objects.filter(selling_contact__isnull=False)
+    summaries = MonthlySales.objects.all()
+    if keys is not None:
+        if not keys:
+            return
+        contracts = contracts.filter(get_rows_filter("selling_contact", "date_created", keys))
+        summaries = summaries.filter(get_summaries_filter("selling_contact", keys))
+    totals = (
+        contracts.annotate(month=TruncMonth("date_created", output_field=DateField()))
+        .values("selling_contact", "month")
+        .annotate(
+            count=Count("id"), total=Sum("amount"), signed_count=Count("id", filter=SIGNED),
+            signed_total=Sum("amount", filter=SIGNED)
+        )
+        .order_by()
+    )
+    with transaction.atomic():
+        lock_owners(User, None if keys is None else {seller_id for seller_id, _ in keys})
+        replace_rows(summaries, [
+            MonthlySales(
+                selling_contact_id=row["selling_contact"], month=row["month"], contracts=row["count"],
+                amount=row["total"], signed_contracts=row["signed_count"], signed_amount=row["signed_total"] or ZERO
+            )
+            for row in totals
+        ])
+
+
+def refresh_client_sales(client_ids=None):
+    clients = Client.objects.all()
+    summaries = ClientSales.objects.all()
+    if client_ids is not None:
+        if not client_ids:
+            return
+        clients = clients.filter(pk__in=client_ids)
+        summaries = summaries.filter(client__in=client_ids)
+    totals = (
+        clients.values("id", "contact")
+        .annotate(
+            count=Count("contracts"), total=Sum("contracts__amount"),
+            signed_count=Count("contracts", filter=Q(contracts__current_is_accepted=True)),
+            signed_total=Sum("contracts__amount", filter=Q(contracts__current_is_accepted=True))
+        )
+        .filter(count__gt=0)
+        .order_by()
+    )
+    with transaction.atomic():
+        lock_owners(Client, client_ids)
+        replace_rows(summaries, [
+            ClientSales(
+                client_id=row["id"], selling_contact_id=row["contact"], contracts=row["count"], amount=row["total"],
+                signed_contracts=row["signed_count"], signed_amount=row["signed_total"] or ZERO
+            )
+            for row in totals
+        ])
+
+
+def refresh_monthly_event_load(keys=None):
+    """ Refresh the monthly event loads of the (support contact id, month) keys. """
+    events = Event.objects.all()
+    summaries = MonthlyEventLoad.objects.all()
+    if keys is not None:
+        if not keys:
+            return
+        events = events.filter(get_rows_filter("support_contact", "start_date", keys))
+        summaries = summaries.filter(get_summaries_filter("support_contact", keys))
+    totals = (
+        events.annotate(month=TruncMonth("start_date", output_field=DateField()))
+        .values("support_contact", "month")
+        .annotate(count=Count("id"), total_attendees=Sum("attendees"), duration=Sum(F("end_date") - F("start_date")))
+        .order_by()
+    )
+    with transaction.atomic():
+        lock_owners(User, None if keys is None else {support_id for support_id, _ in keys})
+        replace_rows(summaries, [
+            MonthlyEventLoad(
+                support_contact_id=row["support_contact"], month=row["month"], events=row["count"],
+                attendees=row["total_attendees"],
+                hours=(Decimal(row["duration"].total_seconds()) / 3600).quantize(ZERO)
+            )
+            for row in totals
+        ])
+
+
+def refresh_sales(sales_keys, client_ids):
+    """ Refresh the monthly sales of the keys and the sales of the clients (None ids are ignored). """
+    with transaction.atomic():
+        refresh_client_sales(set(client_ids) - {None})
+        refresh_monthly_sales(sales_keys)
+
+
+def refresh_sales_of_contracts(contract_ids):
+    """ Refresh the sales summaries of the contracts (their selling contact and month, and their client). """
+    contracts = list(
+        Contract.objects.filter(pk__in=contract_ids).values_list("selling_contact_id", "date_created", "client_id")
+    )
+    refresh_sales(
+        get_keys((seller_id, date_created) for seller_id, date_created, _ in contracts),
+        [client_id for _, _, client_id in contracts]
+    )
+
+
+def refresh_dashboard():
+    """ Rebuild all the summary tables, in one transaction. """
+    with transaction.atomic():
+        refresh_client_sales()
+        refresh_monthly_sales()
+        refresh_monthly_event_load()
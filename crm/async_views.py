@@ -0,0 +1,43 @@
+from django.http import HttpResponseNotAllowed
+
+from .db import database_sync_to_async
+from .views import (
+    ClientList, ClientDetail,
+    ContractList, ContractDetail,
+    ContractStatusList, ContractStatusDetail,
+    EventList, EventDetail,
+)
+
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def as_async_view(view_class):
+    """
+    Native async (ASGI) read-only twin of an API view. Django 3.2 has no async ORM, and runs every sync view of the
+    process in a single thread under ASGI : here the whole sync view (authentication, permissions, filters,
+    conditional requests, query and serialization) runs in the thread pool of the event loop instead, so a slow
+    database call holds one thread of the pool and the other requests keep being served.
+    The answers are the same as the ones of the sync view.
+    """
+    sync_view = database_sync_to_async(view_class.as_view())
+
+    async def view(request, *args, **kwargs):
+        if request.method not in READ_METHODS:
+            return HttpResponseNotAllowed(READ_METHODS)
+        return await sync_view(request, *args, **kwargs)
+
+    view.view_class = view_class
+    # like the DRF views ('csrf_exempt()' would make a sync function of the view)
+    view.csrf_exempt = True
+    return view
+
+
+client_list = as_async_view(ClientList)
+client_detail = as_async_view(ClientDetail)
+contract_list = as_async_view(ContractList)
+contract_detail = as_async_view(ContractDetail)
+contract_status_list = as_async_view(ContractStatusList)
+contract_status_detail = as_async_view(ContractStatusDetail)
+event_list = as_async_view(EventList)
+event_detail = as_async_view(EventDetail)
@@ -0,0 +1,33 @@
+from django.utils.crypto import constant_time_compare, salted_hmac
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .models import User
+
+
+# CALENDAR FEED TOKENS --------------------------------------------------------
+# Calendar applications subscribe to the URL of a feed, without a session or any header : the calendar of a user is
+# opened by a '?token=' of that URL. The token is the id of the user and an HMAC of their id and password hash :
+# changing the password revokes the token.
+
+CALENDAR_TOKEN_SALT = "crm.authentication.calendar"
+
+
+def make_calendar_token(user):
+    digest = salted_hmac(CALENDAR_TOKEN_SALT, f"{user.pk}:{user.password}", algorithm="sha256").hexdigest()
+    return f"{user.pk}-{digest}"
+
+
+class CalendarTokenAuthentication(BaseAuthentication):
+    """ Authenticate the user of the '?token=' of a calendar feed (see 'make_calendar_token'). """
+    token_query_param = "token"
+
+    def authenticate(self, request):
+        token = request.query_params.get(self.token_query_param)
+        if token is None:
+            return None
+        user_id = token.partition("-")[0]
+        user = User.objects.filter(pk=user_id, is_active=True).first() if user_id.isdigit() else None
+        if user is None or not constant_time_compare(token, make_calendar_token(user)):
+            raise AuthenticationFailed("Invalid calendar token.")
+        return user, token
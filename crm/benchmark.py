@@ -0,0 +1,360 @@
+import asyncio
+import io
+import itertools
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.db.models import Max
+from django.test import Client as TestClient
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .aggregates import refresh_dashboard
+from .constants import SELLING_TEAM_NAME, SUPPORT_TEAM_NAME
+from .loader import reset_sequences
+from .middleware import QueryCounter
+from .models import User, Client, Contract, ContractStatus, Event
+from .permissions import ContractDetailPermission, EventDetailPermission
+from .serializers import ContractSerializer, get_values_serializer
+from .signals import refresh_current_statuses
+from .teams import invalidate_team_directory
+
+
+FIRST_NAMES = ("Alice", "Bruno", "Carla", "David", "Emma", "Farid", "Gina", "Hugo", "Ines", "Jules", "Karim", "Lea")
+LAST_NAMES = ("Martin", "Bernard", "Dubois", "Thomas", "Robert", "Richard", "Petit", "Durand", "Leroy", "Moreau")
+COMPANY_WORDS = ("Funnch", "Contal", "Brewery", "Studio", "Consulting", "Partners", "Labs", "Events", "Group")
+
+
+# SYNTHETIC DATASET -----------------------------------------------------------
+
+def get_next_ids(*models):
+    """ Return an iterator of free primary keys for each model : rows are created with explicit ids. """
+    return [
+        itertools.count((model.objects.aggregate(last_id=Max("id"))["last_id"] or 0) + 1) for model in models
+    ]
+
+
+def generate_dataset(clients, contracts_per_client=2, events_per_contract=1, seed=0, batch_size=None, log=print):
+    """
+    Create 'clients' clients with their contracts, one status per contract and their events, followed by a teammate
+    of each team for every 100 clients. Rows are created with 'bulk_create()' and explicit ids (every database
+    backend can then link them) : the denormalized selling contacts and current statuses are set here, as no signal
+    is sent.
+    Return the created users, as a {team name: [users]} dict.
+    """
+    batch_size = batch_size or settings.API_BULK_BATCH_SIZE
+    randomizer = random.Random(seed)
+    now = timezone.now()
+    password = make_password(None)
+    suffix = f"{seed}.{int(now.timestamp())}"
+    models = (User, Client, Contract, ContractStatus, Event)
+    user_ids, client_ids, contract_ids, status_ids, event_ids = get_next_ids(*models)
+
+    teams = {}
+    for team_name, prefix in ((SELLING_TEAM_NAME, "seller"), (SUPPORT_TEAM_NAME, "support")):
+        users = User.objects.bulk_create(
+            [
+                User(
+                    id=next(user_ids), email=f"{prefix}.{number}.{suffix}@bench.crm",
+                    first_name=randomizer.choice(FIRST_NAMES), last_name=randomizer.choice(LAST_NAMES),
+                    phone="0600000000", is_staff=True, password=password
+                )
+                for number in range(max(1, clients // 100))
+            ],
+            batch_size=batch_size
+        )
+        group, _ = Group.objects.get_or_create(name=team_name)
+        User.groups.through.objects.bulk_create(
+            [User.groups.through(user_id=user.id, group_id=group.id) for user in users], batch_size=batch_size
+        )
+        teams[team_name] = users
+    invalidate_team_directory()
+    sellers, supports = teams[SELLING_TEAM_NAME], teams[SUPPORT_TEAM_NAME]
+    log(f"Created {len(sellers)} sellers and {len(supports)} support teammates.")
+
+    for first_client in range(0, clients, batch_size):
+        batch_clients = Client.objects.bulk_create([
+            Client(
+                id=next(client_ids), first_name=randomizer.choice(FIRST_NAMES),
+                last_name=randomizer.choice(LAST_NAMES), email=f"client.{number}.{suffix}@bench.crm",
+                phone="0102030405",
+                company_name=f"{randomizer.choice(COMPANY_WORDS)} {randomizer.choice(COMPANY_WORDS)}",
+                contact=randomizer.choice(sellers)
+            )
+            for number in range(first_client, min(first_client + batch_size, clients))
+        ])
+        contracts = Contract.objects.bulk_create([
+            Contract(
+                id=next(contract_ids), reference=f"B{client.id}.{number}",
+                amount=Decimal(randomizer.randrange(100000, 10000000)) / 100,
+                payment_due=now + timedelta(days=randomizer.randrange(-365, 365)), client=client,
+                selling_contact_id=client.contact_id
+            )
+            for client in batch_clients
+            for number in range(contracts_per_client)
+        ], batch_size=batch_size)
+        ContractStatus.objects.bulk_create([
+            ContractStatus(
+                id=next(status_ids), is_accepted=randomizer.random() < 0.8, acceptance_note="Generated.",
+                state=randomizer.choice("SPE"), state_note="Generated.", contract=contract
+            )
+            for contract in contracts
+        ], batch_size=batch_size)
+        if contracts:
+            refresh_current_statuses(Contract.objects.filter(id__range=(contracts[0].id, contracts[-1].id)))
+        events = []
+        for contract in contracts:
+            for number in range(events_per_contract):
+                start_date = now + timedelta(days=randomizer.randrange(-365, 365), hours=randomizer.randrange(24))
+                events.append(Event(
+                    id=next(event_ids), name=f"Event {number} of {contract.reference}",
+                    attendees=randomizer.randrange(5, 500), start_date=start_date,
+                    end_date=start_date + timedelta(hours=randomizer.randrange(1, 8)), note="Generated.",
+                    contract=contract, support_contact=randomizer.choice(supports),
+                    selling_contact_id=contract.selling_contact_id
+                ))
+        Event.objects.bulk_create(events, batch_size=batch_size)
+        log(f"Created {min(first_client + batch_size, clients)} / {clients} clients.")
+
+    reset_sequences(*models)
+    refresh_dashboard()
+    return teams
+
+
+# TIMING ----------------------------------------------------------------------
+
+def summarize(durations, query_counts=None):
+    """ Latency percentiles (in milliseconds) and query counts of the runs of a scenario. """
+    milliseconds = sorted(duration * 1000 for duration in durations)
+    percentiles = statistics.quantiles(milliseconds, n=100, method="inclusive")
+    summary = {
+        "runs": len(milliseconds),
+        "p50_ms": round(percentiles[49], 3),
+        "p95_ms": round(percentiles[94], 3),
+        "p99_ms": round(percentiles[98], 3),
+        "mean_ms": round(statistics.fmean(milliseconds), 3),
+    }
+    if query_counts is not None:
+        summary["queries"] = max(query_counts)
+    return summary
+
+
+def measure(function, runs):
+    """ Call 'function()' 'runs' times, timing it and counting the queries it sends. """
+    durations, query_counts = [], []
+    for _ in range(runs):
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            start = time.perf_counter()
+            function()
+            durations.append(time.perf_counter() - start)
+        query_counts.append(counter.count)
+    return summarize(durations, query_counts)
+
+
+def api_call(client, method, url, user, expected_status, **kwargs):
+    """ Return a function sending the API request with the test client (through all the middlewares). """
+    def call():
+        client.force_authenticate(user)
+        response = getattr(client, method)(url, **kwargs)
+        if response.status_code != expected_status:
+            raise AssertionError(f"{method.upper()} {url} answered {response.status_code} : {response.content[:200]}")
+    return call
+
+
+# SCENARIOS -------------------------------------------------------------------
+
+def run_scenarios(runs, page_size=100):
+    """ Time the main endpoints, the permission checks and the serializers on the current database content. """
+    event = Event.objects.select_related("contract__client", "selling_contact").order_by("-id").first()
+    if event is None:
+        raise ValueError("There is no event to run the scenarios on : generate some data first.")
+    seller, contract = event.selling_contact, event.contract
+    client = APIClient()
+    event_data = {
+        "name": event.name, "attendees": event.attendees, "note": "Updated by the benchmark.",
+        "start_date": event.start_date.isoformat(), "end_date": event.end_date.isoformat(),
+        "contract": event.contract_id, "support_contact": event.support_contact_id,
+    }
+    permission_request = SimpleNamespace(user=seller, method="PUT")
+    contracts = list(Contract.objects.order_by("-id")[:page_size])
+    contract_rows = list(
+        Contract.objects.order_by("-id").values(*get_values_serializer(ContractSerializer).columns)[:page_size]
+    )
+
+    scenarios = {
+        "client_list": api_call(client, "get", f"/api/v1/client/?page_size={page_size}", seller, 200),
+        "contract_search": api_call(
+            client, "get", f"/api/v1/contract/?search={contract.client.last_name}&page_size={page_size}", seller, 200
+        ),
+        "event_detail_put": api_call(client, "put", f"/api/v1/event/{event.id}/", seller, 200, data=event_data),
+        "permission_checks": lambda: [
+            ContractDetailPermission().has_object_permission(permission_request, None, contract)
+            and EventDetailPermission().has_object_permission(permission_request, None, event)
+            for _ in range(page_size)
+        ],
+        "model_serializer": lambda: ContractSerializer(contracts, many=True).data,
+        "values_serializer": lambda: get_values_serializer(ContractSerializer).to_representation(contract_rows),
+    }
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+        return {name: measure(function, runs) for name, function in scenarios.items()}
+
+
+# LOAD ------------------------------------------------------------------------
+# Many concurrent clients polling the read endpoints, sent straight to the WSGI and ASGI handlers of Django (no
+# server, no network) : the threads of a threaded WSGI server against the event loop of an ASGI server.
+
+@contextmanager
+def database_latency(seconds):
+    """ Add 'seconds' to every query, in every thread, like a database server far away or under load. """
+    def slow_down(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    patched = []
+
+    def patch(connection, **kwargs):
+        connection.execute_wrappers.append(slow_down)
+        patched.append(connection)
+
+    if not seconds:
+        yield
+        return
+    for existing_connection in connections.all():
+        patch(existing_connection)
+    connection_created.connect(patch, weak=False)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(patch)
+        for patched_connection in patched:
+            patched_connection.execute_wrappers.remove(slow_down)
+
+
+def get_session_cookie(user):
+    """ Session cookie of the user, logged in without a password check. """
+    client = TestClient()
+    client.force_login(user)
+    return client.cookies.output(attrs=[], header="", sep=";").strip()
+
+
+def summarize_load(durations, statuses, wall_time):
+    failures = sum(1 for status in statuses if status != 200)
+    return {
+        **summarize(durations),
+        "throughput_rps": round(len(durations) / wall_time, 1),
+        "failures": failures,
+    }
+
+
+def run_wsgi_load(urls, cookie, concurrency):
+    """ Send the GET requests to the WSGI handler from 'concurrency' threads, like a threaded WSGI server. """
+    handler = WSGIHandler()
+
+    def call(url):
+        path, _, query = url.partition("?")
+        environ = {
+            "REQUEST_METHOD": "GET", "SCRIPT_NAME": "", "PATH_INFO": path, "QUERY_STRING": query,
+            "SERVER_NAME": "testserver", "SERVER_PORT": "80", "SERVER_PROTOCOL": "HTTP/1.1",
+            "REMOTE_ADDR": "127.0.0.1", "HTTP_HOST": "testserver", "HTTP_COOKIE": cookie,
+            "wsgi.version": (1, 0), "wsgi.url_scheme": "http", "wsgi.input": io.BytesIO(), "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True, "wsgi.multiprocess": False, "wsgi.run_once": False,
+        }
+        statuses = []
+        start = time.perf_counter()
+        response = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+        b"".join(response)
+        response.close()
+        return time.perf_counter() - start, int(statuses[0].split()[0])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(call, urls))
+    wall_time = time.perf_counter() - start
+    return summarize_load([duration for duration, _ in results], [status for _, status in results], wall_time)
+
+
+async def send_asgi_load(urls, cookie, concurrency):
+    handler = ASGIHandler()
+    pending = iter(urls)
+    durations, statuses = [], []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def call(url):
+        path, _, query = url.partition("?")
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+            "path": path, "query_string": query.encode(), "root_path": "",
+            "headers": [(b"host", b"testserver"), (b"cookie", cookie.encode())],
+            "client": ("127.0.0.1", 0), "server": ("testserver", 80),
+        }
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        start = time.perf_counter()
+        await handler(scope, receive, send)
+        durations.append(time.perf_counter() - start)
+        statuses.append(messages[0]["status"])
+
+    async def client():
+        for url in pending:
+            await call(url)
+
+    # the sync code run by 'sync_to_async(thread_sensitive=False)' gets as many threads as the WSGI server
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return summarize_load(durations, statuses, time.perf_counter() - start)
+
+
+def run_asgi_load(urls, cookie, concurrency):
+    """ Send the GET requests to the ASGI handler from 'concurrency' tasks of an event loop, like an ASGI server. """
+    return asyncio.run(send_asgi_load(urls, cookie, concurrency))
+
+
+def run_load(requests, concurrency, db_latency=0, page_size=20):
+    """
+    Send the same mix of list and detail GETs to the sync views through WSGI, to the same sync views through
+    ASGI, and to their async twins (crm/async_views.py) through ASGI, and compare their latencies and throughput.
+    The data must be committed : every thread uses its own database connection.
+    """
+    event = Event.objects.select_related("selling_contact").order_by("-id").first()
+    if event is None:
+        raise ValueError("There is no event to run the load on : generate some data first.")
+    paths = [
+        f"client/?page_size={page_size}&mine=true",
+        f"contract/?page_size={page_size}&mine=true",
+        f"event/?page_size={page_size}&mine=true",
+        f"client/{event.contract.client_id}/",
+        f"contract/{event.contract_id}/",
+        f"event/{event.id}/",
+    ]
+    cookie = get_session_cookie(event.selling_contact)
+    sync_urls = [f"/api/v1/{path}" for path in itertools.islice(itertools.cycle(paths), requests)]
+    async_urls = [url.replace("/api/v1/", "/api/v1/async/", 1) for url in sync_urls]
+
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]), database_latency(db_latency):
+        return {
+            "wsgi_sync_views": run_wsgi_load(sync_urls, cookie, concurrency),
+            "asgi_sync_views": run_asgi_load(sync_urls, cookie, concurrency),
+            "asgi_async_views": run_asgi_load(async_urls, cookie, concurrency),
+        }
@@ -0,0 +1,55 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+
+def close_unusable_connections():
+    """
+    With persistent connections (CONN_MAX_AGE), close the connections of the thread which the database server
+    dropped (restart, failover, idle timeout) : Django opens a new one on the next query.
+    """
+    if not settings.DB_CONN_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+
+
+def database_sync_to_async(func):
+    """
+    Make an awaitable of a sync function using the database, run in the thread pool of the event loop
+    (thread_sensitive=False) : it neither blocks the event loop, nor waits for the single thread in which Django 3.2
+    runs all the other sync code of the process. Every thread of the pool has its own connections, checked and
+    closed when they are too old, like around a request.
+    """
+    def run(*args, **kwargs):
+        close_old_connections()
+        close_unusable_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+
+def iterate(queryset, chunk_size):
+    """
+    Iterate over a large queryset without loading it whole into memory : through a server-side cursor with
+    '.iterator()' when the database allows them, by pages of 'chunk_size' rows on the primary key otherwise
+    (DISABLE_SERVER_SIDE_CURSORS behind pgbouncer, where psycopg would fetch the whole result at once).
+    Rows can be model instances or '.values()' dicts holding the primary key.
+    """
+    if not connections[queryset.db].settings_dict.get("DISABLE_SERVER_SIDE_CURSORS"):
+        yield from queryset.iterator(chunk_size=chunk_size)
+        return
+
+    pk_name = queryset.model._meta.pk.attname
+    queryset = queryset.order_by("pk")
+    page = queryset
+    while True:
+        rows = list(page[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last_row = rows[-1]
+        page = queryset.filter(pk__gt=last_row[pk_name] if isinstance(last_row, dict) else last_row.pk)
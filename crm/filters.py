@@ -0,0 +1,154 @@
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connections
+from django.db.models import BooleanField, CharField, TextField
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend, SearchFilter
+
+
+SEARCH_RANK = "search_rank"
+TRUE_VALUES = ("1", "true", "yes", "on")
+FALSE_VALUES = ("0", "false", "no", "off")
+
+
+def get_model_field(model, lookup_path):
+    """ Follow a 'relation__field' lookup path from the model and return the targeted model field. """
+    *relation_names, field_name = lookup_path.split("__")
+    for relation_name in relation_names:
+        model = model._meta.get_field(relation_name).related_model
+    return model._meta.get_field(field_name)
+
+
+class TrigramSearchFilter(SearchFilter):
+    """
+    DRF SearchFilter, with the same '?search=' semantics, ranked on PostgreSQL.
+    There, the 'icontains' lookups on the client names and email are served by the trigram GIN indexes of
+    migration 0003, and the results are ordered by their best trigram similarity with the search terms (then by id,
+    and paged with an offset, see 'KeysetPagination').
+    """
+    def filter_queryset(self, request, queryset, view):
+        queryset = super().filter_queryset(request, queryset, view)
+        search_terms = self.get_search_terms(request)
+        if not search_terms or not self.can_rank(queryset):
+            return queryset
+
+        text_fields = [
+            search_field for search_field in getattr(view, "search_fields", [])
+            if search_field[0].isalpha()
+            and isinstance(get_model_field(queryset.model, search_field), (CharField, TextField))
+        ]
+        similarities = [TrigramSimilarity(field, term) for field in text_fields for term in search_terms]
+        if not similarities:
+            return queryset
+        rank = similarities[0] if len(similarities) == 1 else Greatest(*similarities)
+        return queryset.annotate(**{SEARCH_RANK: rank})
+
+    @staticmethod
+    def can_rank(queryset):
+        """ Trigram similarities need the pg_trgm extension of PostgreSQL. """
+        return connections[queryset.db].vendor == "postgresql"
+
+    def get_ordering(self, request, queryset, view):
+        """ Ordering used by the pagination : by rank first when the results are ranked. """
+        ordering = view.pagination_class.ordering
+        if SEARCH_RANK in queryset.query.annotations:
+            return ("-" + SEARCH_RANK, ordering)
+        return (ordering,)
+
+
+KEY_LOOKUPS = ["exact", "in"]
+RANGE_LOOKUPS = ["exact", "gt", "gte", "lt", "lte", "range"]
+
+
+class LookupFilter(BaseFilterBackend):
+    """
+    Typed filtering on the fields declared in the view 'filter_fields' dict, like {"amount": RANGE_LOOKUPS}.
+    '?amount__gte=1000', '?payment_due__lt=2022-03-01' or '?start_date__range=2022-01-01,2022-02-01' are parsed
+    with the model field (dates, decimals and booleans are compared as such, not as text), so they become plain
+    WHERE clauses that can use the column indexes. A bare '?client=3' means 'exact'. Invalid values get a 400.
+    """
+    MULTIPLE_VALUES_LOOKUPS = ("in", "range")
+
+    def filter_queryset(self, request, queryset, view):
+        filter_fields = getattr(view, "filter_fields", {})
+        conditions, errors = {}, {}
+
+        for param, value in request.query_params.items():
+            if param in filter_fields:
+                field_name, lookup = param, "exact"
+            else:
+                field_name, _, lookup = param.rpartition("__")
+                if lookup not in filter_fields.get(field_name, ()):
+                    continue
+
+            model_field = get_model_field(queryset.model, field_name)
+            try:
+                if lookup in self.MULTIPLE_VALUES_LOOKUPS:
+                    values = [self.parse_value(model_field, item) for item in value.split(",")]
+                    if lookup == "range" and len(values) != 2:
+                        raise DjangoValidationError("A range needs two comma separated values.")
+                    conditions[f"{field_name}__{lookup}"] = values
+                else:
+                    conditions[f"{field_name}__{lookup}"] = self.parse_value(model_field, value)
+            except DjangoValidationError as error:
+                errors[param] = error.messages
+
+        if errors:
+            raise ValidationError(errors)
+        return queryset.filter(**conditions)
+
+    @staticmethod
+    def parse_value(model_field, value):
+        value = value.strip()
+        if model_field.is_relation:
+            model_field = model_field.target_field
+        if isinstance(model_field, BooleanField) and value.lower() in TRUE_VALUES + FALSE_VALUES:
+            return value.lower() in TRUE_VALUES
+
+        value = model_field.to_python(value)
+        if isinstance(value, datetime) and settings.USE_TZ and timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
+
+
+class WindowFilter(BaseFilterBackend):
+    """
+    '?from=2022-02-01&to=2022-03-01' restricts the list to the records whose 'window_field' (a date of the view) is
+    in the [from, to) window : a calendar page is then one range scan of the index on that date. Both bounds are
+    optional.
+    """
+    bounds = (("from", "gte"), ("to", "lt"))
+
+    def filter_queryset(self, request, queryset, view):
+        model_field = get_model_field(queryset.model, view.window_field)
+        conditions, errors = {}, {}
+        for param, lookup in self.bounds:
+            value = request.query_params.get(param)
+            if not value:
+                continue
+            try:
+                conditions[f"{view.window_field}__{lookup}"] = LookupFilter.parse_value(model_field, value)
+            except DjangoValidationError as error:
+                errors[param] = error.messages
+        if errors:
+            raise ValidationError(errors)
+        return queryset.filter(**conditions)
+
+
+class OwnerFilter(BaseFilterBackend):
+    """
+    '?mine=true' restricts the list to the records of the user : the clients they follow, the contracts (and their
+    status) and events they sold, and the events they support. Ownership is read from the indexed owner columns of
+    the model (see 'OwnedQuerySet'), not through joins up to the client.
+    """
+    mine_query_param = "mine"
+
+    def filter_queryset(self, request, queryset, view):
+        if request.query_params.get(self.mine_query_param, "").lower() in TRUE_VALUES:
+            return queryset.owned_by(request.user)
+        return queryset
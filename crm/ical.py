@@ -0,0 +1,63 @@
+from datetime import timezone
+
+
+# ICALENDAR -------------------------------------------------------------------
+# Just enough of RFC 5545 to publish the events as a read-only calendar feed : CRLF line endings, lines folded at 75
+# octets, escaped texts and UTC dates.
+
+PRODUCT_ID = "-//EPIC Events//CRM//EN"
+LINE_LENGTH = 75
+
+
+def escape_text(value):
+    return (
+        value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+        .replace("\r\n", "\\n").replace("\n", "\\n")
+    )
+
+
+def format_datetime(value):
+    return value.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def fold(line):
+    """ Split the content line in lines of at most 75 octets, the next ones starting with a space. """
+    parts, part, length = [], "", 0
+    for character in line:
+        size = len(character.encode())
+        if length + size > LINE_LENGTH:
+            parts.append(part)
+            part, length = " ", 1
+        part += character
+        length += size
+    parts.append(part)
+    return "\r\n".join(parts) + "\r\n"
+
+
+def describe(event):
+    return f"{event['attendees']} attendees.\n{event['note']}"
+
+
+def iter_calendar(events, name, domain):
+    """
+    Render an iterable of event dicts (id, name, start_date, end_date, attendees, note, date_updated) as the lines
+    of an iCalendar document.
+    """
+    yield fold("BEGIN:VCALENDAR")
+    yield fold("VERSION:2.0")
+    yield fold(f"PRODID:{PRODUCT_ID}")
+    yield fold("CALSCALE:GREGORIAN")
+    yield fold(f"X-WR-CALNAME:{escape_text(name)}")
+    for event in events:
+        yield "".join(fold(line) for line in (
+            "BEGIN:VEVENT",
+            f"UID:event-{event['id']}@{domain}",
+            f"DTSTAMP:{format_datetime(event['date_updated'])}",
+            f"LAST-MODIFIED:{format_datetime(event['date_updated'])}",
+            f"DTSTART:{format_datetime(event['start_date'])}",
+            f"DTEND:{format_datetime(event['end_date'])}",
+            f"SUMMARY:{escape_text(event['name'])}",
+            f"DESCRIPTION:{escape_text(describe(event))}",
+            "END:VEVENT",
+        ))
+    yield fold("END:VCALENDAR")
@@ -0,0 +1,245 @@
+import json
+import os
+import re
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import chain
+from pathlib import Path
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.management.color import no_style
+from django.core import serializers
+from django.core.serializers.python import Deserializer
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .aggregates import refresh_dashboard
+from .db import iterate
+from .models import User
+from .signals import fill_selling_contacts, refresh_current_statuses
+from .teams import invalidate_team_directory
+
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+DEMO_FIXTURES = (
+    "crm_user.json",
+    "crm_client.json",
+    "crm_contract.json",
+    "crm_contract_status.json",
+    "crm_event.json",
+)
+SEPARATORS = re.compile(r"[\s,]*")
+
+
+# STREAMING JSON --------------------------------------------------------------
+
+def iter_fixture(path, chunk_size=64 * 1024):
+    """
+    Yield the objects of a JSON fixture (a list of objects) one by one, reading the file by chunks : only the
+    objects not yet decoded are kept in memory.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as fixture_file:
+        buffer = ""
+        while not buffer:
+            chunk = fixture_file.read(chunk_size)
+            buffer = chunk.lstrip()
+            if not chunk:
+                break
+        if not buffer.startswith("["):
+            raise ValueError(f"{path} is not a JSON list.")
+        position = 1
+        while True:
+            position = SEPARATORS.match(buffer, position).end()
+            if position < len(buffer) and buffer[position] == "]":
+                return
+            try:
+                if position == len(buffer):
+                    raise json.JSONDecodeError("Unexpected end of chunk", buffer, position)
+                fixture_object, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # the object goes on in the next chunk
+                chunk = fixture_file.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            yield fixture_object
+
+
+def get_fixture_model(path):
+    """ Model of the first object of a fixture, used to load the fixtures in the order of their foreign keys. """
+    first_object = next(iter_fixture(path), None)
+    return apps.get_model(first_object["model"]) if first_object else None
+
+
+def sort_by_dependencies(models):
+    """ Order the models so that every model comes after the models its foreign keys point to. """
+    remaining, ordered = list(models), []
+    while remaining:
+        for model in remaining:
+            targets = {field.related_model for field in model._meta.concrete_fields if field.is_relation}
+            if not targets.intersection(remaining) - {model}:
+                ordered.append(model)
+                remaining.remove(model)
+                break
+        else:
+            raise ValueError(f"Circular foreign keys between {', '.join(model.__name__ for model in remaining)}.")
+    return ordered
+
+
+# BULK LOADING ----------------------------------------------------------------
+
+def reset_sequences(*models):
+    """ Move the primary key sequences after the rows created with explicit ids. """
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(sql)
+
+
+@contextmanager
+def fixture_dates(model, instances):
+    """
+    Keep the dates of the fixture in the 'auto_now' and 'auto_now_add' fields of the model, like 'loaddata'. The
+    dates missing from the fixture (a dump older than the field) are set to the current time.
+    """
+    fields = [field for field in model._meta.concrete_fields if getattr(field, "auto_now_add", False)
+              or getattr(field, "auto_now", False)]
+    now = timezone.now()
+    for instance in instances:
+        for field in fields:
+            if getattr(instance, field.attname) is None:
+                setattr(instance, field.attname, now)
+    flags = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, flags):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def hash_passwords(users, pool):
+    """ Hash the plain text passwords of the users (demo users), in the process pool. """
+    plain_users = []
+    for user in users:
+        try:
+            identify_hasher(user.password)
+        except ValueError:
+            plain_users.append(user)
+    if plain_users:
+        hashed_passwords = pool().map(make_password, [user.password for user in plain_users], chunksize=16)
+        for user, hashed_password in zip(plain_users, hashed_passwords):
+            user.password = hashed_password
+
+
+def insert_objects(model, batch, pool):
+    """ Insert a batch of deserialized objects of the model, with their many-to-many relations. """
+    instances = [deserialized.object for deserialized in batch]
+    if model is User:
+        hash_passwords(instances, pool)
+    with fixture_dates(model, instances):
+        model.objects.bulk_create(instances)
+    for field in model._meta.many_to_many:
+        through = field.remote_field.through
+        from_column, to_column = f"{field.m2m_field_name()}_id", f"{field.m2m_reverse_field_name()}_id"
+        through.objects.bulk_create([
+            through(**{from_column: deserialized.object.pk, to_column: pk})
+            for deserialized in batch
+            for pk in deserialized.m2m_data.get(field.name, ())
+        ])
+
+
+def load_fixture(path, batch_size, pool):
+    """
+    Insert the objects of a fixture by batches of 'bulk_create()'. A fixture holding several models (a dump) must
+    list them in the order of their foreign keys. Return the number of objects of every model.
+    """
+    counts = {}
+    batch, model = [], None
+    for deserialized in Deserializer(iter_fixture(path)):
+        if batch and (type(deserialized.object) is not model or len(batch) == batch_size):
+            insert_objects(model, batch, pool)
+            batch = []
+        model = type(deserialized.object)
+        batch.append(deserialized)
+        counts[model] = counts.get(model, 0) + 1
+    if batch:
+        insert_objects(model, batch, pool)
+    return counts
+
+
+def load_fixtures(paths, batch_size=None, log=print):
+    """
+    Load the fixtures in one transaction, much faster than 'loaddata' which saves the objects one by one : the files
+    are streamed in the order of their foreign keys (the files starting with the same model in the given order) and
+    inserted with 'bulk_create()', then the primary key sequences are reset. Plain text passwords of the users are
+    hashed in a pool of processes. No signal is sent : the denormalized columns and the team directory are
+    refreshed at the end.
+    """
+    batch_size = batch_size or settings.API_BULK_BATCH_SIZE
+    fixtures = defaultdict(list)
+    for path in paths:
+        model = get_fixture_model(path)
+        if model is not None:
+            fixtures[model].append(path)
+
+    executor = None
+
+    def pool():
+        nonlocal executor
+        if executor is None:
+            executor = ProcessPoolExecutor(initializer=django.setup)
+        return executor
+
+    try:
+        with transaction.atomic():
+            loaded_models = set()
+            for path in chain.from_iterable(fixtures[model] for model in sort_by_dependencies(fixtures)):
+                for loaded_model, count in load_fixture(path, batch_size, pool).items():
+                    loaded_models.add(loaded_model)
+                    log(f"Loaded {count} {loaded_model._meta.verbose_name_plural.lower()} from {Path(path).name}.")
+            reset_sequences(*loaded_models)
+            fill_selling_contacts()
+            refresh_current_statuses(keep_dates=True)
+            refresh_dashboard()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        invalidate_team_directory()
+
+
+def load_demo_fixtures(batch_size=None, log=print):
+    load_fixtures([FIXTURES_DIR / file_name for file_name in DEMO_FIXTURES], batch_size, log)
+
+
+# STREAMING DUMP --------------------------------------------------------------
+
+def dump_fixture(path, models=None, chunk_size=2000):
+    """
+    Write the objects of the models (all the models of the crm app by default) into a JSON fixture, in the order of
+    their foreign keys. Rows are read by chunks (see 'crm.db.iterate') and written as they come, so the dump never
+    holds a whole table in memory. The dump is written into a temporary file of the same directory, which replaces
+    the file at the path once complete : a failed dump leaves the previous one untouched.
+    """
+    models = sort_by_dependencies(models or apps.get_app_config("crm").get_models())
+    objects = chain.from_iterable(
+        iterate(model._default_manager.order_by("pk"), chunk_size) for model in models
+    )
+    path = Path(path)
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=path.parent, prefix=f".{path.name}.", suffix=".tmp", delete=False
+    ) as fixture_file:
+        try:
+            serializers.serialize("json", objects, stream=fixture_file, indent=2)
+        except BaseException:
+            fixture_file.close()
+            os.remove(fixture_file.name)
+            raise
+    os.replace(fixture_file.name, path)
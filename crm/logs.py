@@ -0,0 +1,69 @@
+import json
+import logging
+import os
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+
+# Attributes of every log record : anything else on a record was given with 'extra' and is logged as a field.
+RECORD_ATTRIBUTES = frozenset(logging.makeLogRecord({}).__dict__) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """ Format a record as one JSON object per line, with the 'extra' values given to the logger as fields. """
+    def format(self, record):
+        content = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith("_"):
+                content[key] = value
+        if record.exc_info:
+            content["exception"] = self.formatException(record.exc_info)
+        return json.dumps(content, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """ Keep a 'rate' share of the records (0 to 1), warnings and errors are always kept. """
+    def __init__(self, rate=1.0, name=""):
+        super().__init__(name)
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+class QueueFileHandler(QueueHandler):
+    """
+    Non-blocking file handler : the request thread only puts the record in an in-memory queue, a background
+    listener thread formats it and writes it to the file.
+    """
+    def __init__(self, filename, encoding="utf-8"):
+        super().__init__(queue.SimpleQueue())
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        self.file_handler = logging.FileHandler(filename, encoding=encoding, delay=True)
+        self.listener = QueueListener(self.queue, self.file_handler, respect_handler_level=False)
+        self.listener.start()
+        self.stopped = False
+
+    def setFormatter(self, fmt):
+        # Records are formatted by the listener thread, not by the thread logging them.
+        self.file_handler.setFormatter(fmt)
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def close(self):
+        # Called by 'logging.shutdown()' at exit : wait for the queued records to be written.
+        if not self.stopped:
+            self.stopped = True
+            self.listener.stop()
+            self.file_handler.close()
+        super().close()
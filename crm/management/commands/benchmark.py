@@ -0,0 +1,107 @@
+import json
+import subprocess
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from crm.benchmark import generate_dataset, run_scenarios
+from crm.models import Client, Contract, ContractStatus, Event
+from crm.teams import invalidate_team_directory
+
+
+def get_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic dataset, time the main endpoints, permission checks and serializers on it, and "\
+           "print the p50/p95/p99 latencies and query counts as JSON. The dataset is rolled back unless --keep is used."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--clients",
+            type=int,
+            default=10000,
+            help="Number of clients to generate, 0 to run on the current data only (default: 10000)."
+        )
+        parser.add_argument(
+            "--contracts-per-client",
+            type=int,
+            default=2,
+            help="Number of contracts (each with a status) generated per client (default: 2)."
+        )
+        parser.add_argument(
+            "--events-per-contract",
+            type=int,
+            default=1,
+            help="Number of events generated per contract (default: 1)."
+        )
+        parser.add_argument(
+            "--runs",
+            type=int,
+            default=50,
+            help="Number of runs of every scenario (default: 50)."
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Seed of the data generator, to compare runs on the same dataset (default: 0)."
+        )
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help="Keep the generated dataset instead of rolling it back."
+        )
+        parser.add_argument(
+            "--output",
+            help="Also write the JSON report into this file."
+        )
+
+    def handle(self, *args, **options):
+        if options["runs"] < 2:
+            raise CommandError("Percentiles need at least 2 runs.")
+
+        report = {
+            "revision": get_revision(),
+            "date": timezone.now().isoformat(),
+            "database": connection.vendor,
+        }
+        log = self.stderr.write
+        try:
+            with transaction.atomic():
+                if options["clients"]:
+                    start = time.perf_counter()
+                    generate_dataset(
+                        options["clients"], options["contracts_per_client"], options["events_per_contract"],
+                        seed=options["seed"], log=log
+                    )
+                    report["generation_s"] = round(time.perf_counter() - start, 3)
+                if connection.vendor == "postgresql":
+                    with connection.cursor() as cursor:
+                        cursor.execute("ANALYZE;")
+                report["dataset"] = {
+                    model._meta.model_name: model.objects.count() for model in (Client, Contract, ContractStatus, Event)
+                }
+                log("Running the scenarios.")
+                try:
+                    report["scenarios"] = run_scenarios(options["runs"])
+                except ValueError as error:
+                    raise CommandError(error)
+                transaction.set_rollback(not options["keep"])
+        finally:
+            invalidate_team_directory()
+
+        content = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                output_file.write(content + "\n")
+        self.stdout.write(content)
@@ -0,0 +1,31 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.loader import FIXTURES_DIR, load_fixtures
+
+
+class Command(BaseCommand):
+    help = "Load JSON fixtures with 'bulk_create()' in the order of their foreign keys, in one transaction. "\
+           "Much faster than 'loaddata', but no signal is sent."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "fixtures",
+            nargs="+",
+            help="Paths of the fixtures, or names of fixtures of the 'crm/fixtures' directory."
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="Number of objects inserted per query (default: API_BULK_BATCH_SIZE)."
+        )
+
+    def handle(self, *args, **options):
+        paths = []
+        for fixture in options["fixtures"]:
+            path = next((path for path in (Path(fixture), FIXTURES_DIR / fixture) if path.is_file()), None)
+            if path is None:
+                raise CommandError(f"No fixture named '{fixture}'.")
+            paths.append(path)
+        load_fixtures(paths, options["batch_size"], log=self.stdout.write)
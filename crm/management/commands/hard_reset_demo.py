@@ -1,7 +1,10 @@
-from django.db import connection
+from django.db import connection, DatabaseError
 from django.core import management
-from django.core.management.base import BaseCommand
-from django.core.management.commands import makemigrations, migrate, dumpdata, loaddata
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.commands import makemigrations, migrate
+
+from crm.loader import dump_fixture, load_demo_fixtures
+from crm.snapshots import get_snapshot_name, restore_snapshot, take_snapshot
 
 from project.settings import DATABASES
 
@@ -34,6 +37,21 @@ class Command(BaseCommand):
             action="store_true",
             help="Ask the user confirmation before every next step."
         )
+        parser.add_argument(
+            '--nosave',
+            action="store_true",
+            help="Command will not save the database content before dropping it."
+        )
+        parser.add_argument(
+            '--snapshot',
+            action="store_true",
+            help="Save a snapshot of the migrated and prepopulated database, for the next '--fromsnapshot' resets."
+        )
+        parser.add_argument(
+            '--fromsnapshot',
+            action="store_true",
+            help="Restore the database from its last snapshot instead of migrating and prepopulating it again."
+        )
 
     def handle(self, *args, **options):
         save_location = "crm/fixtures/last_saved.json"
@@ -45,28 +63,51 @@ class Command(BaseCommand):
             print("\n/!\\ UNSAFE FOR PRODUCTION /!\\\n")
             start_message = "This operation will :"\
                 f"\n - drop all your actual '' database content"\
-                f"(and save it into fixture file {save_location})"\
-                "\n - execute the makemigrations command"\
-                "\n - execute the migrate command"\
-                + f"{f'{new_line}- prepopulate the database using fixtures' if not options['noprepopulate'] else ''}"\
+                + f"{f' (and save it into fixture file {save_location})' if not options['nosave'] else ''}"\
+                + (
+                    f"{new_line} - restore the database from its snapshot ({get_snapshot_name()})"
+                    if options["fromsnapshot"] else
+                    "\n - execute the makemigrations command"
+                    "\n - execute the migrate command"
+                    + (f"{new_line} - prepopulate the database using fixtures" if not options["noprepopulate"] else "")
+                    + f"{f'{new_line} - save a snapshot of the database' if options['snapshot'] else ''}"
+                )\
                 + f"{new_line}Your permission will{' not' if not options['askconfirmation'] else ''}"\
                 + " be asked before each step.\n"
             print(start_message)
             if not user_confirmed():
                 return
-        """
+
         # saves all the actual data at 'crm/fixtures/last_saved.json' ---------
-        print(separator + f"* Going to save you actual database content at {save_location}.")
-        if options["askconfirmation"]:
-            if not user_confirmed():
-                return
+        if not options["nosave"]:
+            print(separator + f"* Going to save you actual database content at {save_location}.")
+            if options["askconfirmation"]:
+                if not user_confirmed():
+                    return
 
-        print("☐ Saving the actual database content.")
-        management.call_command(dumpdata.Command(), output="crm/fixtures/last_saved.json")
-        print("☑ Database content was saved into the 'crm/fixtures/last_saved.json' file."
-              "Use 'manage.py loaddata last_saved.json' to restore it.")
-        
-        """
+            print("☐ Saving the actual database content.")
+            try:
+                dump_fixture(save_location)
+                print(f"☑ Database content was saved into the '{save_location}' file. "
+                      "Use 'manage.py fast_loaddata last_saved.json' to restore it.")
+            except DatabaseError:
+                print("☒ No database content to save (the tables don't exist).")
+
+        # restores the snapshot of the database -------------------------------
+        if options["fromsnapshot"]:
+            print(separator + f"* Going to restore the database from its snapshot ({get_snapshot_name()}).")
+            if options["askconfirmation"]:
+                if not user_confirmed():
+                    return
+
+            print("☐ Restoring the database snapshot.")
+            try:
+                restore_snapshot()
+            except (FileNotFoundError, NotImplementedError) as error:
+                raise CommandError(f"{error} Run 'hard_reset_demo --snapshot' first.")
+            print("☑ Restored the database snapshot.")
+            print("\n\n☑ Demo application is ready to use !")
+            return
 
         # removes the PostgreSQL public schema and recreate it ----------------
         print(separator + "* Going to drop public schema and to create another.")
@@ -110,18 +151,19 @@ class Command(BaseCommand):
                     return
 
             print(separator + "☐ Prepopulating database with demo data.")
-            fixtures = (
-                "crm_user.json",
-                "crm_client.json",
-                "crm_contract.json",
-                "crm_contract_status.json",
-                "crm_event.json"
-            )
-            for file_name in fixtures:
-                print(f"☐ Loading {file_name} fixture.")
-                management.call_command(loaddata.Command(), file_name)
-                print(f"☑ Loaded {file_name} fixture.")
+            load_demo_fixtures(log=lambda message: print(f"☑ {message}"))
             print("☑ Prepopulated database with demo data.")
 
+        # snapshot ------------------------------------------------------------
+        if options["snapshot"]:
+            print(separator + f"* Going to save a snapshot of the database ({get_snapshot_name()}).")
+            if options["askconfirmation"]:
+                if not user_confirmed():
+                    return
+
+            print("☐ Saving the database snapshot.")
+            take_snapshot()
+            print("☑ Saved the database snapshot. Use 'manage.py hard_reset_demo --fromsnapshot' to restore it.")
+
         # Command end message -------------------------------------------------
         print("\n\n☑ Demo application is ready to use !")
@@ -0,0 +1,82 @@
+from django.db import connection
+from django.core.management.base import BaseCommand, CommandError
+
+
+UNUSED_INDEXES_QUERY = """
+    SELECT stats.relname, stats.indexrelname, stats.idx_scan, pg_size_pretty(pg_relation_size(stats.indexrelid))
+    FROM pg_stat_user_indexes AS stats
+    JOIN pg_index AS pg_index ON pg_index.indexrelid = stats.indexrelid
+    WHERE stats.idx_scan <= %(max_scans)s
+      AND NOT pg_index.indisunique
+      AND NOT pg_index.indisprimary
+      AND stats.relname LIKE %(table_pattern)s
+    ORDER BY pg_relation_size(stats.indexrelid) DESC;
+"""
+
+SEQUENTIAL_SCANS_QUERY = """
+    SELECT relname, seq_scan, seq_tup_read, COALESCE(idx_scan, 0), n_live_tup
+    FROM pg_stat_user_tables
+    WHERE seq_scan > 0
+      AND n_live_tup >= %(min_rows)s
+      AND seq_tup_read / seq_scan >= %(min_rows)s
+      AND relname LIKE %(table_pattern)s
+    ORDER BY seq_tup_read DESC;
+"""
+
+
+class Command(BaseCommand):
+    help = "Report the unused indexes and the tables read by large sequential scans (missing indexes), "\
+           "from the PostgreSQL statistics collected since their last reset."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--table-prefix",
+            default="crm_",
+            help="Only report the tables whose name starts with this prefix (default: 'crm_')."
+        )
+        parser.add_argument(
+            "--max-scans",
+            type=int,
+            default=0,
+            help="An index used at most this number of times is reported as unused (default: 0)."
+        )
+        parser.add_argument(
+            "--min-rows",
+            type=int,
+            default=10000,
+            help="Only report the sequential scans reading at least this number of rows per scan (default: 10000)."
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError(
+                "The index report reads the PostgreSQL statistics views, it needs a PostgreSQL database."
+            )
+
+        parameters = {
+            "table_pattern": options["table_prefix"] + "%",
+            "max_scans": options["max_scans"],
+            "min_rows": options["min_rows"],
+        }
+        with connection.cursor() as cursor:
+            cursor.execute(UNUSED_INDEXES_QUERY, parameters)
+            unused_indexes = cursor.fetchall()
+            cursor.execute(SEQUENTIAL_SCANS_QUERY, parameters)
+            sequential_scans = cursor.fetchall()
+
+        self.stdout.write(f"* Unused indexes (scanned at most {options['max_scans']} times, can be dropped) :")
+        for table, index, scans, size in unused_indexes:
+            self.stdout.write(f"  - {table}.{index} : {scans} scans, {size}")
+        if not unused_indexes:
+            self.stdout.write("  none")
+
+        self.stdout.write(
+            f"* Tables read by sequential scans of {options['min_rows']}+ rows (an index may be missing) :"
+        )
+        for table, seq_scans, rows_read, index_scans, live_rows in sequential_scans:
+            self.stdout.write(
+                f"  - {table} : {seq_scans} sequential scans reading {rows_read // seq_scans} rows on average "
+                f"({index_scans} index scans, {live_rows} live rows)"
+            )
+        if not sequential_scans:
+            self.stdout.write("  none")
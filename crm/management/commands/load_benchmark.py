@@ -0,0 +1,63 @@
+import json
+
+from django.db import connection
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from crm.benchmark import run_load
+from crm.management.commands.benchmark import get_revision
+
+
+class Command(BaseCommand):
+    help = "Send many concurrent GETs to the list and detail endpoints through the WSGI handler (sync views) and "\
+           "the ASGI handler (sync views, then their async twins), and print the latencies and throughput as JSON. "\
+           "Runs on the current data : use 'benchmark --keep' or the demo data first."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=2000,
+            help="Number of requests sent to every handler (default: 2000)."
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=32,
+            help="Number of concurrent clients, and of threads of the WSGI server and of the ASGI thread pool "
+                 "(default: 32)."
+        )
+        parser.add_argument(
+            "--db-latency",
+            type=float,
+            default=0,
+            help="Milliseconds added to every query, to mimic a remote or loaded database (default: 0)."
+        )
+        parser.add_argument(
+            "--output",
+            help="Also write the JSON report into this file."
+        )
+
+    def handle(self, *args, **options):
+        if options["requests"] < 2:
+            raise CommandError("Percentiles need at least 2 requests.")
+
+        report = {
+            "revision": get_revision(),
+            "date": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "requests": options["requests"],
+            "concurrency": options["concurrency"],
+            "db_latency_ms": options["db_latency"],
+        }
+        self.stderr.write("Sending the requests.")
+        try:
+            report["handlers"] = run_load(options["requests"], options["concurrency"], options["db_latency"] / 1000)
+        except ValueError as error:
+            raise CommandError(error)
+
+        content = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                output_file.write(content + "\n")
+        self.stdout.write(content)
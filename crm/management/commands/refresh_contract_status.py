@@ -0,0 +1,30 @@
+from django.db import transaction
+from django.db.models import Max
+from django.core.management.base import BaseCommand
+
+from crm.models import Contract
+from crm.signals import refresh_current_statuses
+
+
+class Command(BaseCommand):
+    help = "Copy the latest status of every contract into its 'current_is_accepted' and 'current_state' columns, "\
+           "by ranges of ids, each in its own transaction. Run it after writing statuses without signals."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10000,
+            help="Number of contract ids refreshed per transaction (default: 10000)."
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_id = Contract.objects.aggregate(last_id=Max("id"))["last_id"] or 0
+        refreshed = 0
+        for first_id in range(1, last_id + 1, batch_size):
+            with transaction.atomic():
+                refreshed += refresh_current_statuses(
+                    Contract.objects.filter(id__gte=first_id, id__lt=first_id + batch_size)
+                )
+            self.stdout.write(f"Refreshed {refreshed} contracts (ids up to {min(first_id + batch_size - 1, last_id)}).")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from crm.aggregates import refresh_dashboard
+from crm.models import ClientSales, MonthlyEventLoad, MonthlySales
+
+
+class Command(BaseCommand):
+    help = "Rebuild the dashboard summary tables from the contracts, statuses and events, in one transaction. "\
+           "Run it after migrating, and periodically if rows are written without signals (queryset updates, SQL)."
+
+    def handle(self, *args, **options):
+        refresh_dashboard()
+        self.stdout.write(
+            f"Refreshed {MonthlySales.objects.count()} monthly sales, {ClientSales.objects.count()} client sales "
+            f"and {MonthlyEventLoad.objects.count()} monthly event loads."
+        )
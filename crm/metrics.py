@@ -0,0 +1,174 @@
+import threading
+from bisect import bisect_left
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+ROW_COUNT_BUCKETS = (0, 1, 10, 50, 100, 250, 500, 1000)
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Registry:
+    """
+    In-process metrics, written in the Prometheus text format by 'expose()'.
+    Every thread writes in its own shard ({(metric, label values): value} dict), only read when the metrics are
+    exposed : recording a value takes no lock. The shards of the finished threads are folded into the 'retired'
+    totals, so that servers starting a thread per request don't keep a shard per request. Values are kept per
+    process, so with several workers every worker has to be scraped (or the scraper has to sum them up).
+    """
+    def __init__(self):
+        self.metrics = []
+        self.shards = {}
+        self.retired = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def get_shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = {}
+            with self.lock:
+                self.retire_finished_threads()
+                self.shards[threading.current_thread()] = shard
+            return shard
+
+    @staticmethod
+    def merge_shard(samples, shard):
+        for (metric, label_values), value in list(shard.items()):
+            samples[metric, label_values] = metric.merge(samples.get((metric, label_values)), value)
+
+    def retire_finished_threads(self):
+        """ Fold the shards of the finished threads into the retired totals (called with the lock held). """
+        for thread in [thread for thread in self.shards if not thread.is_alive()]:
+            self.merge_shard(self.retired, self.shards.pop(thread))
+
+    def collect(self):
+        """ Sum up the retired totals and the shards into a {metric: {label values: value}} dict. """
+        with self.lock:
+            self.retire_finished_threads()
+            totals = dict(self.retired)
+            shards = list(self.shards.values())
+        for shard in shards:
+            self.merge_shard(totals, shard)
+        samples = {metric: {} for metric in self.metrics}
+        for (metric, label_values), value in totals.items():
+            samples[metric][label_values] = value
+        return samples
+
+    def expose(self):
+        lines = []
+        for metric, values in self.collect().items():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.format_samples(values))
+        return "\n".join(lines) + "\n"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        registry.register(self)
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callbacks = []
+
+    def add_callback(self, callback):
+        """ Add values read from another object when the metrics are exposed : 'callback()' returns {labels: value}. """
+        self.callbacks.append(callback)
+
+    def inc(self, *label_values, amount=1):
+        shard = self.registry.get_shard()
+        key = (self, label_values)
+        shard[key] = shard.get(key, 0) + amount
+
+    def merge(self, total, value):
+        return value if total is None else total + value
+
+    def format_samples(self, values):
+        for callback in self.callbacks:
+            values = {**values, **callback()}
+        for label_values, value in sorted(values.items()):
+            yield f"{self.name}{format_labels(self.labelnames, label_values)} {format_value(value)}"
+
+
+class Histogram:
+    """ Histogram of the observed values : each shard keeps [count per bucket..., '+Inf' count, sum]. """
+    type = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.registry = registry
+        registry.register(self)
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        shard = self.registry.get_shard()
+        key = (self, label_values)
+        counts = shard.get(key)
+        if counts is None:
+            counts = shard[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def merge(self, total, value):
+        return list(value) if total is None else [a + b for a, b in zip(total, value)]
+
+    def format_samples(self, values):
+        for label_values, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = format_labels((*self.labelnames, "le"), (*label_values, bound))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = format_labels(self.labelnames, label_values)
+            yield f"{self.name}_sum{labels} {format_value(counts[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+# CRM METRICS -----------------------------------------------------------------
+
+registry = Registry()
+
+REQUEST_LATENCY = Histogram(
+    registry, "crm_request_duration_seconds", "Time spent answering the requests, per view.", ("view", "method"),
+)
+REQUEST_QUERIES = Histogram(
+    registry, "crm_request_queries", "Number of database queries per request, per view.", ("view",),
+    buckets=QUERY_COUNT_BUCKETS,
+)
+REQUEST_DB_TIME = Counter(
+    registry, "crm_request_db_seconds_total", "Time spent in the database, per view.", ("view",),
+)
+LIST_ROWS = Histogram(
+    registry, "crm_list_rows", "Number of rows returned by the list endpoints, per view.", ("view",),
+    buckets=ROW_COUNT_BUCKETS,
+)
+PERMISSION_DENIALS = Counter(
+    registry, "crm_permission_denials_total", "Requests refused, per permission class.", ("permission",),
+)
+CACHE_REQUESTS = Counter(
+    registry, "crm_cache_requests_total", "In-process cache lookups, per cache and result.", ("cache", "result"),
+)
@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.functional import SimpleLazyObject, empty
+
+from .db import database_sync_to_async
+from .metrics import REQUEST_LATENCY, REQUEST_QUERIES, REQUEST_DB_TIME
+from .routers import is_stuck_to_primary, next_replica, read_database, stick_to_primary
+
+
+request_logger = logging.getLogger("crm.requests")
+query_logger = logging.getLogger("crm.queries")
+
+# Counter of the queries of the current request, set by QueryTimingMiddleware. A context variable follows the
+# request into the threads running its sync code under ASGI, which use other connections than the middleware.
+current_query_counter = ContextVar("current_query_counter", default=None)
+
+
+class QueryCounter:
+    """
+    'connection.execute_wrapper()' counting the queries of a request, their total duration and the slowest one.
+    With 'keep_queries', the SQL of every query is also kept to be logged if the request turns out to be slow.
+    """
+    def __init__(self, keep_queries=False):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = 0.0
+        self.queries = [] if keep_queries else None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            if duration > self.slowest:
+                self.slowest = duration
+            if self.queries is not None:
+                self.queries.append((context["connection"].alias, round(duration * 1000, 2), sql))
+
+
+def count_query(execute, sql, params, many, context):
+    """ Execute wrapper of every connection (see crm/signals.py), feeding the counter of the current request. """
+    counter = current_query_counter.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    return counter(execute, sql, params, many, context)
+
+
+def get_view_path(request):
+    """
+    Module and qualified name of the view class (or admin view) which answered the request, (None, None) if no URL
+    matched.
+    """
+    match = request.resolver_match
+    if match is None:
+        return None, None
+    view_class = getattr(match.func, "view_class", None)
+    if view_class is not None:
+        return view_class.__module__, view_class.__qualname__
+    model_admin = getattr(match.func, "model_admin", None)
+    if model_admin is not None:
+        return type(model_admin).__module__, f"{type(model_admin).__qualname__}.{match.func.__name__}"
+    return match.func.__module__, match.view_name
+
+
+def get_view_name(request):
+    """ Dotted path of the view which answered the request, None if no URL matched. """
+    module, name = get_view_path(request)
+    return f"{module}.{name}" if name else None
+
+
+def get_loaded_user_id(request):
+    """ Id of the user of the request, if it was authenticated : the user is not loaded only to be logged. """
+    user = getattr(request, "user", None)
+    if user is None or isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+        return None
+    return user.id if user.is_authenticated else None
+
+
+class SyncAndAsyncMiddleware:
+    """
+    Base of the middlewares of this module, which run around sync and async views alike : under ASGI, a chain of
+    async capable middlewares lets the async views (see crm/async_views.py) run on the event loop, instead of being
+    pushed into a thread. Subclasses implement '__call__()' for the sync chain and '__acall__()' for the async one.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # tells Django to await the middleware (like MiddlewareMixin)
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+
+class QueryTimingMiddleware(SyncAndAsyncMiddleware):
+    """
+    Count the queries sent to every database during the request, and time them : the results are kept on
+    'request.query_counter' and sent back in a 'Server-Timing' header. The SQL of the requests spending more than
+    SLOW_REQUEST_THRESHOLD milliseconds in the database is logged to 'crm.queries'.
+    The body of streamed responses (exports) is produced after the middleware returns, its queries are not counted.
+    """
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.threshold = settings.SLOW_REQUEST_THRESHOLD / 1000 if settings.SLOW_REQUEST_THRESHOLD else None
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = self.start_counting(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_query_counter.reset(token)
+        return self.report(request, response)
+
+    async def __acall__(self, request):
+        token = self.start_counting(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_query_counter.reset(token)
+        return self.report(request, response)
+
+    def start_counting(self, request):
+        request.query_counter = QueryCounter(keep_queries=self.threshold is not None)
+        return current_query_counter.set(request.query_counter)
+
+    def report(self, request, response):
+        counter = request.query_counter
+        if settings.SERVER_TIMING:
+            response["Server-Timing"] = (
+                f'db;dur={counter.duration * 1000:.2f};desc="{counter.count} queries", '
+                f"db-slowest;dur={counter.slowest * 1000:.2f}"
+            )
+        if self.threshold is not None and counter.duration > self.threshold:
+            query_logger.warning(
+                "%s %s spent %.2f ms in %s queries", request.method, request.path,
+                counter.duration * 1000, counter.count,
+                extra={
+                    "view": get_view_name(request),
+                    "queries": counter.count,
+                    "db_ms": round(counter.duration * 1000, 2),
+                    "sql": counter.queries,
+                }
+            )
+        return response
+
+
+class RequestLogMiddleware(SyncAndAsyncMiddleware):
+    """
+    Log one 'crm.requests' record per request, with the view, the user, the status, the number of queries and the
+    time spent in the database as fields (see the JSON formatter in crm/logs.py).
+    Must come before QueryTimingMiddleware, which counts the queries.
+    """
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.log(request, response, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.log(request, response, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def log(request, response, duration):
+        counter = getattr(request, "query_counter", None)
+        request_logger.info(
+            "%s %s %s", request.method, request.path, response.status_code,
+            extra={
+                "view": get_view_name(request),
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "user_id": get_loaded_user_id(request),
+                "duration_ms": round(duration * 1000, 2),
+                "queries": counter.count if counter else None,
+                "db_ms": round(counter.duration * 1000, 2) if counter else None,
+            }
+        )
+
+
+class MetricsMiddleware(SyncAndAsyncMiddleware):
+    """
+    Record the latency, the number of queries and the time spent in the database of every request, per view class
+    (see crm/metrics.py). Must come before QueryTimingMiddleware, which counts the queries.
+    """
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def record(request, duration):
+        view = get_view_path(request)[1] or "none"
+        REQUEST_LATENCY.observe(duration, view, request.method)
+        counter = getattr(request, "query_counter", None)
+        if counter is not None:
+            REQUEST_QUERIES.observe(counter.count, view)
+            REQUEST_DB_TIME.inc(view, amount=counter.duration)
+
+
+class ReplicaRoutingMiddleware(SyncAndAsyncMiddleware):
+    """
+    Send all the reads of a safe request (GET, HEAD, OPTIONS) to the same replica, picked in weighted round-robin,
+    except for a user who just wrote : their reads stick to the primary for a while, so they don't read stale data
+    from a replica which has not caught up yet (see crm/routers.py). Must come after AuthenticationMiddleware.
+    Without replicas, the user is not even loaded.
+    """
+    safe_methods = ("GET", "HEAD", "OPTIONS")
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = read_database.set(self.get_read_database(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            read_database.reset(token)
+        self.after_response(request)
+        return response
+
+    async def __acall__(self, request):
+        if settings.DATABASE_REPLICAS:
+            # loading the user queries the database
+            database = await database_sync_to_async(self.get_read_database)(request)
+        else:
+            database = DEFAULT_DB_ALIAS
+        token = read_database.set(database)
+        try:
+            response = await self.get_response(request)
+        finally:
+            read_database.reset(token)
+        if settings.DATABASE_REPLICAS and request.method not in self.safe_methods:
+            await database_sync_to_async(self.after_response)(request)
+        return response
+
+    def get_read_database(self, request):
+        if not settings.DATABASE_REPLICAS or request.method not in self.safe_methods:
+            return DEFAULT_DB_ALIAS
+        if request.user.is_authenticated and is_stuck_to_primary(request.user):
+            return DEFAULT_DB_ALIAS
+        return next_replica()
+
+    def after_response(self, request):
+        if settings.DATABASE_REPLICAS and request.method not in self.safe_methods and request.user.is_authenticated:
+            stick_to_primary(request.user)
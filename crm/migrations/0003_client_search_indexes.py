@@ -0,0 +1,41 @@
+"""
+Trigram GIN indexes for the '?search=' filter of the client, contract and event lists.
+Django turns 'icontains' into 'UPPER(column::text) LIKE UPPER(%term%)' on PostgreSQL, so the indexes are built on
+that exact expression. Other database backends don't get (or need) them.
+"""
+
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+SEARCH_INDEXED_COLUMNS = ("first_name", "last_name", "email")
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for column in SEARCH_INDEXED_COLUMNS:
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS crm_client_{column}_trgm_idx "
+            f"ON crm_client USING gin (UPPER({column}::text) gin_trgm_ops);"
+        )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for column in SEARCH_INDEXED_COLUMNS:
+        schema_editor.execute(f"DROP INDEX IF EXISTS crm_client_{column}_trgm_idx;")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crm", "0002_generate_groups"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
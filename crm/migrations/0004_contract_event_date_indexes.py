@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0003_client_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='contract',
+            name='date_created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='contract',
+            name='payment_due',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='event',
+            name='end_date',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='event',
+            name='start_date',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:09
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def check_unique_references(apps, schema_editor):
+    """ Stop before adding the unique constraint if contracts share a reference, listing them to rename by hand. """
+    Contract = apps.get_model("crm", "Contract")
+    shared = Contract.objects.values("reference").annotate(count=Count("id")).filter(count__gt=1).values("reference")
+    duplicates = {}
+    for pk, reference in (
+        Contract.objects.filter(reference__in=shared).order_by("reference", "pk").values_list("pk", "reference")
+    ):
+        duplicates.setdefault(reference, []).append(str(pk))
+    if duplicates:
+        raise RuntimeError(
+            "Contract references must be unique, rename the contracts sharing one before migrating :\n"
+            + "\n".join(f"  - '{reference}' : contracts {', '.join(pks)}" for reference, pks in duplicates.items())
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0004_contract_event_date_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_unique_references, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='client',
+            name='email',
+            field=models.EmailField(db_index=True, max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='contract',
+            name='reference',
+            field=models.CharField(max_length=20, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='contractstatus',
+            name='contract',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='status', to='crm.contract'),
+        ),
+        migrations.AddIndex(
+            model_name='contractstatus',
+            index=models.Index(fields=['contract', 'state'], name='crm_status_contract_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contractstatus',
+            index=models.Index(condition=models.Q(('is_accepted', True), models.Q(('state', 'E'), _negated=True)), fields=['contract'], name='crm_status_active_idx'),
+        ),
+    ]
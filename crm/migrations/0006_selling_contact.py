@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_selling_contacts(apps, schema_editor):
+    Client = apps.get_model("crm", "Client")
+    Contract = apps.get_model("crm", "Contract")
+    Event = apps.get_model("crm", "Event")
+
+    Contract.objects.update(selling_contact_id=models.Subquery(
+        Client.objects.filter(pk=models.OuterRef("client_id")).values("contact_id")[:1]
+    ))
+    Event.objects.update(selling_contact_id=models.Subquery(
+        Contract.objects.filter(pk=models.OuterRef("contract_id")).values("selling_contact_id")[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0005_indexes_and_unique_reference'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contract',
+            name='selling_contact',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='sold_contracts', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='selling_contact',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='sold_events', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(fill_selling_contacts, migrations.RunPython.noop),
+    ]
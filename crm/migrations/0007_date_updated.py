@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0006_selling_contact'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='date_updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='contractstatus',
+            name='date_updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='date_updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AlterField(
+            model_name='contract',
+            name='date_updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:34
+
+from django.db import migrations, models
+
+
+def fill_current_statuses(apps, schema_editor):
+    Contract = apps.get_model("crm", "Contract")
+    ContractStatus = apps.get_model("crm", "ContractStatus")
+
+    latest_status = ContractStatus.objects.filter(contract=models.OuterRef("pk")).order_by("-pk")
+    Contract.objects.update(
+        current_is_accepted=models.Subquery(latest_status.values("is_accepted")[:1]),
+        current_state=models.Subquery(latest_status.values("state")[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0007_date_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contract',
+            name='current_is_accepted',
+            field=models.BooleanField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='contract',
+            name='current_state',
+            field=models.CharField(choices=[('S', 'Started'), ('P', 'Paused'), ('E', 'Ended')], editable=False, max_length=1, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='contract',
+            index=models.Index(fields=['current_state', 'current_is_accepted'], name='crm_contract_current_idx'),
+        ),
+        migrations.RunPython(fill_current_statuses, migrations.RunPython.noop),
+    ]
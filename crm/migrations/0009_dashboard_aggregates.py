@@ -0,0 +1,73 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0008_contract_current_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(db_index=True)),
+                ('contracts', models.IntegerField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('signed_contracts', models.IntegerField()),
+                ('signed_amount', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('date_updated', models.DateTimeField(auto_now=True)),
+                ('selling_contact', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Monthly sales',
+                'verbose_name_plural': 'Monthly sales',
+            },
+        ),
+        migrations.CreateModel(
+            name='MonthlyEventLoad',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(db_index=True)),
+                ('events', models.IntegerField()),
+                ('attendees', models.IntegerField()),
+                ('hours', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('date_updated', models.DateTimeField(auto_now=True)),
+                ('support_contact', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Monthly event load',
+                'verbose_name_plural': 'Monthly event load',
+            },
+        ),
+        migrations.CreateModel(
+            name='ClientSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('contracts', models.IntegerField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('signed_contracts', models.IntegerField()),
+                ('signed_amount', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('date_updated', models.DateTimeField(auto_now=True)),
+                ('client', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sales', to='crm.client')),
+                ('selling_contact', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Client sales',
+                'verbose_name_plural': 'Client sales',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='monthlysales',
+            constraint=models.UniqueConstraint(fields=('selling_contact', 'month'), name='crm_monthly_sales_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyeventload',
+            constraint=models.UniqueConstraint(fields=('support_contact', 'month'), name='crm_monthly_event_load_unique'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+"""
+GiST index of the support contacts schedules, for the conflict checks and the availability of the support team.
+'EventQuerySet.overlapping()' compares 'tstzrange(start_date, end_date)' periods on PostgreSQL, so the index is built
+on that exact expression (btree_gist indexes the support contact in the same GiST index). It is not an exclusion
+constraint : existing events may overlap, only new schedules are checked. Other database backends don't get it,
+their overlap condition uses the start_date and end_date indexes.
+"""
+
+
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations
+
+
+def create_schedule_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS crm_event_schedule_idx "
+        "ON crm_event USING gist (support_contact_id, TSTZRANGE(start_date, end_date));"
+    )
+
+
+def drop_schedule_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS crm_event_schedule_idx;")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crm", "0009_dashboard_aggregates"),
+    ]
+
+    operations = [
+        BtreeGistExtension(),
+        migrations.RunPython(create_schedule_index, drop_schedule_index),
+    ]
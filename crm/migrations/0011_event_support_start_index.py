@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0010_event_schedule_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['support_contact', 'start_date'], name='crm_event_support_start_idx'),
+        ),
+        migrations.AlterField(
+            model_name='event',
+            name='support_contact',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='events', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
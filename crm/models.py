@@ -1,7 +1,9 @@
-from django.db import models
+from django.db import connections, models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.core.validators import RegexValidator
 from django.core.exceptions import ValidationError
+from django.contrib.postgres.fields import DateTimeRangeField
+from psycopg2.extras import DateTimeTZRange
 
 
 class UserManager(BaseUserManager):
@@ -68,6 +70,34 @@ class User(AbstractBaseUser, PermissionsMixin):
         return f"{self.first_name} {self.last_name} ({self.email})"
 
 
+STATE_CHOICES = (
+    ("S", "Started"),
+    ("P", "Paused"),
+    ("E", "Ended"),
+)
+
+
+class OwnedQuerySet(models.QuerySet):
+    """ Queryset able to select the records of a teammate, through the indexed columns listed in 'owner_fields'. """
+    def owned_by(self, user):
+        condition = models.Q()
+        for owner_field in self.model.owner_fields:
+            condition |= models.Q(**{owner_field: user})
+        return self.filter(condition)
+
+
+class EventQuerySet(OwnedQuerySet):
+    def overlapping(self, start, end):
+        """
+        Select the events sharing some time with the [start, end) period. On PostgreSQL, the condition is written on
+        the 'tstzrange(start_date, end_date)' period, so that it uses the GiST index of the support contacts schedules.
+        """
+        if connections[self.db].vendor == "postgresql":
+            period = models.Func("start_date", "end_date", function="TSTZRANGE", output_field=DateTimeRangeField())
+            return self.alias(period=period).filter(period__overlap=DateTimeTZRange(start, end))
+        return self.filter(start_date__lt=end, end_date__gt=start)
+
+
 class Client(models.Model):
 
     class Meta:
@@ -77,11 +107,15 @@ class Client(models.Model):
     phone_number_regex = RegexValidator(regex=r"0\d{9}")
     first_name = models.CharField(max_length=50)
     last_name = models.CharField(max_length=50)
-    email = models.EmailField(max_length=50)
+    email = models.EmailField(max_length=50, db_index=True)
     phone = models.CharField(validators=[phone_number_regex], max_length=10, blank=True, null=True)
     mobile = models.CharField(validators=[phone_number_regex], max_length=10, blank=True, null=True)
     company_name = models.CharField(max_length=50)
     contact = models.ForeignKey(to="User", on_delete=models.DO_NOTHING, related_name="clients")
+    date_updated = models.DateTimeField(auto_now=True)
+
+    objects = OwnedQuerySet.as_manager()
+    owner_fields = ("contact",)
 
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.company_name})"
@@ -97,13 +131,26 @@ class Contract(models.Model):
     class Meta:
         verbose_name = "Contract"
         verbose_name_plural = "Contracts"
+        indexes = [
+            models.Index(fields=["current_state", "current_is_accepted"], name="crm_contract_current_idx"),
+        ]
 
-    reference = models.CharField(max_length=20)
+    reference = models.CharField(max_length=20, unique=True)
     amount = models.DecimalField(max_digits=9, decimal_places=2)
-    date_created = models.DateTimeField(auto_now_add=True)
-    date_updated = models.DateTimeField(auto_now_add=True)
-    payment_due = models.DateTimeField()
+    date_created = models.DateTimeField(auto_now_add=True, db_index=True)
+    date_updated = models.DateTimeField(auto_now=True)
+    payment_due = models.DateTimeField(db_index=True)
     client = models.ForeignKey(to="Client", on_delete=models.CASCADE, related_name="contracts")
+    # denormalized 'client.contact', kept in sync by crm/signals.py
+    selling_contact = models.ForeignKey(
+        to="User", on_delete=models.DO_NOTHING, related_name="sold_contracts", null=True, editable=False
+    )
+    # denormalized 'is_accepted' and 'state' of the latest status, kept in sync by crm/signals.py (null without status)
+    current_is_accepted = models.BooleanField(null=True, editable=False)
+    current_state = models.CharField(max_length=1, choices=STATE_CHOICES, null=True, editable=False)
+
+    objects = OwnedQuerySet.as_manager()
+    owner_fields = ("selling_contact",)
 
     def __str__(self):
         return f"{self.reference}"
@@ -114,17 +161,25 @@ class ContractStatus(models.Model):
     class Meta:
         verbose_name = "Contract Status"
         verbose_name_plural = "Contract Status"
-
-    STATE_CHOICES = (
-        ("S", "Started"),
-        ("P", "Paused"),
-        ("E", "Ended"),
-    )
+        indexes = [
+            models.Index(fields=["contract", "state"], name="crm_status_contract_state_idx"),
+            models.Index(
+                fields=["contract"], name="crm_status_active_idx",
+                condition=models.Q(is_accepted=True) & ~models.Q(state="E")
+            ),
+        ]
+
+    STATE_CHOICES = STATE_CHOICES
     is_accepted = models.BooleanField()
     acceptance_note = models.TextField(max_length=2000)
     state = models.CharField(max_length=1, choices=STATE_CHOICES)
     state_note = models.TextField(max_length=2000)
-    contract = models.ForeignKey(to="Contract", on_delete=models.CASCADE, related_name="status")
+    # indexed as the first column of 'crm_status_contract_state_idx'
+    contract = models.ForeignKey(to="Contract", on_delete=models.CASCADE, related_name="status", db_index=False)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    objects = OwnedQuerySet.as_manager()
+    owner_fields = ("contract__selling_contact",)
 
     def __str__(self):
         return f"{'☑' if self.is_accepted else '☒'} {self.contract.reference} ({self.state})"
@@ -135,14 +190,27 @@ class Event(models.Model):
     class Meta:
         verbose_name = "Event"
         verbose_name_plural = "Events"
+        indexes = [
+            # calendars : the events of a support contact in a window, in start order
+            models.Index(fields=["support_contact", "start_date"], name="crm_event_support_start_idx"),
+        ]
 
     name = models.CharField(max_length=100)
     attendees = models.IntegerField()
-    start_date = models.DateTimeField()
-    end_date = models.DateTimeField()
+    start_date = models.DateTimeField(db_index=True)
+    end_date = models.DateTimeField(db_index=True)
     note = models.TextField(max_length=2000)
     contract = models.ForeignKey(to="Contract", on_delete=models.CASCADE, related_name="events")
-    support_contact = models.ForeignKey(to="User", on_delete=models.DO_NOTHING, related_name="events")
+    # indexed as the first column of 'crm_event_support_start_idx'
+    support_contact = models.ForeignKey(to="User", on_delete=models.DO_NOTHING, related_name="events", db_index=False)
+    date_updated = models.DateTimeField(auto_now=True)
+    # denormalized 'contract.client.contact', kept in sync by crm/signals.py
+    selling_contact = models.ForeignKey(
+        to="User", on_delete=models.DO_NOTHING, related_name="sold_events", null=True, editable=False
+    )
+
+    objects = EventQuerySet.as_manager()
+    owner_fields = ("selling_contact", "support_contact")
 
     def __str__(self):
         if self.start_date.date() == self.end_date.date():
@@ -150,3 +218,70 @@ class Event(models.Model):
             return f"{self.name} ({start.date()}, {start:%H:%M} to {end:%H:%M}) : {self.attendees} attendees"
         else:
             return f"{self.name} ({self.start_date.date()} to {self.end_date.date()}) : {self.attendees} attendees"
+
+
+# DASHBOARD AGGREGATES --------------------------------------------------------
+# Summary tables read by the dashboard endpoints, refreshed from the contracts, their status and the events by
+# crm/aggregates.py (incrementally by crm/signals.py, wholly by the 'refresh_dashboard' command).
+
+class MonthlySales(models.Model):
+
+    class Meta:
+        verbose_name = "Monthly sales"
+        verbose_name_plural = "Monthly sales"
+        constraints = [
+            models.UniqueConstraint(fields=["selling_contact", "month"], name="crm_monthly_sales_unique"),
+        ]
+
+    # month of the creation of the contracts
+    month = models.DateField(db_index=True)
+    selling_contact = models.ForeignKey(to="User", on_delete=models.CASCADE, related_name="+", db_index=False)
+    contracts = models.IntegerField()
+    amount = models.DecimalField(max_digits=15, decimal_places=2)
+    # contracts whose current status is accepted
+    signed_contracts = models.IntegerField()
+    signed_amount = models.DecimalField(max_digits=15, decimal_places=2)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.selling_contact_id} {self.month:%Y-%m} : {self.signed_amount} / {self.amount}"
+
+
+class ClientSales(models.Model):
+
+    class Meta:
+        verbose_name = "Client sales"
+        verbose_name_plural = "Client sales"
+
+    client = models.OneToOneField(to="Client", on_delete=models.CASCADE, related_name="sales")
+    selling_contact = models.ForeignKey(to="User", on_delete=models.CASCADE, related_name="+")
+    contracts = models.IntegerField()
+    amount = models.DecimalField(max_digits=15, decimal_places=2)
+    # contracts whose current status is accepted
+    signed_contracts = models.IntegerField()
+    signed_amount = models.DecimalField(max_digits=15, decimal_places=2)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.client_id} : {self.signed_amount} / {self.amount}"
+
+
+class MonthlyEventLoad(models.Model):
+
+    class Meta:
+        verbose_name = "Monthly event load"
+        verbose_name_plural = "Monthly event load"
+        constraints = [
+            models.UniqueConstraint(fields=["support_contact", "month"], name="crm_monthly_event_load_unique"),
+        ]
+
+    # month of the start of the events
+    month = models.DateField(db_index=True)
+    support_contact = models.ForeignKey(to="User", on_delete=models.CASCADE, related_name="+", db_index=False)
+    events = models.IntegerField()
+    attendees = models.IntegerField()
+    hours = models.DecimalField(max_digits=12, decimal_places=2)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.support_contact_id} {self.month:%Y-%m} : {self.events} events, {self.hours} hours"
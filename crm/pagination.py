@@ -0,0 +1,74 @@
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .filters import SEARCH_RANK, TRUE_VALUES
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination on the primary key : every page is a 'WHERE id > x ORDER BY id LIMIT n' query, so fetching
+    the N-th page costs as much as fetching the first one (no OFFSET scan).
+    The total number of rows is only counted when the client asks for it with '?count=true'.
+    Ranked searches (see 'TrigramSearchFilter') are paged with an '?offset=' instead : a cursor on their rank, a
+    computed value shared by many rows, would walk the rows of a same rank with an offset DRF caps at 1000 rows,
+    repeating pages past it. Search results are only browsed on their first pages, where an offset is cheap.
+    """
+    ordering = "id"
+    page_size_query_param = "page_size"
+    max_page_size = settings.API_MAX_PAGE_SIZE
+    count_query_param = "count"
+    offset_query_param = "offset"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param, "").lower() in TRUE_VALUES:
+            self.count = queryset.count()
+        self.ranked = SEARCH_RANK in queryset.query.annotations
+        if self.ranked:
+            return self.paginate_ranked_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def paginate_ranked_queryset(self, queryset, request, view):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = remove_query_param(request.build_absolute_uri(), self.cursor_query_param)
+        try:
+            self.offset = max(int(request.query_params.get(self.offset_query_param, 0)), 0)
+        except ValueError:
+            self.offset = 0
+        queryset = queryset.order_by(*self.get_ordering(request, queryset, view))
+        rows = list(queryset[self.offset:self.offset + self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        return rows[:self.page_size]
+
+    def get_next_link(self):
+        if not self.ranked:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        return replace_query_param(self.base_url, self.offset_query_param, self.offset + self.page_size)
+
+    def get_previous_link(self):
+        if not self.ranked:
+            return super().get_previous_link()
+        if not self.offset:
+            return None
+        previous_offset = max(self.offset - self.page_size, 0)
+        if not previous_offset:
+            return remove_query_param(self.base_url, self.offset_query_param)
+        return replace_query_param(self.base_url, self.offset_query_param, previous_offset)
+
+    def get_paginated_response(self, data):
+        content = [
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+        ]
+        if self.count is not None:
+            content.append(("count", self.count))
+        content.append(("results", data))
+        return Response(OrderedDict(content))
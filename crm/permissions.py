@@ -1,5 +1,33 @@
+from functools import wraps
+
 from rest_framework.permissions import BasePermission
 from .constants import SELLING_TEAM_NAME, SUPPORT_TEAM_NAME
+from .metrics import PERMISSION_DENIALS
+from .teams import is_team_member
+
+
+# COUNTED PERMISSION ----------------------------------------------------------
+
+def count_denials(check, permission_name):
+    @wraps(check)
+    def counted_check(*args):
+        allowed = check(*args)
+        if not allowed:
+            PERMISSION_DENIALS.inc(permission_name)
+        return allowed
+    return counted_check
+
+
+class CountedPermission(BasePermission):
+    """
+    Base of the team permissions : every refusal of 'has_permission' or 'has_object_permission' is counted per
+    permission class in the metrics (see crm/metrics.py).
+    """
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for check_name in ("has_permission", "has_object_permission"):
+            if check_name in cls.__dict__:
+                setattr(cls, check_name, count_denials(cls.__dict__[check_name], cls.__name__))
 
 
 # SUPER USER PERMISSION -------------------------------------------------------
@@ -14,7 +42,7 @@ class IsSuperUser(BasePermission):
 
 # CLIENT PERMISSIONS ----------------------------------------------------------
 
-class ClientListPermission(BasePermission):
+class ClientListPermission(CountedPermission):
     def has_permission(self, request, view):
         user = request.user
         method = request.method
@@ -23,13 +51,13 @@ class ClientListPermission(BasePermission):
             return True
 
         if method == "POST":
-            if user.groups.filter(name=SELLING_TEAM_NAME).exists():
+            if is_team_member(user, SELLING_TEAM_NAME):
                 return True
 
         return False
 
 
-class ClientDetailPermission(BasePermission):
+class ClientDetailPermission(CountedPermission):
     def has_permission(self, request, view):
         user = request.user
         method = request.method
@@ -38,7 +66,7 @@ class ClientDetailPermission(BasePermission):
             return True
 
         if method == "PUT":
-            return user.groups.filter(name=SELLING_TEAM_NAME).exists()
+            return is_team_member(user, SELLING_TEAM_NAME)
 
         return False
 
@@ -51,12 +79,12 @@ class ClientDetailPermission(BasePermission):
             return True
 
         if method == "PUT":
-            return user == client.contact
+            return user.id == client.contact_id
 
 
 # CONTRACT PERMISSIONS --------------------------------------------------------
 
-class ContractListPermission(BasePermission):
+class ContractListPermission(CountedPermission):
     def has_permission(self, request, view):
         user = request.user
         method = request.method
@@ -65,12 +93,12 @@ class ContractListPermission(BasePermission):
             return True
 
         if method == "POST":
-            return user.groups.filter(name=SELLING_TEAM_NAME).exists()
+            return is_team_member(user, SELLING_TEAM_NAME)
 
         return False
 
 
-class ContractDetailPermission(BasePermission):
+class ContractDetailPermission(CountedPermission):
     def has_permission(self, request, view):
         user = request.user
         method = request.method
@@ -79,7 +107,7 @@ class ContractDetailPermission(BasePermission):
             return True
 
         if method == "PUT":
-            return user.groups.filter(name=SELLING_TEAM_NAME).exists()
+            return is_team_member(user, SELLING_TEAM_NAME)
 
         return False
 
@@ -92,14 +120,14 @@ class ContractDetailPermission(BasePermission):
             return True
 
         if method == "PUT":
-            return user == contract.client.contact
+            return user.id == contract.selling_contact_id
 
         return False
 
 
 # CONTRACT STATUS PERMISSION --------------------------------------------------
 
-class ContractStatusListPermission(BasePermission):
+class ContractStatusListPermission(CountedPermission):
     def has_permission(self, request, view):
         user = request.user
         method = request.method
@@ -108,12 +136,12 @@ class ContractStatusListPermission(BasePermission):
             return True
 
         if method == "POST":
-            return user.groups.filter(name=SELLING_TEAM_NAME).exists()
+            return is_team_member(user, SELLING_TEAM_NAME)
 
         return False
 
 
-class ContractStatusDetailPermission(BasePermission):
+class ContractStatusDetailPermission(CountedPermission):
     def has_permission(self, request, view):
         user = request.user
         method = request.method
@@ -122,7 +150,7 @@ class ContractStatusDetailPermission(BasePermission):
             return True
 
         if method == "PUT":
-            return user.groups.filter(name=SELLING_TEAM_NAME).exists()
+            return is_team_member(user, SELLING_TEAM_NAME)
 
         return False
 
@@ -135,14 +163,14 @@ class ContractStatusDetailPermission(BasePermission):
             return True
 
         if method == "PUT":
-            return user == contract_status.contract.client.contact
+            return user.id == contract_status.contract.selling_contact_id
 
         return False
 
 
 # EVENT PERMISSIONS -----------------------------------------------------------
 
-class EventListPermission(BasePermission):
+class EventListPermission(CountedPermission):
     def has_permission(self, request, view):
         user = request.user
         method = request.method
@@ -151,12 +179,12 @@ class EventListPermission(BasePermission):
             return True
 
         if method == "POST":
-            return user.groups.filter(name__in=(SELLING_TEAM_NAME, SUPPORT_TEAM_NAME)).exists()
+            return is_team_member(user, SELLING_TEAM_NAME, SUPPORT_TEAM_NAME)
 
         return False
 
 
-class EventDetailPermission(BasePermission):
+class EventDetailPermission(CountedPermission):
     def has_permission(self, request, view):
         user = request.user
         method = request.method
@@ -165,7 +193,7 @@ class EventDetailPermission(BasePermission):
             return True
 
         if method == "PUT":
-            return user.groups.filter(name__in=(SELLING_TEAM_NAME, SUPPORT_TEAM_NAME)).exists()
+            return is_team_member(user, SELLING_TEAM_NAME, SUPPORT_TEAM_NAME)
 
         return False
 
@@ -178,6 +206,35 @@ class EventDetailPermission(BasePermission):
             return True
 
         if method == "PUT":
-            return user == event.contract.client.contact or user == event.support_contact
+            return user.id in (event.selling_contact_id, event.support_contact_id)
 
         return False
+
+
+# BULK PERMISSIONS ------------------------------------------------------------
+# The team is checked once for the whole batch. The objects a bulk PUT targets are then restricted with a single
+# query on the queryset given to 'filter_editable()', instead of checking every object one by one.
+
+class ContractBulkPermission(CountedPermission):
+    def has_permission(self, request, view):
+        return request.method in ("POST", "PUT") and is_team_member(request.user, SELLING_TEAM_NAME)
+
+    def filter_editable(self, request, queryset):
+        return queryset.filter(selling_contact=request.user)
+
+
+class ContractStatusBulkPermission(CountedPermission):
+    def has_permission(self, request, view):
+        return request.method in ("POST", "PUT") and is_team_member(request.user, SELLING_TEAM_NAME)
+
+    def filter_editable(self, request, queryset):
+        return queryset.filter(contract__selling_contact=request.user)
+
+
+class EventBulkPermission(CountedPermission):
+    def has_permission(self, request, view):
+        user = request.user
+        return request.method in ("POST", "PUT") and is_team_member(user, SELLING_TEAM_NAME, SUPPORT_TEAM_NAME)
+
+    def filter_editable(self, request, queryset):
+        return queryset.owned_by(request.user)
@@ -0,0 +1,70 @@
+from contextvars import ContextVar
+from functools import lru_cache
+from itertools import cycle
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+
+# Database of the reads of the current request, set by ReplicaRoutingMiddleware (see crm/middleware.py) : a replica
+# for the safe requests (GET, HEAD, OPTIONS). Management commands, migrations and writes always use the primary.
+read_database = ContextVar("read_database", default=DEFAULT_DB_ALIAS)
+
+PRIMARY_READS_CACHE_KEY = "crm:primary_reads:{}"
+
+
+def weighted_round_robin(weights):
+    """
+    Order of the replicas for one round, from their {alias: weight} dict, spreading the picks of every replica
+    over the round (smooth weighted round-robin) : {"a": 3, "b": 1} gives a, a, b, a.
+    """
+    total = sum(weights.values())
+    current = dict.fromkeys(weights, 0)
+    order = []
+    for _ in range(total):
+        for alias, weight in weights.items():
+            current[alias] += weight
+        alias = max(current, key=current.get)
+        current[alias] -= total
+        order.append(alias)
+    return order
+
+
+@lru_cache(maxsize=None)
+def get_replicas_cycle():
+    return cycle(weighted_round_robin(settings.DATABASE_REPLICAS))
+
+
+def next_replica():
+    """ Replica for the reads of the next request, the primary if there is no replica (or only zero weights). """
+    return next(get_replicas_cycle(), DEFAULT_DB_ALIAS)
+
+
+def stick_to_primary(user):
+    """ Send the reads of the user to the primary for DB_READ_YOUR_WRITES_WINDOW seconds, after a write. """
+    if settings.DATABASE_REPLICAS and settings.DB_READ_YOUR_WRITES_WINDOW:
+        cache.set(PRIMARY_READS_CACHE_KEY.format(user.id), True, settings.DB_READ_YOUR_WRITES_WINDOW)
+
+
+def is_stuck_to_primary(user):
+    return bool(settings.DATABASE_REPLICAS) and cache.get(PRIMARY_READS_CACHE_KEY.format(user.id), False)
+
+
+class ReplicaRouter:
+    """
+    Send the reads to the database chosen for the request (a replica of DATABASE_REPLICAS for the safe requests),
+    everything else to the primary ('default') database. Replicas hold the same data, so relations are allowed
+    between all the databases, and migrations only run on the primary.
+    """
+    def db_for_read(self, model, **hints):
+        return read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -1,7 +1,52 @@
-from rest_framework.serializers import ModelSerializer, ValidationError, SlugRelatedField
+import decimal
+from collections import defaultdict
+from functools import lru_cache
 
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Q
+from rest_framework import ISO_8601, fields
+from rest_framework.relations import PrimaryKeyRelatedField, RelatedField
+from rest_framework.serializers import ModelSerializer, Serializer, ValidationError, SlugRelatedField
+from rest_framework.settings import api_settings
+
+from .aggregates import lock_owners
 from .constants import SELLING_TEAM_NAME, SUPPORT_TEAM_NAME
-from .models import Client, Contract, ContractStatus, Event, User
+from .metrics import CACHE_REQUESTS
+from .models import Client, ClientSales, Contract, ContractStatus, Event, MonthlyEventLoad, MonthlySales, User
+from .teams import get_team_member_ids, is_team_member
+
+
+# RELATED FIELDS --------------------------------------------------------------
+
+class PrefetchedRelatedFieldMixin:
+    """
+    Look the related object up in the 'prefetched' serializer context first : a {field name: {pk: object}} dict
+    that the bulk views fill with one query per field for the whole batch. Unknown keys get the usual lookup (and
+    its error message).
+    """
+    def to_internal_value(self, data):
+        prefetched = self.context.get("prefetched", {}).get(self.field_name)
+        if prefetched is not None and not isinstance(data, bool):
+            try:
+                return prefetched[int(data)]
+            except (KeyError, TypeError, ValueError):
+                pass
+        return super().to_internal_value(data)
+
+
+class PrefetchedPrimaryKeyRelatedField(PrefetchedRelatedFieldMixin, PrimaryKeyRelatedField):
+    pass
+
+
+class TeamMemberField(PrefetchedRelatedFieldMixin, SlugRelatedField):
+    """ A user referenced by its id, who must belong to the given team. """
+    def __init__(self, team_name, **kwargs):
+        self.team_name = team_name
+        super().__init__(slug_field="id", **kwargs)
+
+    def get_queryset(self):
+        return User.objects.filter(id__in=get_team_member_ids(self.team_name))
 
 
 # USER SERIALIZER -------------------------------------------------------------
@@ -15,10 +60,7 @@ class UserSerializer(ModelSerializer):
 # CLIENT SERIALIZER -----------------------------------------------------------
 
 class ClientSerializer(ModelSerializer):
-    contact = SlugRelatedField(
-        queryset=User.objects.filter(groups__name=SELLING_TEAM_NAME),
-        slug_field="id"
-    )
+    contact = TeamMemberField(SELLING_TEAM_NAME)
 
     class Meta:
         model = Client
@@ -27,7 +69,7 @@ class ClientSerializer(ModelSerializer):
     def validate_contact(self, value):
         """ Check if the contact is in the Selling Team. """
         user = value
-        if user.groups.filter(name=SELLING_TEAM_NAME).exists():
+        if is_team_member(user, SELLING_TEAM_NAME):
             return value
         raise ValidationError("The 'contact' must be a Selling Team member.")
 
@@ -35,30 +77,274 @@ class ClientSerializer(ModelSerializer):
 # CONTRACT SERIALIZER ---------------------------------------------------------
 
 class ContractSerializer(ModelSerializer):
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField
+
     class Meta:
         model = Contract
-        fields = "__all__"
+        exclude = ["selling_contact"]
 
 
 class ContractStatusSerializer(ModelSerializer):
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField
+
     class Meta:
         model = ContractStatus
         fields = "__all__"
 
 
+SCHEDULE_FIELDS = ("support_contact", "start_date", "end_date")
+SCHEDULE_CONFLICT_MESSAGE = "The support contact already has an event at that time."
+
+
 class EventSerializer(ModelSerializer):
-    support_contact = SlugRelatedField(
-        queryset=User.objects.filter(groups__name=SUPPORT_TEAM_NAME),
-        slug_field="id"
-    )
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField
+    support_contact = TeamMemberField(SUPPORT_TEAM_NAME)
 
     class Meta:
         model = Event
-        fields = "__all__"
+        exclude = ["selling_contact"]
 
     def validate_support_contact(self, value):
         """ Check if the contact is in the Selling Team. """
         user = value
-        if user.groups.filter(name=SUPPORT_TEAM_NAME).exists():
+        if is_team_member(user, SUPPORT_TEAM_NAME):
             return value
         raise ValidationError("The 'support_contact' must be a Support Team member.")
+
+    def validate(self, attrs):
+        """ Check that the event ends after it starts (its schedule is checked when it is saved). """
+        _, start_date, end_date = self.get_schedule(attrs)
+        if end_date <= start_date:
+            raise ValidationError({"end_date": "The event must end after it starts."})
+        return attrs
+
+    def save(self, **kwargs):
+        """
+        Check that the support contact has no other event meanwhile and save the event in one transaction, holding
+        the lock of the support contact : two requests can't book them at the same time. The bulk views check the
+        whole batch at once instead (see 'check_schedule_conflicts()').
+        """
+        with transaction.atomic():
+            support_contact, start_date, end_date = schedule = self.get_schedule(self.validated_data)
+            if self.schedule_changed(schedule):
+                lock_support_contacts([support_contact.pk, getattr(self.instance, "support_contact_id", None)])
+                conflicts = Event.objects.filter(support_contact=support_contact).overlapping(start_date, end_date)
+                if self.instance is not None:
+                    conflicts = conflicts.exclude(pk=self.instance.pk)
+                conflict = conflicts.values_list("pk", flat=True).first()
+                if conflict is not None:
+                    raise ValidationError({"support_contact": f"{SCHEDULE_CONFLICT_MESSAGE} (event {conflict})"})
+            return super().save(**kwargs)
+
+    def get_schedule(self, attrs):
+        """ Return the (support contact, start date, end date) of the event, once the attrs are applied. """
+        return tuple(attrs[name] if name in attrs else getattr(self.instance, name) for name in SCHEDULE_FIELDS)
+
+    def schedule_changed(self, schedule):
+        """ Only new or moved events are checked, so that events already overlapping can still be edited. """
+        return self.instance is None or schedule != tuple(getattr(self.instance, name) for name in SCHEDULE_FIELDS)
+
+
+def lock_support_contacts(support_contact_ids):
+    """
+    Lock the support contacts until the end of the transaction, to check and write their schedules alone. The
+    previous support contacts of the moved events are locked with them, since their event loads are refreshed too
+    (see crm/aggregates.py, which takes the same locks).
+    """
+    lock_owners(User, set(support_contact_ids) - {None})
+
+
+def check_schedule_conflicts(serializers, errors):
+    """
+    Check the schedules of a batch of validated events with one query : the events of the support contacts around
+    the periods of the batch are sorted with the new periods, then one pass finds every period overlapping another
+    (the one before it, or the furthest ending period started before it).
+    It has to run in the transaction writing the batch : it locks the support contacts of the batch first.
+    """
+    checked = []
+    for serializer, error in zip(serializers, errors):
+        if serializer is not None and not error:
+            schedule = serializer.get_schedule(serializer.validated_data)
+            if serializer.schedule_changed(schedule):
+                checked.append((serializer, error, schedule))
+    if not checked:
+        return
+
+    bounds = {}
+    for _, _, (support_contact, start_date, end_date) in checked:
+        first_start, last_end = bounds.get(support_contact.pk, (start_date, end_date))
+        bounds[support_contact.pk] = (min(first_start, start_date), max(last_end, end_date))
+    lock_support_contacts([*bounds, *(
+        serializer.instance.support_contact_id for serializer, _, _ in checked if serializer.instance is not None
+    )])
+    condition = Q()
+    for support_contact_id, (first_start, last_end) in bounds.items():
+        condition |= Q(support_contact=support_contact_id, start_date__lt=last_end, end_date__gt=first_start)
+    moved_ids = [serializer.instance.pk for serializer, _, _ in checked if serializer.instance is not None]
+    periods = defaultdict(list)
+    for support_contact_id, start_date, end_date in (
+        Event.objects.filter(condition).exclude(pk__in=moved_ids)
+        .values_list("support_contact_id", "start_date", "end_date")
+    ):
+        periods[support_contact_id].append((start_date, end_date, None))
+    for _, error, (support_contact, start_date, end_date) in checked:
+        periods[support_contact.pk].append((start_date, end_date, error))
+
+    for schedule in periods.values():
+        schedule.sort(key=lambda period: period[:2])
+        latest_end = None
+        for index, (start_date, end_date, error) in enumerate(schedule):
+            overlaps_previous = latest_end is not None and start_date < latest_end
+            overlaps_next = index + 1 < len(schedule) and schedule[index + 1][0] < end_date
+            if error is not None and (overlaps_previous or overlaps_next):
+                error.setdefault("support_contact", []).append(SCHEDULE_CONFLICT_MESSAGE)
+            latest_end = end_date if latest_end is None else max(latest_end, end_date)
+
+
+class PeriodSerializer(Serializer):
+    """ Period given by the '?start=' and '?end=' query parameters. """
+    start = fields.DateTimeField()
+    end = fields.DateTimeField()
+
+    def validate(self, attrs):
+        if attrs["end"] <= attrs["start"]:
+            raise ValidationError({"end": "The period must end after it starts."})
+        return attrs
+
+
+class EventDaySerializer(Serializer):
+    """ Events starting on one day, for the timeline. """
+    day = fields.DateField()
+    events = fields.IntegerField(source="event_count")
+    attendees = fields.IntegerField(source="total_attendees")
+    first_start = fields.DateTimeField()
+    last_end = fields.DateTimeField()
+
+
+# DASHBOARD SERIALIZERS -------------------------------------------------------
+
+class MonthlySalesSerializer(ModelSerializer):
+    class Meta:
+        model = MonthlySales
+        fields = "__all__"
+
+
+class MonthTotalSerializer(Serializer):
+    """ Sales of all the selling contacts for one month. """
+    month = fields.DateField()
+    contracts = fields.IntegerField()
+    amount = fields.DecimalField(max_digits=15, decimal_places=2)
+    signed_contracts = fields.IntegerField()
+    signed_amount = fields.DecimalField(max_digits=15, decimal_places=2)
+
+
+class ClientSalesSerializer(ModelSerializer):
+    class Meta:
+        model = ClientSales
+        fields = "__all__"
+
+
+class MonthlyEventLoadSerializer(ModelSerializer):
+    class Meta:
+        model = MonthlyEventLoad
+        fields = "__all__"
+
+
+# VALUES SERIALIZER -----------------------------------------------------------
+
+def iso_datetime_converter(field):
+    """
+    Return a function rendering datetimes like 'field.to_representation()', with the timezone resolved once
+    instead of once per value. Fields with a custom format or timezone keep their own method.
+    """
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    field_timezone = getattr(field, "timezone", field.default_timezone())
+    if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        value = value.astimezone(field_timezone).isoformat()
+        if value.endswith("+00:00"):
+            value = value[:-6] + "Z"
+        return value
+    return convert
+
+
+def decimal_converter(field):
+    """ Same as 'iso_datetime_converter()' for decimals : the quantize exponent and context are built once. """
+    coerce_to_string = getattr(field, "coerce_to_string", api_settings.COERCE_DECIMAL_TO_STRING)
+    if not coerce_to_string or field.localize or field.decimal_places is None:
+        return field.to_representation
+
+    exponent = decimal.Decimal(".1") ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+
+    def convert(value):
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        return "{:f}".format(value.quantize(exponent, rounding=field.rounding, context=context))
+    return convert
+
+
+class ValuesSerializer:
+    """
+    Read-only twin of a ModelSerializer, rendering '.values()' rows instead of model instances.
+    Its fields are compiled once from the serializer declaration : columns whose database value is already the
+    JSON value are copied as is, relations are read from their '<name>_id' column, and only the other fields
+    (decimals, dates...) are converted. The output is the same as the serializer's.
+    """
+    PASSTHROUGH_FIELDS = (
+        fields.BooleanField, fields.CharField, fields.ChoiceField, fields.EmailField, fields.IntegerField
+    )
+
+    def __init__(self, serializer_class):
+        serializer = serializer_class()
+        model_meta = serializer.Meta.model._meta
+        self.names, self.columns, self.fields = [], [], []
+
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if "." in field.source or field.source == "*":
+                raise ImproperlyConfigured(f"{serializer_class.__name__}.{name} can't be read from a column.")
+            if isinstance(field, RelatedField) and getattr(field, "slug_field", "id") not in ("id", "pk"):
+                raise ImproperlyConfigured(f"{serializer_class.__name__}.{name} isn't a primary key relation.")
+            self.names.append(name)
+            self.columns.append(model_meta.get_field(field.source).attname)
+            self.fields.append(field)
+
+    def get_converter(self, field):
+        """ Return the function converting a column value, or None if the value can be used as is. """
+        if isinstance(field, RelatedField) or type(field) in self.PASSTHROUGH_FIELDS:
+            return None
+        if isinstance(field, fields.DateTimeField):
+            return iso_datetime_converter(field)
+        if isinstance(field, fields.DecimalField):
+            return decimal_converter(field)
+        return field.to_representation
+
+    def iter_representation(self, rows):
+        compiled_fields = tuple(zip(self.names, self.columns, map(self.get_converter, self.fields)))
+        for row in rows:
+            yield {
+                name: row[column] if converter is None or row[column] is None else converter(row[column])
+                for name, column, converter in compiled_fields
+            }
+
+    def to_representation(self, rows):
+        return list(self.iter_representation(rows))
+
+
+@lru_cache(maxsize=None)
+def get_values_serializer(serializer_class):
+    return ValuesSerializer(serializer_class)
+
+
+def get_values_serializer_cache_requests():
+    cache_info = get_values_serializer.cache_info()
+    return {("values_serializer", "hit"): cache_info.hits, ("values_serializer", "miss"): cache_info.misses}
+
+
+CACHE_REQUESTS.add_callback(get_values_serializer_cache_requests)
@@ -0,0 +1,300 @@
+from django.contrib.auth.models import Group
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import OuterRef, Subquery
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from .aggregates import get_keys, refresh_monthly_event_load, refresh_sales, refresh_sales_of_contracts
+from .db import close_unusable_connections
+from .middleware import count_query
+from .models import User, Client, Contract, ContractStatus, Event
+from .teams import invalidate_team_directory, forget_user_teams
+
+
+# Sent by the bulk views around 'bulk_create()' and 'bulk_update()', which don't send pre_save and post_save.
+# Arguments : sender (the model), instances (the list of objects), created (True for a creation).
+pre_bulk_save = Signal()
+post_bulk_save = Signal()
+
+
+# CONNECTIONS -----------------------------------------------------------------
+
+@receiver(request_started)
+def check_connections_health(sender, **kwargs):
+    close_unusable_connections()
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    """ Count the queries of every connection in the counter of the current request (see crm/middleware.py). """
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+# TEAM DIRECTORY --------------------------------------------------------------
+# The cached directory is invalidated once the membership change is committed : invalidated before, it could be
+# filled again by a concurrent request with the membership of before the change, kept until TEAM_CACHE_TIMEOUT.
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        transaction.on_commit(invalidate_team_directory)
+        if isinstance(instance, User):
+            forget_user_teams(instance)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def team_changed(sender, **kwargs):
+    transaction.on_commit(invalidate_team_directory)
+
+
+# SELLING CONTACT -------------------------------------------------------------
+# 'Contract.selling_contact' and 'Event.selling_contact' copy the contact of the client, so that the records of a
+# teammate are found with one indexed column instead of a join up to the client.
+
+def fill_selling_contacts():
+    """ Set the missing selling contacts, for the rows inserted without signal (fixtures bulk loading). """
+    Contract.objects.filter(selling_contact__isnull=True).update(selling_contact_id=Subquery(
+        Client.objects.filter(pk=OuterRef("client_id")).values("contact_id")[:1]
+    ))
+    Event.objects.filter(selling_contact__isnull=True).update(selling_contact_id=Subquery(
+        Contract.objects.filter(pk=OuterRef("contract_id")).values("selling_contact_id")[:1]
+    ))
+
+
+@receiver(pre_save, sender=Contract)
+def set_contract_selling_contact(sender, instance, **kwargs):
+    instance.selling_contact_id = instance.client.contact_id
+
+
+@receiver(pre_save, sender=Event)
+def set_event_selling_contact(sender, instance, **kwargs):
+    instance.selling_contact_id = instance.contract.selling_contact_id
+
+
+@receiver(pre_bulk_save, sender=Contract)
+@receiver(pre_bulk_save, sender=Event)
+def set_bulk_selling_contacts(sender, instances, **kwargs):
+    set_selling_contact = set_contract_selling_contact if sender is Contract else set_event_selling_contact
+    for instance in instances:
+        set_selling_contact(sender, instance)
+
+
+@receiver(post_save, sender=Client)
+def client_contact_changed(sender, instance, created, raw, **kwargs):
+    if created or raw:
+        return
+    Contract.objects.filter(client=instance).exclude(selling_contact_id=instance.contact_id).update(
+        selling_contact_id=instance.contact_id
+    )
+    Event.objects.filter(contract__client=instance).exclude(selling_contact_id=instance.contact_id).update(
+        selling_contact_id=instance.contact_id
+    )
+
+
+@receiver(post_save, sender=Contract)
+def contract_client_changed(sender, instance, created, raw, **kwargs):
+    if created or raw:
+        return
+    Event.objects.filter(contract=instance).exclude(selling_contact_id=instance.selling_contact_id).update(
+        selling_contact_id=instance.selling_contact_id
+    )
+
+
+@receiver(post_bulk_save, sender=Contract)
+def bulk_contracts_client_changed(sender, instances, created, **kwargs):
+    if created:
+        return
+    Event.objects.filter(contract__in=instances).update(selling_contact_id=Subquery(
+        Contract.objects.filter(pk=OuterRef("contract_id")).values("selling_contact_id")[:1]
+    ))
+
+
+# CURRENT STATUS --------------------------------------------------------------
+# 'Contract.current_is_accepted' and 'Contract.current_state' copy the latest status (the one with the highest id)
+# of the contract, so that the contracts are filtered on their status without going through their status history.
+# The contract row is updated in the transaction writing the status, with its 'date_updated' (the contract answers
+# hold the current status, so their ETag has to change with it).
+
+def refresh_current_statuses(contracts=None, keep_dates=False):
+    """
+    Copy the latest status into the contracts of the queryset (all the contracts by default). The loaders keep the
+    'date_updated' of the contracts they load ('keep_dates').
+    """
+    latest_status = ContractStatus.objects.filter(contract=OuterRef("pk")).order_by("-pk")
+    contracts = Contract.objects.all() if contracts is None else contracts
+    values = {
+        "current_is_accepted": Subquery(latest_status.values("is_accepted")[:1]),
+        "current_state": Subquery(latest_status.values("state")[:1]),
+    }
+    if not keep_dates:
+        values["date_updated"] = timezone.now()
+    return contracts.update(**values)
+
+
+def remember_previous_contracts(statuses):
+    """ Keep the contract the statuses were attached to, to refresh it too if they move to another contract. """
+    previous_contracts = dict(
+        ContractStatus.objects.filter(pk__in=[status.pk for status in statuses if status.pk is not None])
+        .values_list("pk", "contract_id")
+    )
+    for status in statuses:
+        status.previous_contract_id = previous_contracts.get(status.pk)
+
+
+@receiver(pre_save, sender=ContractStatus)
+def contract_status_changing(sender, instance, raw, **kwargs):
+    if not raw and instance.pk is not None:
+        remember_previous_contracts([instance])
+
+
+@receiver(post_save, sender=ContractStatus)
+def contract_status_saved(sender, instance, created, **kwargs):
+    if created:
+        # the new status is the latest one
+        Contract.objects.filter(pk=instance.contract_id).update(
+            current_is_accepted=instance.is_accepted, current_state=instance.state, date_updated=timezone.now()
+        )
+    else:
+        contract_ids = {instance.contract_id, getattr(instance, "previous_contract_id", None)} - {None}
+        refresh_current_statuses(Contract.objects.filter(pk__in=contract_ids))
+
+
+@receiver(post_delete, sender=ContractStatus)
+def contract_status_deleted(sender, instance, **kwargs):
+    refresh_current_statuses(Contract.objects.filter(pk=instance.contract_id))
+
+
+@receiver(pre_bulk_save, sender=ContractStatus)
+def bulk_contract_statuses_changing(sender, instances, created, **kwargs):
+    if not created:
+        remember_previous_contracts(instances)
+
+
+@receiver(post_bulk_save, sender=ContractStatus)
+def bulk_contract_statuses_saved(sender, instances, **kwargs):
+    contract_ids = {status.contract_id for status in instances}
+    contract_ids.update(getattr(status, "previous_contract_id", None) for status in instances)
+    contract_ids.discard(None)
+    refresh_current_statuses(Contract.objects.filter(pk__in=contract_ids))
+
+
+# DASHBOARD AGGREGATES --------------------------------------------------------
+# The summary rows of crm/aggregates.py touched by a write are refreshed in the transaction of the write : the months
+# of the selling contacts and support contacts of the rows written, and their clients, before and after the write.
+# These receivers are connected after the ones above, so they read the selling contacts and current statuses already
+# updated.
+
+def remember_previous_values(model, instances, *fields):
+    """ Keep the values of the fields before the update, as 'previous_<field>' attributes of the instances. """
+    previous_values = {
+        row[0]: row[1:]
+        for row in model.objects.filter(pk__in=[instance.pk for instance in instances if instance.pk is not None])
+        .values_list("pk", *fields)
+    }
+    for instance in instances:
+        for field, value in zip(fields, previous_values.get(instance.pk, (None,) * len(fields))):
+            setattr(instance, f"previous_{field}", value)
+
+
+def refresh_contracts_sales(contracts):
+    refresh_sales(
+        get_keys((seller_id, contract.date_created) for contract in contracts for seller_id in (
+            contract.selling_contact_id, getattr(contract, "previous_selling_contact_id", None)
+        )),
+        [client_id for contract in contracts for client_id in (
+            contract.client_id, getattr(contract, "previous_client_id", None)
+        )]
+    )
+
+
+def refresh_events_load(events):
+    refresh_monthly_event_load(get_keys(pair for event in events for pair in (
+        (event.support_contact_id, event.start_date),
+        (getattr(event, "previous_support_contact_id", None), getattr(event, "previous_start_date", None)),
+    )))
+
+
+@receiver(pre_save, sender=Client)
+def client_sales_changing(sender, instance, raw, **kwargs):
+    if not raw and instance.pk is not None:
+        remember_previous_values(Client, [instance], "contact_id")
+
+
+@receiver(post_save, sender=Client)
+def client_sales_saved(sender, instance, created, raw, **kwargs):
+    previous_contact_id = getattr(instance, "previous_contact_id", None)
+    if not (created or raw) and previous_contact_id != instance.contact_id:
+        contract_dates = Contract.objects.filter(client=instance).values_list("date_created", flat=True)
+        refresh_sales(
+            get_keys((seller_id, date_created) for date_created in contract_dates
+                     for seller_id in (instance.contact_id, previous_contact_id)),
+            [instance.pk]
+        )
+
+
+@receiver(pre_save, sender=Contract)
+def contract_sales_changing(sender, instance, raw, **kwargs):
+    if not raw and instance.pk is not None:
+        remember_previous_values(Contract, [instance], "selling_contact_id", "client_id")
+
+
+@receiver(post_save, sender=Contract)
+@receiver(post_delete, sender=Contract)
+def contract_sales_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_contracts_sales([instance])
+
+
+@receiver(pre_bulk_save, sender=Contract)
+def bulk_contracts_sales_changing(sender, instances, created, **kwargs):
+    if not created:
+        remember_previous_values(Contract, instances, "selling_contact_id", "client_id")
+
+
+@receiver(post_bulk_save, sender=Contract)
+def bulk_contracts_sales_saved(sender, instances, **kwargs):
+    refresh_contracts_sales(instances)
+
+
+@receiver(post_save, sender=ContractStatus)
+@receiver(post_delete, sender=ContractStatus)
+def contract_status_sales_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_sales_of_contracts({instance.contract_id, getattr(instance, "previous_contract_id", None)})
+
+
+@receiver(post_bulk_save, sender=ContractStatus)
+def bulk_contract_statuses_sales_saved(sender, instances, **kwargs):
+    contract_ids = {status.contract_id for status in instances}
+    contract_ids.update(getattr(status, "previous_contract_id", None) for status in instances)
+    refresh_sales_of_contracts(contract_ids)
+
+
+@receiver(pre_save, sender=Event)
+def event_load_changing(sender, instance, raw, **kwargs):
+    if not raw and instance.pk is not None:
+        remember_previous_values(Event, [instance], "support_contact_id", "start_date")
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def event_load_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_events_load([instance])
+
+
+@receiver(pre_bulk_save, sender=Event)
+def bulk_events_load_changing(sender, instances, created, **kwargs):
+    if not created:
+        remember_previous_values(Event, instances, "support_contact_id", "start_date")
+
+
+@receiver(post_bulk_save, sender=Event)
+def bulk_events_load_saved(sender, instances, **kwargs):
+    refresh_events_load(instances)
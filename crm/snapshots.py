@@ -0,0 +1,75 @@
+import sqlite3
+from pathlib import Path
+
+from django.db import connection
+
+
+def get_snapshot_name():
+    """ Name of the snapshot of the database : a template database on PostgreSQL, a file next to it on SQLite. """
+    name = connection.settings_dict["NAME"]
+    return f"{name}_snapshot" if connection.vendor == "postgresql" else f"{name}.snapshot"
+
+
+def copy_sqlite_database(source, target):
+    """ Copy a SQLite database with the backup API (a consistent copy, even if the database is being used). """
+    with sqlite3.connect(source) as source_database, sqlite3.connect(target) as target_database:
+        source_database.backup(target_database)
+
+
+def snapshot_exists():
+    name = get_snapshot_name()
+    if connection.vendor == "postgresql":
+        with connection._nodb_cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s;", [name])
+            return cursor.fetchone() is not None
+    return Path(name).is_file()
+
+
+def check_vendor():
+    if connection.vendor not in ("postgresql", "sqlite"):
+        raise NotImplementedError(f"Snapshots are not available on {connection.vendor} databases.")
+
+
+def terminate_connections(cursor, database_name):
+    """ A database used as (or created from) a template can't have other sessions. """
+    cursor.execute(
+        "SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = %s AND pid <> pg_backend_pid();",
+        [database_name]
+    )
+
+
+def take_snapshot():
+    """
+    Save the current state of the database (schema and data) : 'CREATE DATABASE ... TEMPLATE' copies the files of
+    the database on PostgreSQL, the SQLite backup API copies the database file.
+    """
+    check_vendor()
+    name, snapshot_name = connection.settings_dict["NAME"], get_snapshot_name()
+    connection.close()
+    if connection.vendor == "postgresql":
+        quote_name = connection.ops.quote_name
+        with connection._nodb_cursor() as cursor:
+            cursor.execute(f"DROP DATABASE IF EXISTS {quote_name(snapshot_name)};")
+            terminate_connections(cursor, name)
+            cursor.execute(f"CREATE DATABASE {quote_name(snapshot_name)} TEMPLATE {quote_name(name)};")
+    else:
+        copy_sqlite_database(name, snapshot_name)
+    return snapshot_name
+
+
+def restore_snapshot():
+    """ Replace the database by its snapshot, in one copy of the snapshot files. """
+    check_vendor()
+    name, snapshot_name = connection.settings_dict["NAME"], get_snapshot_name()
+    if not snapshot_exists():
+        raise FileNotFoundError(f"There is no snapshot '{snapshot_name}' to restore.")
+    connection.close()
+    if connection.vendor == "postgresql":
+        quote_name = connection.ops.quote_name
+        with connection._nodb_cursor() as cursor:
+            terminate_connections(cursor, name)
+            cursor.execute(f"DROP DATABASE {quote_name(name)};")
+            cursor.execute(f"CREATE DATABASE {quote_name(name)} TEMPLATE {quote_name(snapshot_name)};")
+    else:
+        copy_sqlite_database(snapshot_name, name)
+    return snapshot_name
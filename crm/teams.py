@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .constants import SELLING_TEAM_NAME, SUPPORT_TEAM_NAME
+from .metrics import CACHE_REQUESTS
+from .models import User
+
+
+TEAM_NAMES = (SELLING_TEAM_NAME, SUPPORT_TEAM_NAME)
+TEAM_DIRECTORY_CACHE_KEY = "crm:team_directory"
+
+
+def get_team_directory():
+    """
+    Return the members of every team as a {team name: frozenset of user ids} dict.
+    The directory is built with a single query on the user/group table and kept in cache until a membership
+    changes (see crm/signals.py) or TEAM_CACHE_TIMEOUT expires.
+    """
+    directory = cache.get(TEAM_DIRECTORY_CACHE_KEY)
+    CACHE_REQUESTS.inc("team_directory", "miss" if directory is None else "hit")
+    if directory is None:
+        members = {team_name: set() for team_name in TEAM_NAMES}
+        memberships = User.groups.through.objects.filter(group__name__in=TEAM_NAMES)
+        for user_id, team_name in memberships.values_list("user_id", "group__name"):
+            members[team_name].add(user_id)
+        directory = {team_name: frozenset(user_ids) for team_name, user_ids in members.items()}
+        cache.set(TEAM_DIRECTORY_CACHE_KEY, directory, settings.TEAM_CACHE_TIMEOUT)
+    return directory
+
+
+def get_team_member_ids(*team_names):
+    """ Return the ids of the users belonging to any of the given teams (to any team if none is given). """
+    directory = get_team_directory()
+    return frozenset().union(*(directory[team_name] for team_name in team_names or TEAM_NAMES))
+
+
+def invalidate_team_directory():
+    cache.delete(TEAM_DIRECTORY_CACHE_KEY)
+
+
+def get_user_teams(user):
+    """
+    Return the names of the teams the user belongs to.
+    The answer is memoized on the user object, which lives as long as the request, so permission classes,
+    serializers and admin checks can all ask for it without querying the database again.
+    """
+    try:
+        return user._crm_teams
+    except AttributeError:
+        directory = get_team_directory()
+        user._crm_teams = frozenset(team_name for team_name, user_ids in directory.items() if user.id in user_ids)
+        return user._crm_teams
+
+
+def is_team_member(user, *team_names):
+    """ Check if the user belongs to at least one of the given teams. """
+    return not get_user_teams(user).isdisjoint(team_names)
+
+
+def forget_user_teams(user):
+    user.__dict__.pop("_crm_teams", None)
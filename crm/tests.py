@@ -1,3 +1,894 @@
-from django.test import TestCase
+import csv
+import importlib.util
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, APITestCase, force_authenticate
+
+from project import settings as settings_module
+
+from .aggregates import get_month, refresh_dashboard
+from .authentication import make_calendar_token
+from .constants import SUPPORT_TEAM_NAME
+from .filters import TrigramSearchFilter
+from .ical import escape_text, fold
+from .loader import DEMO_FIXTURES, FIXTURES_DIR, dump_fixture, load_demo_fixtures, load_fixtures
+from .metrics import Counter, Histogram, Registry
+from .models import User, Client, ClientSales, Contract, ContractStatus, Event, MonthlyEventLoad, MonthlySales
+from .pagination import KeysetPagination
+from .routers import get_replicas_cycle, next_replica, weighted_round_robin
+from .serializers import (
+    UserSerializer, ClientSerializer, ContractSerializer, ContractStatusSerializer, EventSerializer
+)
+from .signals import fill_selling_contacts, refresh_current_statuses
+from .snapshots import restore_snapshot, snapshot_exists, take_snapshot
+from .teams import get_team_member_ids
+from .views import ContractBulk, ContractDetail, ContractStatusDetail, EventDetail
+
+
+class CrmTestCase(APITestCase):
+    """ Demo fixtures, with the columns that 'loaddata' leaves empty filled, and a logged super user. """
+    fixtures = ["crm_user", "crm_client", "crm_contract", "crm_contract_status", "crm_event"]
+
+    @classmethod
+    def setUpTestData(cls):
+        fill_selling_contacts()
+        refresh_current_statuses()
+
+    def setUp(self):
+        cache.clear()
+        self.superuser = User.objects.filter(is_superuser=True).first()
+        self.client.force_authenticate(self.superuser)
+
+
+# PAGINATION ------------------------------------------------------------------
+
+class PaginationTests(CrmTestCase):
+    def test_pages_are_browsed_with_a_cursor(self):
+        ids, url = [], "/api/v1/client/?page_size=3"
+        while url:
+            page = self.client.get(url).json()
+            self.assertNotIn("count", page)
+            self.assertLessEqual(len(page["results"]), 3)
+            ids.extend(client["id"] for client in page["results"])
+            url = page["next"]
+            self.assertTrue(url is None or "cursor=" in url)
+        self.assertEqual(ids, list(Client.objects.order_by("id").values_list("id", flat=True)))
+
+    def test_previous_link_leads_back(self):
+        first_page = self.client.get("/api/v1/client/?page_size=3").json()
+        second_page = self.client.get(first_page["next"]).json()
+        self.assertIsNone(first_page["previous"])
+        self.assertEqual(self.client.get(second_page["previous"]).json()["results"], first_page["results"])
+
+    def test_count_is_only_given_on_demand(self):
+        page = self.client.get("/api/v1/client/?page_size=3&count=true").json()
+        self.assertEqual(page["count"], Client.objects.count())
+
+    def test_page_size_is_capped(self):
+        with mock.patch.object(KeysetPagination, "max_page_size", 2):
+            self.assertEqual(len(self.client.get("/api/v1/client/?page_size=5").json()["results"]), 2)
+
+
+# DETAIL QUERIES --------------------------------------------------------------
+
+class DetailQueriesTests(CrmTestCase):
+    """ Loading the object of a PUT and checking the permission of its owner cost one query. """
+    def assertObjectIsLoadedInOneQuery(self, view_class, obj, user):
+        request = APIRequestFactory().put(f"/{obj.pk}/", {}, format="json")
+        force_authenticate(request, user)
+        view = view_class()
+        view.setup(request, pk=obj.pk)
+        view.request = view.initialize_request(request)
+        view.format_kwarg = None
+        get_team_member_ids()
+        with self.assertNumQueries(1):
+            self.assertEqual(view.get_object(), obj)
+
+    def test_contract(self):
+        contract = Contract.objects.first()
+        self.assertObjectIsLoadedInOneQuery(ContractDetail, contract, contract.selling_contact)
+
+    def test_contract_status(self):
+        contract_status = ContractStatus.objects.select_related("contract").first()
+        self.assertObjectIsLoadedInOneQuery(
+            ContractStatusDetail, contract_status, contract_status.contract.selling_contact
+        )
+
+    def test_event(self):
+        event = Event.objects.first()
+        self.assertObjectIsLoadedInOneQuery(EventDetail, event, event.support_contact)
+
+
+# LIST SERIALIZATION ----------------------------------------------------------
+
+class ValuesSerializerTests(CrmTestCase):
+    """ The lists rendered from '.values()' rows are the same as the ones of the model serializers. """
+    def assertListIsSerializedLikeTheModels(self, url, serializer_class, queryset):
+        expected = JSONRenderer().render(serializer_class(queryset.order_by("id"), many=True).data)
+        response = self.client.get(f"{url}?page_size=1000")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"], json.loads(expected))
+
+    def test_users(self):
+        self.assertListIsSerializedLikeTheModels(
+            "/api/v1/user/", UserSerializer, User.objects.filter(id__in=get_team_member_ids())
+        )
+
+    def test_clients(self):
+        self.assertListIsSerializedLikeTheModels("/api/v1/client/", ClientSerializer, Client.objects.all())
+
+    def test_contracts(self):
+        self.assertListIsSerializedLikeTheModels("/api/v1/contract/", ContractSerializer, Contract.objects.all())
+
+    def test_contract_statuses(self):
+        self.assertListIsSerializedLikeTheModels(
+            "/api/v1/contract_status/", ContractStatusSerializer, ContractStatus.objects.all()
+        )
+
+    def test_events(self):
+        self.assertListIsSerializedLikeTheModels("/api/v1/event/", EventSerializer, Event.objects.all())
+
+
+# TEAM DIRECTORY --------------------------------------------------------------
+
+class TeamDirectoryTests(CrmTestCase):
+    def test_directory_is_invalidated_once_the_change_is_committed(self):
+        user = User.objects.exclude(pk__in=get_team_member_ids(SUPPORT_TEAM_NAME)).first()
+        get_team_member_ids()
+        with self.captureOnCommitCallbacks() as callbacks:
+            user.groups.add(Group.objects.get(name=SUPPORT_TEAM_NAME))
+            self.assertNotIn(user.pk, get_team_member_ids(SUPPORT_TEAM_NAME))
+        for callback in callbacks:
+            callback()
+        self.assertIn(user.pk, get_team_member_ids(SUPPORT_TEAM_NAME))
+
+
+# CURRENT STATUS --------------------------------------------------------------
+
+class CurrentStatusTests(CrmTestCase):
+    def test_new_status_changes_contract_etags(self):
+        contract = Contract.objects.filter(current_state="S").first()
+        detail_url, list_url = f"/api/v1/contract/{contract.pk}/", f"/api/v1/contract/?client={contract.client_id}"
+        detail_etag = self.client.get(detail_url)["ETag"]
+        list_etag = self.client.get(list_url)["ETag"]
+
+        response = self.client.post("/api/v1/contract_status/", {
+            "is_accepted": True, "acceptance_note": "Accepted.", "state": "E", "state_note": "Done.",
+            "contract": contract.pk
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get(detail_url, HTTP_IF_NONE_MATCH=detail_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["current_state"], "E")
+        self.assertEqual(self.client.get(list_url, HTTP_IF_NONE_MATCH=list_etag).status_code, 200)
+
+
+# SEARCH ----------------------------------------------------------------------
+
+def similarity(value, term):
+    """ Stand-in for the pg_trgm similarity on SQLite, ranking most rows the same. """
+    value, term = value.lower(), term.lower()
+    return 1.0 if value.startswith(term) else 0.5 if term in value else 0.0
+
+
+class SearchTests(CrmTestCase):
+    def setUp(self):
+        super().setUp()
+        if connection.vendor == "sqlite":
+            connection.ensure_connection()
+            connection.connection.create_function("SIMILARITY", 2, similarity)
+            patcher = mock.patch.object(TrigramSearchFilter, "can_rank", return_value=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_search_looks_in_the_client_names_and_email(self):
+        response = self.client.get("/api/v1/client/?search=carl")
+        self.assertEqual([client["id"] for client in response.json()["results"]], [1])
+
+    def test_search_results_are_ranked(self):
+        results = self.client.get("/api/v1/client/?search=a").json()["results"]
+        ranks = [
+            max(similarity(client[name], "a") for name in ("first_name", "last_name", "email")) for client in results
+        ]
+        self.assertEqual(ranks, sorted(ranks, reverse=True))
+        self.assertEqual(len(results), Client.objects.filter(email__icontains="a").count())
+
+    def test_ranked_pages_neither_skip_nor_repeat_results(self):
+        expected_ids = [client["id"] for client in self.client.get("/api/v1/client/?search=a").json()["results"]]
+        ids, url, pages = [], "/api/v1/client/?search=a&page_size=2", []
+        while url:
+            page = self.client.get(url).json()
+            pages.append(page)
+            ids.extend(client["id"] for client in page["results"])
+            url = page["next"]
+        self.assertEqual(ids, expected_ids)
+        self.assertGreater(len(pages), 2)
+        self.assertIn("offset=2", pages[0]["next"])
+        self.assertEqual(self.client.get(pages[1]["previous"]).json()["results"], pages[0]["results"])
+
+
+# FILTERS ---------------------------------------------------------------------
+
+class LookupFilterTests(CrmTestCase):
+    def get_ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [row["id"] for row in response.json()["results"]]
+
+    def test_amounts_are_compared_as_numbers(self):
+        # compared as text, "10000.00" would come before "9000.5"
+        self.assertEqual(self.get_ids("/api/v1/contract/?amount__gte=9000.5"), [1, 2, 3, 6, 7])
+
+    def test_dates_are_compared_as_dates(self):
+        self.assertEqual(self.get_ids("/api/v1/event/?start_date__range=2022-01-01,2022-06-01"), [1, 2, 3, 4])
+        self.assertEqual(self.get_ids("/api/v1/event/?start_date__lt=2022-02-22T00:00:00Z"), [1, 5, 6, 7])
+
+    def test_relations_and_booleans(self):
+        self.assertEqual(
+            self.get_ids("/api/v1/contract/?client__in=1,2&current_is_accepted=false"),
+            list(
+                Contract.objects.filter(client__in=[1, 2], current_is_accepted=False)
+                .order_by("id").values_list("id", flat=True)
+            )
+        )
+
+    def test_invalid_values_are_refused_with_their_parameter(self):
+        response = self.client.get("/api/v1/contract/?amount__gte=lots&payment_due__lt=2022-02-01")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()), ["amount__gte"])
+        response = self.client.get("/api/v1/event/?start_date__range=2022-01-01")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("start_date__range", response.json())
+
+    def test_undeclared_lookups_are_ignored(self):
+        self.assertEqual(len(self.get_ids("/api/v1/contract/?amount__contains=1")), Contract.objects.count())
+
+
+# BULK WRITES -----------------------------------------------------------------
+
+class BulkWriteTests(CrmTestCase):
+    def get_event_items(self, *ids):
+        return [dict(EventSerializer(event).data) for event in Event.objects.filter(pk__in=ids).order_by("pk")]
+
+    def test_boolean_id_is_refused(self):
+        item = self.get_event_items(1)[0]
+        item.update(id=True, name="Renamed")
+        response = self.client.put("/api/v1/event/bulk/", [item], format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("id", response.json()["errors"][0])
+        self.assertNotEqual(Event.objects.get(pk=1).name, "Renamed")
+
+    def test_duplicate_ids_are_refused(self):
+        first, second = self.get_event_items(2) * 2
+        second = dict(second, name="Renamed")
+        response = self.client.put("/api/v1/event/bulk/", [first, second], format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"][0], {})
+        self.assertIn("id", response.json()["errors"][1])
+        self.assertNotEqual(Event.objects.get(pk=2).name, "Renamed")
+
+    def test_update_keeps_a_status_written_meanwhile(self):
+        contract = Contract.objects.filter(current_state="S").first()
+        item = dict(ContractSerializer(contract).data, amount="1000.00")
+        get_editable_objects = ContractBulk.get_editable_objects
+
+        def get_editable_objects_then_add_status(view, request, ids):
+            objects = get_editable_objects(view, request, ids)
+            ContractStatus.objects.create(
+                contract=contract, is_accepted=True, acceptance_note="Accepted.", state="E", state_note="Done."
+            )
+            return objects
+
+        with mock.patch.object(ContractBulk, "get_editable_objects", get_editable_objects_then_add_status):
+            self.assertEqual(self.client.put("/api/v1/contract/bulk/", [item], format="json").status_code, 200)
+        contract.refresh_from_db()
+        self.assertEqual(contract.current_state, "E")
+        self.assertEqual(str(contract.amount), "1000.00")
+
+
+# EXPORTS ---------------------------------------------------------------------
+
+class ExportTests(CrmTestCase):
+    def get_export(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_ndjson_export_holds_the_list_rows(self):
+        response, content = self.get_export("/api/v1/event/export.ndjson")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(
+            [json.loads(line) for line in content.splitlines()],
+            self.client.get("/api/v1/event/?page_size=1000").json()["results"]
+        )
+
+    def test_csv_export_has_a_header_and_a_line_per_row(self):
+        response, content = self.get_export("/api/v1/contract/export.csv")
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertIn('filename="contracts.csv"', response["Content-Disposition"])
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(
+            [int(row["id"]) for row in rows], list(Contract.objects.order_by("id").values_list("id", flat=True))
+        )
+        self.assertEqual(rows[0]["amount"], str(Contract.objects.get(pk=rows[0]["id"]).amount))
+
+    def test_export_uses_the_list_filters(self):
+        _, content = self.get_export("/api/v1/contract_status/export.ndjson?contract=1")
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertTrue(rows)
+        self.assertEqual({row["contract"] for row in rows}, {1})
+
+    def test_unknown_format_is_not_found(self):
+        self.assertEqual(self.client.get("/api/v1/event/export.xml").status_code, 404)
+
+
+# MY RECORDS ------------------------------------------------------------------
+
+class MineTests(CrmTestCase):
+    def get_ids(self, url, user):
+        self.client.force_authenticate(user)
+        return [row["id"] for row in self.client.get(url).json()["results"]]
+
+    def test_mine_lists_the_records_of_the_user(self):
+        seller, support = User.objects.get(pk=2), User.objects.get(pk=3)
+        self.assertEqual(
+            self.get_ids("/api/v1/client/?mine=true", seller),
+            list(Client.objects.filter(contact=seller).order_by("id").values_list("id", flat=True))
+        )
+        self.assertEqual(
+            self.get_ids("/api/v1/contract_status/?mine=true", seller),
+            list(
+                ContractStatus.objects.filter(contract__client__contact=seller)
+                .order_by("id").values_list("id", flat=True)
+            )
+        )
+        self.assertEqual(
+            self.get_ids("/api/v1/event/?mine=true", support),
+            list(Event.objects.filter(support_contact=support).order_by("id").values_list("id", flat=True))
+        )
+
+    def test_events_of_a_seller_are_the_events_of_their_clients(self):
+        seller = User.objects.get(pk=2)
+        self.assertEqual(
+            self.get_ids("/api/v1/event/?mine=true", seller),
+            list(Event.objects.filter(contract__client__contact=seller).order_by("id").values_list("id", flat=True))
+        )
+
+    def test_without_mine_the_list_is_whole(self):
+        self.assertEqual(len(self.get_ids("/api/v1/event/", User.objects.get(pk=3))), Event.objects.count())
+
+    def test_admin_filter(self):
+        seller = User.objects.get(pk=2)
+        self.client.force_login(seller)
+        for url, expected in (
+            ("/admin/crm/contract/", Contract.objects.filter(client__contact=seller)),
+            ("/admin/crm/event/", Event.objects.filter(contract__client__contact=seller)),
+        ):
+            response = self.client.get(f"{url}?mine=1")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                sorted(obj.pk for obj in response.context["cl"].result_list),
+                sorted(expected.values_list("pk", flat=True))
+            )
+            self.assertEqual(len(self.client.get(url).context["cl"].result_list), expected.model.objects.count())
+
+
+# EVENTS SCHEDULING -----------------------------------------------------------
+
+class ScheduleConflictTests(CrmTestCase):
+    def get_new_event(self, **fields):
+        item = dict(EventSerializer(Event.objects.get(pk=1)).data)
+        del item["id"], item["date_updated"]
+        return dict(item, **fields)
+
+    def test_overlapping_event_is_refused(self):
+        event = Event.objects.get(pk=1)
+        response = self.client.post("/api/v1/event/", self.get_new_event(
+            start_date=event.start_date.isoformat(), end_date=event.end_date.isoformat()
+        ), format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("support_contact", response.json())
+
+    def test_adjacent_event_is_accepted(self):
+        event = Event.objects.get(pk=1)
+        response = self.client.post("/api/v1/event/", self.get_new_event(
+            start_date=event.end_date.isoformat(), end_date=(event.end_date + timedelta(hours=1)).isoformat()
+        ), format="json")
+        self.assertEqual(response.status_code, 201)
+
+    def test_overlapping_items_of_a_batch_are_refused(self):
+        items = [
+            self.get_new_event(start_date="2030-01-01T08:00:00Z", end_date="2030-01-01T10:00:00Z"),
+            self.get_new_event(start_date="2030-01-01T09:00:00Z", end_date="2030-01-01T11:00:00Z"),
+            self.get_new_event(start_date="2030-01-02T09:00:00Z", end_date="2030-01-02T11:00:00Z"),
+        ]
+        count = Event.objects.count()
+        response = self.client.post("/api/v1/event/bulk/", items, format="json")
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()["errors"]
+        self.assertIn("support_contact", errors[0])
+        self.assertIn("support_contact", errors[1])
+        self.assertEqual(errors[2], {})
+        self.assertEqual(Event.objects.count(), count)
+
+
+# EVENTS CALENDAR -------------------------------------------------------------
+
+class TimelineTests(CrmTestCase):
+    def get_days(self, query):
+        response = self.client.get(f"/api/v1/event/timeline/{query}")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_timeline_groups_the_events_by_day(self):
+        Event.objects.filter(pk=2).update(start_date="2022-02-21T14:00:00Z", end_date="2022-02-21T16:00:00Z")
+        days = self.get_days("?support_contact=3")
+        self.assertEqual([day["day"] for day in days], ["2022-02-21", "2022-04-18"])
+        self.assertEqual(days[0]["events"], 2)
+        self.assertEqual(days[0]["attendees"], 20)
+        self.assertEqual(days[0]["first_start"], "2022-02-21T08:00:00Z")
+        self.assertEqual(days[0]["last_end"], "2022-02-21T16:00:00Z")
+
+    def test_window_includes_from_and_excludes_to(self):
+        days = self.get_days("?from=2022-02-21T08:00:00Z&to=2022-04-18T08:00:00Z")
+        self.assertEqual([day["day"] for day in days], ["2022-02-21", "2022-02-22", "2022-03-21"])
+        self.assertEqual(len(self.get_days("")), Event.objects.count())
+
+    def test_bad_bound_is_a_bad_request(self):
+        response = self.client.get("/api/v1/event/timeline/?from=yesterday")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("from", response.json())
+
+
+class CalendarTests(CrmTestCase):
+    def get_calendar(self, query=""):
+        response = self.client.get(f"/api/v1/event/calendar.ics{query}")
+        self.assertEqual(response.status_code, 200)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_fold_and_escape(self):
+        self.assertEqual(escape_text("a;b,c\\d\r\ne\nf"), "a\\;b\\,c\\\\d\\ne\\nf")
+        self.assertEqual(fold("short"), "short\r\n")
+        folded = fold("SUMMARY:" + "é" * 80)
+        self.assertEqual(folded.replace("\r\n ", "")[:-2], "SUMMARY:" + "é" * 80)
+        self.assertTrue(all(len(line.encode()) <= 75 for line in folded.split("\r\n")))
+
+    def test_calendar_has_one_valid_event_per_row(self):
+        Event.objects.filter(pk=1).update(name="Wedding, party; " * 6, note="First line\nSecond line")
+        response, content = self.get_calendar("?from=2022-01-01T00:00:00Z")
+        self.assertEqual(response["Content-Type"], "text/calendar; charset=utf-8")
+        self.assertTrue(content.startswith("BEGIN:VCALENDAR\r\n"))
+        self.assertTrue(content.endswith("END:VCALENDAR\r\n"))
+        self.assertNotIn("\n", content.replace("\r\n", ""))
+        lines = content.split("\r\n")[:-1]
+        self.assertTrue(all(len(line.encode()) <= 75 for line in lines))
+        events = Event.objects.filter(start_date__gte="2022-01-01T00:00:00Z")
+        self.assertEqual(lines.count("BEGIN:VEVENT"), events.count())
+        unfolded = content.replace("\r\n ", "")
+        self.assertIn("UID:event-1@testserver\r\nDTSTAMP:", unfolded)
+        self.assertIn("DTSTART:20220221T080000Z\r\nDTEND:20220221T100000Z\r\n", unfolded)
+        self.assertIn("SUMMARY:" + "Wedding\\, party\\; " * 6 + "\r\n", unfolded)
+        self.assertIn("DESCRIPTION:10 attendees.\\nFirst line\\nSecond line\r\n", unfolded)
+
+    def test_token_opens_the_calendar_of_its_user_only(self):
+        support = User.objects.get(pk=3)
+        self.client.force_authenticate(support)
+        url = self.client.get("/api/v1/event/calendar/token/").json()["url"]
+        self.assertTrue(url.startswith("http://testserver/api/v1/event/calendar.ics?token=3-"))
+        self.client.force_authenticate(None)
+        response, content = self.get_calendar(url[len("http://testserver/api/v1/event/calendar.ics"):])
+        self.assertEqual(content.count("BEGIN:VEVENT"), support.events.count())
+        self.assertNotIn("UID:event-4@", content)
+
+    def test_bad_or_revoked_token_is_refused(self):
+        support = User.objects.get(pk=3)
+        token = make_calendar_token(support)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get("/api/v1/event/calendar.ics?token=3-0").status_code, 403)
+        support.set_password("a new password")
+        support.save()
+        self.assertEqual(self.client.get(f"/api/v1/event/calendar.ics?token={token}").status_code, 403)
+
+
+# CONDITIONAL REQUESTS --------------------------------------------------------
+
+class ConditionalRequestTests(CrmTestCase):
+    detail_url = "/api/v1/client/1/"
+    list_url = "/api/v1/client/"
+
+    def test_unchanged_detail_is_not_modified(self):
+        etag = self.client.get(self.detail_url)["ETag"]
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_changed_detail_is_sent(self):
+        etag = self.client.get(self.detail_url)["ETag"]
+        response = self.client.patch(self.detail_url, {"company_name": "Renamed"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["company_name"], "Renamed")
+
+    def test_update_with_matching_etag(self):
+        etag = self.client.get(self.detail_url)["ETag"]
+        response = self.client.patch(
+            self.detail_url, {"company_name": "Renamed"}, format="json", HTTP_IF_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(self.client.get(self.detail_url)["ETag"], response["ETag"])
+
+    def test_update_with_stale_etag_is_refused(self):
+        etag = self.client.get(self.detail_url)["ETag"]
+        self.client.patch(self.detail_url, {"company_name": "Renamed"}, format="json")
+        response = self.client.patch(self.detail_url, {"company_name": "Other"}, format="json", HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(Client.objects.get(pk=1).company_name, "Renamed")
+
+    def test_delete_with_stale_etag_is_refused(self):
+        response = self.client.delete(self.detail_url, HTTP_IF_MATCH='"stale"')
+        self.assertEqual(response.status_code, 412)
+        self.assertTrue(Client.objects.filter(pk=1).exists())
+
+    def test_unchanged_list_is_not_modified(self):
+        etag = self.client.get(self.list_url)["ETag"]
+        self.assertEqual(self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_changed_list_is_sent(self):
+        etag = self.client.get(self.list_url)["ETag"]
+        self.client.patch(self.detail_url, {"company_name": "Renamed"}, format="json")
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+# DASHBOARD AGGREGATES --------------------------------------------------------
+
+class DashboardAggregatesTests(CrmTestCase):
+    """ After every kind of write, the summary rows refreshed by the signals equal a full rebuild. """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        refresh_dashboard()
+
+    def assertDashboardIsFresh(self):
+        summaries = self.get_summaries()
+        refresh_dashboard()
+        self.assertEqual(summaries, self.get_summaries())
+
+    @staticmethod
+    def get_summaries():
+        return (
+            sorted(MonthlySales.objects.values_list(
+                "selling_contact", "month", "contracts", "amount", "signed_contracts", "signed_amount"
+            )),
+            sorted(ClientSales.objects.values_list(
+                "client", "selling_contact", "contracts", "amount", "signed_contracts", "signed_amount"
+            )),
+            sorted(MonthlyEventLoad.objects.values_list("support_contact", "month", "events", "attendees", "hours")),
+        )
+
+    def test_contract_writes(self):
+        item = dict(ContractSerializer(Contract.objects.first()).data)
+        item.update(id=None, reference="NEW-CONTRACT")
+        self.assertEqual(self.client.post("/api/v1/contract/", item, format="json").status_code, 201)
+        self.assertDashboardIsFresh()
+
+        contract = Contract.objects.first()
+        response = self.client.patch(f"/api/v1/contract/{contract.pk}/", {"amount": "123.45"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertDashboardIsFresh()
+
+        other_client = Client.objects.exclude(contact_id=contract.client.contact_id).first()
+        response = self.client.patch(f"/api/v1/contract/{contract.pk}/", {"client": other_client.pk}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertDashboardIsFresh()
+
+        items = [dict(ContractSerializer(contract).data) for contract in Contract.objects.all()[:3]]
+        for item in items:
+            item["amount"] = "1000.00"
+        self.assertEqual(self.client.put("/api/v1/contract/bulk/", items, format="json").status_code, 200)
+        self.assertDashboardIsFresh()
+
+        self.assertEqual(self.client.delete(f"/api/v1/contract/{contract.pk}/").status_code, 204)
+        self.assertDashboardIsFresh()
+
+    def test_write_refreshes_its_summaries_only(self):
+        contract = Contract.objects.first()
+        key = {"selling_contact": contract.selling_contact_id, "month": get_month(contract.date_created)}
+        MonthlySales.objects.update(contracts=0)
+        response = self.client.patch(f"/api/v1/contract/{contract.pk}/", {"amount": "123.45"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(MonthlySales.objects.get(**key).contracts, 0)
+        self.assertFalse(MonthlySales.objects.exclude(**key).exclude(contracts=0).exists())
+
+    def test_contract_status_writes(self):
+        contract = Contract.objects.filter(current_is_accepted=False).first()
+        response = self.client.post("/api/v1/contract_status/", {
+            "is_accepted": True, "acceptance_note": "Accepted.", "state": "S", "state_note": "Signed.",
+            "contract": contract.pk
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertDashboardIsFresh()
+
+        items = [
+            {"is_accepted": False, "acceptance_note": "Refused.", "state": "P", "state_note": "Back.", "contract": pk}
+            for pk in Contract.objects.values_list("pk", flat=True)[:3]
+        ]
+        self.assertEqual(self.client.post("/api/v1/contract_status/bulk/", items, format="json").status_code, 201)
+        self.assertDashboardIsFresh()
+
+        self.assertEqual(self.client.delete(f"/api/v1/contract_status/{response.json()['id']}/").status_code, 204)
+        self.assertDashboardIsFresh()
+
+    def test_client_contact_change(self):
+        client = Client.objects.filter(contracts__isnull=False).first()
+        seller = User.objects.filter(clients__isnull=False).exclude(pk=client.contact_id).first()
+        response = self.client.patch(f"/api/v1/client/{client.pk}/", {"contact": seller.pk}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertDashboardIsFresh()
+
+    def test_event_writes(self):
+        event = Event.objects.get(pk=1)
+        response = self.client.patch(f"/api/v1/event/{event.pk}/", {"attendees": 99}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertDashboardIsFresh()
+
+        other_support = Event.objects.exclude(support_contact=event.support_contact).first().support_contact
+        response = self.client.patch(f"/api/v1/event/{event.pk}/", {
+            "support_contact": other_support.pk,
+            "start_date": "2030-01-01T08:00:00Z", "end_date": "2030-01-01T10:00:00Z"
+        }, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertDashboardIsFresh()
+
+        items = [dict(EventSerializer(event).data) for event in Event.objects.order_by("pk")[:3]]
+        for item in items:
+            item["attendees"] += 1
+        self.assertEqual(self.client.put("/api/v1/event/bulk/", items, format="json").status_code, 200)
+        self.assertDashboardIsFresh()
+
+        self.assertEqual(self.client.delete(f"/api/v1/event/{event.pk}/").status_code, 204)
+        self.assertDashboardIsFresh()
+
+
+# FIXTURES LOADER -------------------------------------------------------------
+
+class LoaderTests(TestCase):
+    fixtures = ["crm_user"]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def write_fixture(self, name, objects):
+        path = self.directory / name
+        path.write_text(json.dumps(objects))
+        return path
+
+    @staticmethod
+    def get_client_object(pk):
+        return {"model": "crm.client", "pk": pk, "fields": {
+            "first_name": "First", "last_name": "Last", "email": f"client{pk}@example.com", "phone": "0633445566",
+            "company_name": "Company", "contact": 2, "date_updated": "2022-01-13T10:46:57.011Z"
+        }}
+
+    def test_fixtures_of_the_same_model_are_all_loaded(self):
+        paths = [
+            self.write_fixture("clients_1.json", [self.get_client_object(1001)]),
+            self.write_fixture("clients_2.json", [self.get_client_object(1002)]),
+        ]
+        load_fixtures(paths, log=lambda message: None)
+        self.assertEqual(set(Client.objects.values_list("pk", flat=True)), {1001, 1002})
+
+    def test_failed_dump_keeps_the_previous_one(self):
+        path = self.write_fixture("last_saved.json", [self.get_client_object(1001)])
+        previous_dump = path.read_text()
+        with mock.patch("crm.loader.iterate", side_effect=DatabaseError("no such table")):
+            with self.assertRaises(DatabaseError):
+                dump_fixture(path)
+        self.assertEqual(path.read_text(), previous_dump)
+        self.assertEqual(list(self.directory.iterdir()), [path])
+
+
+class DemoRoundTripTests(TestCase):
+    @staticmethod
+    def get_rows():
+        rows = {model: list(model.objects.order_by("pk").values()) for model in (
+            User, Client, Contract, ContractStatus, Event
+        )}
+        # the summaries are rebuilt by the loader
+        rows.update({model: sorted(
+            tuple(value for name, value in row.items() if name not in ("id", "date_updated"))
+            for row in model.objects.values()
+        ) for model in (MonthlySales, ClientSales, MonthlyEventLoad)})
+        return rows
+
+    def test_dump_is_loaded_back_as_it_was(self):
+        load_demo_fixtures(log=lambda message: None)
+        for file_name in DEMO_FIXTURES:
+            with open(FIXTURES_DIR / file_name) as fixture_file:
+                objects = json.load(fixture_file)
+            self.assertEqual(
+                apps.get_model(objects[0]["model"]).objects.count(), len(objects), f"objects of {file_name}"
+            )
+        self.assertTrue(Contract.objects.filter(selling_contact__isnull=False).exists())
+        self.assertTrue(MonthlySales.objects.exists())
+        rows = self.get_rows()
+        groups = sorted(User.groups.through.objects.values_list("user", "group"))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "last_saved.json"
+            dump_fixture(path)
+            for model in (Event, ContractStatus, Contract, Client, User):
+                model.objects.all().delete()
+            load_fixtures([path], log=lambda message: None)
+
+        self.assertEqual(self.get_rows(), rows)
+        self.assertEqual(sorted(User.groups.through.objects.values_list("user", "group")), groups)
+
+
+class SnapshotTests(SimpleTestCase):
+    """ SQLite snapshots, taken and restored on a database file of their own. """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.name = str(Path(directory.name) / "demo.sqlite3")
+        database_connection = mock.Mock(vendor="sqlite", settings_dict={"NAME": self.name})
+        patcher = mock.patch("crm.snapshots.connection", database_connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def set_rows(self, *values):
+        with sqlite3.connect(self.name) as database:
+            database.execute("CREATE TABLE IF NOT EXISTS demo (value TEXT)")
+            database.execute("DELETE FROM demo")
+            database.executemany("INSERT INTO demo VALUES (?)", [(value,) for value in values])
+        database.close()
+
+    def get_rows(self):
+        with sqlite3.connect(self.name) as database:
+            rows = [value for value, in database.execute("SELECT value FROM demo ORDER BY value")]
+        database.close()
+        return rows
+
+    def test_restore_brings_back_the_snapshot(self):
+        self.set_rows("a", "b")
+        self.assertFalse(snapshot_exists())
+        take_snapshot()
+        self.assertTrue(snapshot_exists())
+        self.set_rows("c")
+        restore_snapshot()
+        self.assertEqual(self.get_rows(), ["a", "b"])
+
+    def test_restore_without_snapshot(self):
+        with self.assertRaises(FileNotFoundError):
+            restore_snapshot()
+
+
+# QUERY TIMING ----------------------------------------------------------------
+
+class ServerTimingTests(CrmTestCase):
+    @staticmethod
+    def load_settings(**environ):
+        """ Run the settings module again, with the given environment variables. """
+        spec = importlib.util.spec_from_file_location("fresh_settings", Path(settings_module.__file__))
+        fresh_settings = importlib.util.module_from_spec(spec)
+        with mock.patch.dict(os.environ, environ):
+            os.environ.pop("SERVER_TIMING", None)
+            spec.loader.exec_module(fresh_settings)
+        return fresh_settings
+
+    def test_header_follows_debug_by_default(self):
+        self.assertFalse(self.load_settings(DEBUG="False").SERVER_TIMING)
+        self.assertTrue(self.load_settings(DEBUG="True").SERVER_TIMING)
+
+    @override_settings(SERVER_TIMING=False)
+    def test_header_is_not_sent_when_disabled(self):
+        self.assertNotIn("Server-Timing", self.client.get("/api/v1/client/1/"))
+
+    @override_settings(SERVER_TIMING=True)
+    def test_header_counts_the_queries(self):
+        self.assertRegex(
+            self.client.get("/api/v1/client/1/")["Server-Timing"], r'^db;dur=[\d.]+;desc="\d+ queries", db-slowest;dur='
+        )
+
+
+# ASYNC VIEWS -----------------------------------------------------------------
+
+class AsyncViewsTests(TransactionTestCase):
+    """ The async views run in other threads, with their own connections : the fixtures have to be committed (and the
+    teams of the migrations restored after every flush). """
+    fixtures = CrmTestCase.fixtures
+    serialized_rollback = True
+
+    def setUp(self):
+        CrmTestCase.setUpTestData()
+        cache.clear()
+        self.client.force_login(User.objects.filter(is_superuser=True).first())
+        self.async_client.cookies = self.client.cookies
+
+    def async_request(self, method, url):
+        async def request():
+            return await getattr(self.async_client, method)(url)
+        return async_to_sync(request)()
+
+    def test_async_views_answer_like_the_sync_ones(self):
+        for url in (
+            "client/", "client/1/", "contract/?amount__gte=10000", "contract/1/", "contract_status/", "event/",
+            "event/1/", "event/404/"
+        ):
+            with self.subTest(url=url):
+                sync_response = self.client.get(f"/api/v1/{url}")
+                async_response = self.async_request("get", f"/api/v1/async/{url}")
+                self.assertEqual(async_response.status_code, sync_response.status_code)
+                self.assertEqual(async_response.json(), sync_response.json())
+                self.assertEqual(async_response.get("ETag"), sync_response.get("ETag"))
+
+    def test_async_views_are_read_only(self):
+        response = self.async_request("delete", "/api/v1/async/client/1/")
+        self.assertEqual(response.status_code, 405)
+        self.assertTrue(Client.objects.filter(pk=1).exists())
+
+    def test_async_views_need_a_login(self):
+        self.async_client.cookies.clear()
+        self.assertEqual(self.async_request("get", "/api/v1/async/client/").status_code, 403)
+
+
+# METRICS ---------------------------------------------------------------------
+
+class RegistryTests(SimpleTestCase):
+    def test_shards_of_finished_threads_are_retired(self):
+        registry = Registry()
+        requests = Counter(registry, "requests", "Requests.")
+        latency = Histogram(registry, "latency", "Latency.")
+
+        def record():
+            requests.inc()
+            latency.observe(0.2)
+
+        for _ in range(20):
+            thread = threading.Thread(target=record)
+            thread.start()
+            thread.join()
+        record()
+
+        samples = registry.collect()
+        self.assertLessEqual(len(registry.shards), 2)
+        self.assertEqual(samples[requests][()], 21)
+        self.assertEqual(sum(samples[latency][()][:-1]), 21)
+        self.assertAlmostEqual(samples[latency][()][-1], 21 * 0.2)
+
+
+# REPLICAS --------------------------------------------------------------------
+
+class ReplicaRouterTests(SimpleTestCase):
+    def tearDown(self):
+        get_replicas_cycle.cache_clear()
+
+    def test_weighted_round_robin(self):
+        self.assertEqual(weighted_round_robin({"a": 3, "b": 1}), ["a", "a", "b", "a"])
+
+    def test_zero_weights_read_from_the_primary(self):
+        get_replicas_cycle.cache_clear()
+        with override_settings(DATABASE_REPLICAS={"replica_1": 0}):
+            self.assertEqual(next_replica(), DEFAULT_DB_ALIAS)
@@ -1,11 +1,15 @@
 from django.urls import path
 
+from . import async_views
 from .views import (
     UserList,
     ClientList, ClientDetail,
-    ContractList, ContractDetail,
-    ContractStatusList, ContractStatusDetail,
-    EventList, EventDetail
+    ContractList, ContractBulk, ContractExport, ContractDetail,
+    ContractStatusList, ContractStatusBulk, ContractStatusExport, ContractStatusDetail,
+    EventList, EventBulk, EventExport, EventDetail, EventTimeline, EventCalendar, EventCalendarToken,
+    SupportAvailabilityList,
+    MonthlySalesList, MonthTotalList, ClientSalesList, MonthlyEventLoadList,
+    metrics_view
 )
 
 
@@ -14,9 +18,33 @@ urlpatterns = [
     path('client/', ClientList.as_view()),
     path('client/<int:pk>/', ClientDetail.as_view()),
     path('contract/', ContractList.as_view()),
+    path('contract/bulk/', ContractBulk.as_view()),
+    path('contract/export.<slug:file_format>', ContractExport.as_view()),
     path('contract/<int:pk>/', ContractDetail.as_view()),
     path('contract_status/', ContractStatusList.as_view()),
+    path('contract_status/bulk/', ContractStatusBulk.as_view()),
+    path('contract_status/export.<slug:file_format>', ContractStatusExport.as_view()),
     path('contract_status/<int:pk>/', ContractStatusDetail.as_view()),
     path('event/', EventList.as_view()),
+    path('event/bulk/', EventBulk.as_view()),
+    path('event/export.<slug:file_format>', EventExport.as_view()),
+    path('event/timeline/', EventTimeline.as_view()),
+    path('event/calendar.ics', EventCalendar.as_view()),
+    path('event/calendar/token/', EventCalendarToken.as_view()),
     path('event/<int:pk>/', EventDetail.as_view()),
+    path('support/availability/', SupportAvailabilityList.as_view()),
+    path('dashboard/sales/sellers/', MonthlySalesList.as_view()),
+    path('dashboard/sales/months/', MonthTotalList.as_view()),
+    path('dashboard/sales/clients/', ClientSalesList.as_view()),
+    path('dashboard/events/', MonthlyEventLoadList.as_view()),
+    path('metrics', metrics_view),
+    # async read-only twins of the list and detail endpoints, for ASGI servers (see crm/async_views.py)
+    path('async/client/', async_views.client_list),
+    path('async/client/<int:pk>/', async_views.client_detail),
+    path('async/contract/', async_views.contract_list),
+    path('async/contract/<int:pk>/', async_views.contract_detail),
+    path('async/contract_status/', async_views.contract_status_list),
+    path('async/contract_status/<int:pk>/', async_views.contract_status_detail),
+    path('async/event/', async_views.event_list),
+    path('async/event/<int:pk>/', async_views.event_detail),
 ]
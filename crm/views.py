@@ -1,40 +1,403 @@
-from rest_framework import generics, filters
-from rest_framework.permissions import IsAdminUser
+import csv
+import hashlib
+import hmac
+import json
 
-from .constants import SELLING_TEAM_NAME, SUPPORT_TEAM_NAME
-from .serializers import UserSerializer, ClientSerializer, ContractSerializer, ContractStatusSerializer, EventSerializer
-from .models import User, Client, Contract, ContractStatus, Event
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.http import HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import generics, status
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import SAFE_METHODS, IsAdminUser
+from rest_framework.relations import RelatedField
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.validators import UniqueValidator
+
+from .authentication import CalendarTokenAuthentication, make_calendar_token
+from .constants import SUPPORT_TEAM_NAME
+from .db import iterate
+from .metrics import LIST_ROWS, registry
+from .parsers import NDJSONParser
+from .signals import pre_bulk_save, post_bulk_save
+from .filters import KEY_LOOKUPS, RANGE_LOOKUPS, LookupFilter, OwnerFilter, TrigramSearchFilter, WindowFilter
+from .ical import iter_calendar
+from .serializers import (
+    UserSerializer, ClientSerializer, ContractSerializer, ContractStatusSerializer, EventSerializer,
+    MonthlySalesSerializer, MonthTotalSerializer, ClientSalesSerializer, MonthlyEventLoadSerializer,
+    PeriodSerializer, EventDaySerializer, check_schedule_conflicts, get_values_serializer
+)
+from .models import User, Client, Contract, ContractStatus, Event, MonthlySales, ClientSales, MonthlyEventLoad
 from .permissions import (
     IsSuperUser,
     ClientListPermission, ClientDetailPermission,
     ContractListPermission, ContractDetailPermission,
     ContractStatusListPermission, ContractStatusDetailPermission,
-    EventListPermission, EventDetailPermission
+    EventListPermission, EventDetailPermission,
+    ContractBulkPermission, ContractStatusBulkPermission, EventBulkPermission
 )
+from .teams import get_team_member_ids
+
+
+# CONDITIONAL REQUESTS --------------------------------------------------------
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = "The object was changed since you read it."
+    default_code = "precondition_failed"
+
+
+def make_etag(*parts):
+    """ Strong ETag of the version of a representation identified by the given parts. """
+    return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def set_validators(response, etag, last_modified=None):
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    return response
+
+
+class ConditionalDetailMixin:
+    """
+    Give every object an ETag and a Last-Modified date from its 'date_updated' column.
+    A GET with the current ETag (If-None-Match) or date (If-Modified-Since) is answered with 304 Not Modified,
+    without serializing the object. A PUT, PATCH or DELETE sent with an outdated ETag (If-Match) or date
+    (If-Unmodified-Since) is refused with 412 Precondition Failed : someone else changed the object meanwhile.
+    The row stays locked from the check to the write, so two clients can't both write over the same version.
+    """
+    precondition_headers = ("If-Match", "If-Unmodified-Since")
+
+    @staticmethod
+    def get_validators(instance):
+        etag = make_etag(instance._meta.label, instance.pk, instance.date_updated)
+        return etag, int(instance.date_updated.timestamp())
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method not in SAFE_METHODS and any(
+            header in self.request.headers for header in self.precondition_headers
+        ):
+            queryset = queryset.select_for_update(of=("self",))
+        return queryset
+
+    def get_object(self):
+        instance = super().get_object()
+        if self.request.method not in SAFE_METHODS:
+            if get_conditional_response(self.request, *self.get_validators(instance)) is not None:
+                raise PreconditionFailed()
+        return instance
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag, last_modified = self.get_validators(instance)
+        response = get_conditional_response(request, etag, last_modified)
+        if response is None:
+            response = Response(self.get_serializer(instance).data)
+        return set_validators(response, etag, last_modified)
+
+    def update(self, request, *args, **kwargs):
+        with transaction.atomic():
+            response = super().update(request, *args, **kwargs)
+        return set_validators(response, *self.get_validators(self.updated_instance))
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        self.updated_instance = serializer.instance
+
+    def destroy(self, request, *args, **kwargs):
+        with transaction.atomic():
+            return super().destroy(request, *args, **kwargs)
+
+
+# LIST MIXIN ------------------------------------------------------------------
+
+class ValuesListMixin:
+    """
+    Answer list GETs with '.values()' rows rendered by the precompiled read-only twin of the view serializer,
+    instead of building a model instance and running the whole serializer for every row.
+    Pages of the models with a 'modified_column' get an ETag from the ids and modification dates of their rows :
+    an unchanged page is answered with 304 Not Modified (If-None-Match), without being serialized. The
+    Last-Modified date of a page is informative only, since deleting a row doesn't move it.
+    """
+    modified_column = "date_updated"
+
+    def list(self, request, *args, **kwargs):
+        values_serializer = get_values_serializer(self.get_serializer_class())
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset = queryset.values(*values_serializer.columns, *queryset.query.annotations)
+
+        page = self.paginate_queryset(queryset)
+        rows = list(queryset) if page is None else page
+        LIST_ROWS.observe(len(rows), type(self).__name__)
+
+        validators = self.get_list_validators(rows, page is not None)
+        if validators:
+            response = get_conditional_response(request, validators[0])
+            if response is not None:
+                return set_validators(response, *validators)
+
+        data = values_serializer.to_representation(rows)
+        response = Response(data) if page is None else self.get_paginated_response(data)
+        return set_validators(response, *validators) if validators else response
+
+    def get_list_validators(self, rows, paginated):
+        """ ETag and Last-Modified date of a list, from its rows and the links to the other pages. """
+        if self.modified_column is None:
+            return None
+        versions = [(row["id"], row[self.modified_column]) for row in rows]
+        links = ()
+        if paginated:
+            links = (self.paginator.get_next_link(), self.paginator.get_previous_link(),
+                     getattr(self.paginator, "count", None))
+        last_modified = max((modified for _, modified in versions), default=None)
+        return make_etag(versions, links), int(last_modified.timestamp()) if last_modified else None
+
+
+# EXPORT MIXIN ----------------------------------------------------------------
+
+class Echo:
+    """ File-like object giving back what is written into it, for 'csv.writer' to produce lines to stream. """
+    def write(self, value):
+        return value
+
+
+class ExportMixin:
+    """
+    Stream the whole filtered list as NDJSON ('.ndjson') or CSV ('.csv'), without pagination.
+    Rows are read by chunks (see 'crm.db.iterate') and rendered with the values serializer of the list, so memory
+    stays flat whatever the size of the table.
+    """
+    http_method_names = ["get", "head", "options"]
+    pagination_class = None
+    export_name = None
+
+    def list(self, request, *args, **kwargs):
+        file_format = kwargs["file_format"]
+        if file_format not in ("ndjson", "csv"):
+            raise NotFound(f"Unknown export format '{file_format}'.")
+
+        values_serializer = get_values_serializer(self.get_serializer_class())
+        queryset = self.filter_queryset(self.get_queryset()).values(*values_serializer.columns).order_by("id")
+        rows = values_serializer.iter_representation(iterate(queryset, settings.EXPORT_CHUNK_SIZE))
+
+        if file_format == "csv":
+            content, content_type = self.iter_csv(values_serializer.names, rows), "text/csv"
+        else:
+            content, content_type = self.iter_ndjson(rows), "application/x-ndjson"
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="{self.export_name}.{file_format}"'
+        return response
+
+    @staticmethod
+    def iter_chunks(lines):
+        """ Group the lines by EXPORT_CHUNK_SIZE, not to send the response one tiny line at a time. """
+        chunk = []
+        for line in lines:
+            chunk.append(line)
+            if len(chunk) == settings.EXPORT_CHUNK_SIZE:
+                yield "".join(chunk)
+                chunk = []
+        if chunk:
+            yield "".join(chunk)
+
+    def iter_ndjson(self, rows):
+        return self.iter_chunks(json.dumps(row) + "\n" for row in rows)
+
+    def iter_csv(self, names, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(names)
+        yield from self.iter_chunks(writer.writerow(row.values()) for row in rows)
+
+
+# BULK MIXIN ------------------------------------------------------------------
+
+class BulkWriteMixin:
+    """
+    Create (POST) or update (PUT, every item with its "id") a batch of objects sent as a JSON array or as NDJSON.
+    The batch is validated in one pass, with the related objects of all the items fetched with one query per
+    field, then written with 'bulk_create()' / 'bulk_update()' in a single transaction. If any item is invalid,
+    nothing is written and the answer holds the errors of every item, in the order of the batch.
+    """
+    parser_classes = [JSONParser, NDJSONParser]
+    bulk_permission_class = None
+    copied_fields = []  # the non editable columns the 'pre_bulk_save' receivers fill (see crm/signals.py)
+
+    def post(self, request, *args, **kwargs):
+        items = self.get_items(request)
+        return self.write(items, [None] * len(items))
+
+    def put(self, request, *args, **kwargs):
+        items = self.get_items(request)
+        ids = [self.get_item_id(item) for item in items]
+        editable = self.get_editable_objects(request, ids)
+        return self.write(items, [editable.get(pk, False) for pk in ids])
+
+    @staticmethod
+    def get_item_id(item):
+        """ Id of an item to update : an integer ('true' is not the id 1). """
+        pk = item.get("id")
+        return pk if isinstance(pk, int) and not isinstance(pk, bool) else None
+
+    def get_items(self, request):
+        items = request.data
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ValidationError("Expected a list of objects.")
+        if len(items) > settings.API_MAX_BULK_SIZE:
+            raise ValidationError(f"A batch can't hold more than {settings.API_MAX_BULK_SIZE} objects.")
+        return items
+
+    def get_editable_objects(self, request, ids):
+        """ Return the {id: object} the user may change among the given ids, in one query. """
+        queryset = self.get_queryset().filter(id__in=[pk for pk in ids if pk is not None])
+        if not request.user.is_superuser:
+            queryset = self.bulk_permission_class().filter_editable(request, queryset)
+        return queryset.in_bulk()
+
+    def get_prefetched_objects(self, items, fields):
+        """ Fetch the objects referenced by all the items with one query per related field. """
+        return {
+            name: field.get_queryset().in_bulk({item[name] for item in items if isinstance(item.get(name), int)})
+            for name, field in fields.items() if isinstance(field, RelatedField) and not field.read_only
+        }
+
+    @staticmethod
+    def pop_unique_validators(serializer):
+        """ Remove the UniqueValidator of the serializer fields, and return their {field name: error message}. """
+        unique_fields = {}
+        for name, field in serializer.fields.items():
+            validators = []
+            for validator in field.validators:
+                if isinstance(validator, UniqueValidator):
+                    unique_fields[name] = validator.message
+                else:
+                    validators.append(validator)
+            field.validators = validators
+        return unique_fields
+
+    def check_unique_fields(self, serializers, errors, unique_fields):
+        """ Check the unique fields of the whole batch with one query per field, instead of one query per item. """
+        model = self.get_queryset().model
+        valid_serializers = [serializer for serializer, error in zip(serializers, errors) if not error]
+        for name, message in unique_fields.items():
+            values = {serializer.validated_data[name] for serializer in valid_serializers}
+            taken = dict(model.objects.filter(**{f"{name}__in": values}).values_list(name, "pk"))
+            seen = set()
+            for serializer, error in zip(serializers, errors):
+                if serializer is None or error:
+                    continue
+                value = serializer.validated_data[name]
+                own_pk = serializer.instance.pk if serializer.instance else None
+                if value in seen or taken.get(value, own_pk) != own_pk:
+                    error.setdefault(name, []).append(message)
+                seen.add(value)
+
+    def check_batch(self, serializers, errors):
+        """
+        Checks of the whole batch reading the database, adding their messages to the errors of the items : none by
+        default. They run in the transaction of the write, so they can lock what they read.
+        """
+
+    @staticmethod
+    def check_duplicate_ids(serializers, errors):
+        """ Refuse the items updating an object already updated by a previous item of the batch. """
+        seen = set()
+        for serializer, error in zip(serializers, errors):
+            if serializer is None or serializer.instance is None:
+                continue
+            if serializer.instance.pk in seen:
+                error.setdefault("id", []).append("This object is already updated by a previous item of the batch.")
+            seen.add(serializer.instance.pk)
+
+    def write(self, items, instances):
+        serializer_class = self.get_serializer_class()
+        context = self.get_serializer_context()
+        context["bulk"] = True
+        context["prefetched"] = self.get_prefetched_objects(items, serializer_class(context=context).fields)
+
+        serializers, errors, unique_fields = [], [], {}
+        for item, instance in zip(items, instances):
+            if instance is False:
+                errors.append({"id": ["Unknown object, or you are not allowed to change it."]})
+                serializers.append(None)
+                continue
+            serializer = serializer_class(instance, data=item, context=context)
+            unique_fields = self.pop_unique_validators(serializer)
+            errors.append({} if serializer.is_valid() else dict(serializer.errors))
+            serializers.append(serializer)
+        self.check_duplicate_ids(serializers, errors)
+        self.check_unique_fields(serializers, errors, unique_fields)
+
+        model = self.get_queryset().model
+        created = self.request.method == "POST"
+        with transaction.atomic():
+            # the batch checks read the database in the transaction of the write, which keeps their locks
+            self.check_batch(serializers, errors)
+            if any(errors):
+                return Response({"errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+
+            if created:
+                objects = [model(**serializer.validated_data) for serializer in serializers]
+            else:
+                objects, changed_fields = [], set()
+                for serializer in serializers:
+                    for name, value in serializer.validated_data.items():
+                        setattr(serializer.instance, name, value)
+                        changed_fields.add(name)
+                    objects.append(serializer.instance)
+
+            pre_bulk_save.send(sender=model, instances=objects, created=created)
+            if created:
+                objects = model.objects.bulk_create(objects, batch_size=settings.API_BULK_BATCH_SIZE)
+                response_status = status.HTTP_201_CREATED
+            else:
+                # only the columns set by the 'pre_bulk_save' receivers are written with the items : the other
+                # columns of the objects, loaded without lock, may be outdated (like the current status of contracts)
+                changed_fields.update(self.copied_fields)
+                # 'bulk_update()' doesn't call 'pre_save()', which sets the 'auto_now' dates
+                now = timezone.now()
+                for field in model._meta.concrete_fields:
+                    if getattr(field, "auto_now", False):
+                        for instance in objects:
+                            setattr(instance, field.attname, now)
+                        changed_fields.add(field.name)
+                model.objects.bulk_update(objects, changed_fields, batch_size=settings.API_BULK_BATCH_SIZE)
+                response_status = status.HTTP_200_OK
+            post_bulk_save.send(sender=model, instances=objects, created=created)
+
+        return Response(serializer_class(objects, many=True, context=context).data, status=response_status)
 
 
 # USER LIST VIEW --------------------------------------------------------------
 
-class UserList(generics.ListAPIView):
+class UserList(ValuesListMixin, generics.ListAPIView):
     serializer_class = UserSerializer
-    queryset = sorted(
-        User.objects.all().filter(groups__name__in=[SELLING_TEAM_NAME, SUPPORT_TEAM_NAME]),
-        key=lambda user: user.id
-    )
     permission_classes = [IsSuperUser | IsAdminUser]
+    modified_column = None
+
+    def get_queryset(self):
+        return User.objects.filter(id__in=get_team_member_ids()).order_by("id")
 
 
 # CLIENT VIEWS ----------------------------------------------------------------
 
-class ClientList(generics.ListCreateAPIView):
+class ClientList(ValuesListMixin, generics.ListCreateAPIView):
     serializer_class = ClientSerializer
     queryset = Client.objects.all()
     permission_classes = [IsSuperUser | (IsAdminUser & ClientListPermission)]
-    filter_backends = [filters.SearchFilter]
+    filter_backends = [TrigramSearchFilter, LookupFilter, OwnerFilter]
     search_fields = ["first_name", "last_name", "email"]
+    filter_fields = {"contact": KEY_LOOKUPS, "date_updated": RANGE_LOOKUPS}
 
 
-class ClientDetail(generics.RetrieveUpdateDestroyAPIView):
+class ClientDetail(ConditionalDetailMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = ClientSerializer
     queryset = Client.objects.all()
     permission_classes = [IsSuperUser | (IsAdminUser & ClientDetailPermission)]
@@ -42,18 +405,41 @@ class ClientDetail(generics.RetrieveUpdateDestroyAPIView):
 
 # CONTRACT VIEWS --------------------------------------------------------------
 
-class ContractList(generics.ListCreateAPIView):
+class ContractList(ValuesListMixin, generics.ListCreateAPIView):
     serializer_class = ContractSerializer
     queryset = Contract.objects.all()
     permission_classes = [IsSuperUser | (IsAdminUser & ContractListPermission)]
-    filter_backends = [filters.SearchFilter]
-    search_fields = [
-        "client__first_name", "client__last_name", "client__email",
-        "date_created", "date_updated", "amount"
-    ]
+    filter_backends = [TrigramSearchFilter, LookupFilter, OwnerFilter]
+    search_fields = ["client__first_name", "client__last_name", "client__email"]
+    filter_fields = {
+        "client": KEY_LOOKUPS,
+        "amount": RANGE_LOOKUPS,
+        "date_created": RANGE_LOOKUPS,
+        "date_updated": RANGE_LOOKUPS,
+        "payment_due": RANGE_LOOKUPS,
+        "current_is_accepted": ["exact"],
+        "current_state": KEY_LOOKUPS,
+    }
+
+    def perform_create(self, serializer):
+        # the sales summaries are refreshed in the same transaction (see crm/signals.py)
+        with transaction.atomic():
+            super().perform_create(serializer)
+
+
+class ContractBulk(BulkWriteMixin, generics.GenericAPIView):
+    serializer_class = ContractSerializer
+    queryset = Contract.objects.all()
+    permission_classes = [IsSuperUser | (IsAdminUser & ContractBulkPermission)]
+    bulk_permission_class = ContractBulkPermission
+    copied_fields = ["selling_contact"]
 
 
-class ContractDetail(generics.RetrieveUpdateDestroyAPIView):
+class ContractExport(ExportMixin, ContractList):
+    export_name = "contracts"
+
+
+class ContractDetail(ConditionalDetailMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = ContractSerializer
     queryset = Contract.objects.all()
     permission_classes = [IsSuperUser | (IsAdminUser & ContractDetailPermission)]
@@ -61,32 +447,236 @@ class ContractDetail(generics.RetrieveUpdateDestroyAPIView):
 
 # CONTRACT STATUS VIEWS -------------------------------------------------------
 
-class ContractStatusList(generics.ListCreateAPIView):
+class ContractStatusList(ValuesListMixin, generics.ListCreateAPIView):
     serializer_class = ContractStatusSerializer
     queryset = ContractStatus.objects.all()
     permission_classes = [IsSuperUser | (IsAdminUser & ContractStatusListPermission)]
+    filter_backends = [LookupFilter, OwnerFilter]
+    filter_fields = {
+        "contract": KEY_LOOKUPS, "state": KEY_LOOKUPS, "is_accepted": ["exact"], "date_updated": RANGE_LOOKUPS
+    }
 
+    def perform_create(self, serializer):
+        # the current status of the contract is updated in the same transaction (see crm/signals.py)
+        with transaction.atomic():
+            super().perform_create(serializer)
 
-class ContractStatusDetail(generics.RetrieveUpdateDestroyAPIView):
+
+class ContractStatusBulk(BulkWriteMixin, generics.GenericAPIView):
     serializer_class = ContractStatusSerializer
     queryset = ContractStatus.objects.all()
+    permission_classes = [IsSuperUser | (IsAdminUser & ContractStatusBulkPermission)]
+    bulk_permission_class = ContractStatusBulkPermission
+
+
+class ContractStatusExport(ExportMixin, ContractStatusList):
+    export_name = "contract_status"
+
+
+class ContractStatusDetail(ConditionalDetailMixin, generics.RetrieveUpdateDestroyAPIView):
+    serializer_class = ContractStatusSerializer
+    queryset = ContractStatus.objects.select_related("contract")
     permission_classes = [IsSuperUser | (IsAdminUser & ContractStatusDetailPermission)]
 
 
 # EVENT VIEWS -----------------------------------------------------------------
 
-class EventList(generics.ListCreateAPIView):
+class EventList(ValuesListMixin, generics.ListCreateAPIView):
     serializer_class = EventSerializer
     queryset = Event.objects.all()
     permission_classes = [IsSuperUser | (IsAdminUser & EventListPermission)]
-    filter_backends = [filters.SearchFilter]
-    search_fields = [
-        "contract__client__first_name", "contract__client__last_name", "contract__client__email",
-        "start_date", "end_date"
-    ]
+    filter_backends = [TrigramSearchFilter, LookupFilter, OwnerFilter]
+    search_fields = ["contract__client__first_name", "contract__client__last_name", "contract__client__email"]
+    filter_fields = {
+        "contract": KEY_LOOKUPS,
+        "support_contact": KEY_LOOKUPS,
+        "attendees": RANGE_LOOKUPS,
+        "start_date": RANGE_LOOKUPS,
+        "end_date": RANGE_LOOKUPS,
+        "date_updated": RANGE_LOOKUPS,
+    }
+
+
+class EventBulk(BulkWriteMixin, generics.GenericAPIView):
+    serializer_class = EventSerializer
+    queryset = Event.objects.all()
+    permission_classes = [IsSuperUser | (IsAdminUser & EventBulkPermission)]
+    bulk_permission_class = EventBulkPermission
+    copied_fields = ["selling_contact"]
+
+    def check_batch(self, serializers, errors):
+        check_schedule_conflicts(serializers, errors)
+
 
+class EventExport(ExportMixin, EventList):
+    export_name = "events"
 
-class EventDetail(generics.RetrieveUpdateDestroyAPIView):
+
+class EventDetail(ConditionalDetailMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = EventSerializer
     queryset = Event.objects.all()
     permission_classes = [IsSuperUser | (IsAdminUser & EventDetailPermission)]
+
+
+class EventTimeline(generics.ListAPIView):
+    """
+    Events grouped by the day they start, in the database, oldest day first, with the list filters and a
+    '?from=' / '?to=' window on their start. For one support contact ('?support_contact=' or '?mine=true'), it is
+    one range scan of the (support contact, start date) index.
+    """
+    serializer_class = EventDaySerializer
+    queryset = Event.objects.all()
+    permission_classes = [IsSuperUser | (IsAdminUser & EventListPermission)]
+    http_method_names = ["get", "head", "options"]
+    filter_backends = [WindowFilter, LookupFilter, OwnerFilter]
+    filter_fields = {"contract": KEY_LOOKUPS, "support_contact": KEY_LOOKUPS}
+    window_field = "start_date"
+    pagination_class = None
+
+    def get_queryset(self):
+        return super().get_queryset().annotate(day=TruncDate("start_date")).values("day").annotate(
+            event_count=Count("id"), total_attendees=Sum("attendees"),
+            first_start=Min("start_date"), last_end=Max("end_date")
+        ).order_by("day")
+
+    def list(self, request, *args, **kwargs):
+        rows = list(self.filter_queryset(self.get_queryset()))
+        etag = make_etag(rows)
+        response = get_conditional_response(request, etag)
+        if response is None:
+            response = Response(self.get_serializer(rows, many=True).data)
+        return set_validators(response, etag)
+
+
+class EventCalendar(EventList):
+    """
+    Stream the filtered events as an iCalendar ('.ics') feed, to subscribe to from a calendar application :
+    '?support_contact=3' or '?mine=true' for the calendar of a user, '?from=' / '?to=' for a window on their start.
+    Calendar applications can't log in : they open the feed with the '?token=' of a user (see 'EventCalendarToken'),
+    which only shows the events of that user. Rows are read by chunks, like the exports.
+    """
+    authentication_classes = [CalendarTokenAuthentication, *api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    http_method_names = ["get", "head", "options"]
+    filter_backends = [WindowFilter, *EventList.filter_backends]
+    window_field = "start_date"
+    pagination_class = None
+    calendar_columns = ("id", "name", "start_date", "end_date", "attendees", "note", "date_updated")
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if isinstance(self.request.successful_authenticator, CalendarTokenAuthentication):
+            return queryset.owned_by(self.request.user)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset()).values(*self.calendar_columns).order_by("id")
+        lines = iter_calendar(iterate(queryset, settings.EXPORT_CHUNK_SIZE), "EPIC Events", request.get_host())
+        response = StreamingHttpResponse(ExportMixin.iter_chunks(lines), content_type="text/calendar; charset=utf-8")
+        response["Content-Disposition"] = 'attachment; filename="events.ics"'
+        return response
+
+
+class EventCalendarToken(generics.GenericAPIView):
+    """ URL of the calendar feed of the logged user, with their token, to subscribe to from a calendar application. """
+    permission_classes = [IsSuperUser | IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        url = request.build_absolute_uri(f"../../calendar.ics?token={make_calendar_token(request.user)}")
+        response = Response({"url": url})
+        response["Cache-Control"] = "private, no-store"
+        return response
+
+
+class SupportAvailabilityList(ValuesListMixin, generics.ListAPIView):
+    """
+    Support Team members without any event between '?start=' and '?end=' : the events overlapping the period are
+    found through the schedules index (see 'EventQuerySet.overlapping()'), then their support contacts excluded.
+    """
+    serializer_class = UserSerializer
+    permission_classes = [IsSuperUser | IsAdminUser]
+    pagination_class = None
+    modified_column = None
+
+    def get_queryset(self):
+        period = PeriodSerializer(data=self.request.query_params)
+        period.is_valid(raise_exception=True)
+        busy_ids = Event.objects.overlapping(**period.validated_data).values("support_contact")
+        support_ids = get_team_member_ids(SUPPORT_TEAM_NAME)
+        return User.objects.filter(id__in=support_ids).exclude(id__in=busy_ids).order_by("id")
+
+
+# DASHBOARD VIEWS -------------------------------------------------------------
+# Read-only lists of the summary tables of crm/aggregates.py, which the writes keep up to date : a dashboard reads a
+# few indexed summary rows instead of aggregating the contracts and events.
+
+class MonthlySalesList(ValuesListMixin, generics.ListAPIView):
+    serializer_class = MonthlySalesSerializer
+    queryset = MonthlySales.objects.all()
+    permission_classes = [IsSuperUser]
+    filter_backends = [LookupFilter]
+    filter_fields = {"selling_contact": KEY_LOOKUPS, "month": RANGE_LOOKUPS}
+
+
+class MonthTotalList(generics.ListAPIView):
+    """ Sales of every month, summed over the monthly sales of the selling contacts, oldest month first. """
+    serializer_class = MonthTotalSerializer
+    queryset = MonthlySales.objects.all()
+    permission_classes = [IsSuperUser]
+    filter_backends = [LookupFilter]
+    filter_fields = {"month": RANGE_LOOKUPS}
+    pagination_class = None
+
+    def get_queryset(self):
+        return super().get_queryset().values("month").annotate(
+            total_contracts=Sum("contracts"), total_amount=Sum("amount"),
+            total_signed_contracts=Sum("signed_contracts"), total_signed_amount=Sum("signed_amount")
+        ).order_by("month")
+
+    def list(self, request, *args, **kwargs):
+        rows = [
+            {
+                "month": row["month"], "contracts": row["total_contracts"], "amount": row["total_amount"],
+                "signed_contracts": row["total_signed_contracts"], "signed_amount": row["total_signed_amount"]
+            }
+            for row in self.filter_queryset(self.get_queryset())
+        ]
+        etag = make_etag(rows)
+        response = get_conditional_response(request, etag)
+        if response is None:
+            response = Response(self.get_serializer(rows, many=True).data)
+        return set_validators(response, etag)
+
+
+class ClientSalesList(ValuesListMixin, generics.ListAPIView):
+    serializer_class = ClientSalesSerializer
+    queryset = ClientSales.objects.all()
+    permission_classes = [IsSuperUser]
+    filter_backends = [LookupFilter]
+    filter_fields = {
+        "client": KEY_LOOKUPS, "selling_contact": KEY_LOOKUPS, "amount": RANGE_LOOKUPS, "signed_amount": RANGE_LOOKUPS
+    }
+
+
+class MonthlyEventLoadList(ValuesListMixin, generics.ListAPIView):
+    serializer_class = MonthlyEventLoadSerializer
+    queryset = MonthlyEventLoad.objects.all()
+    permission_classes = [IsSuperUser]
+    filter_backends = [LookupFilter]
+    filter_fields = {"support_contact": KEY_LOOKUPS, "month": RANGE_LOOKUPS}
+
+
+# METRICS VIEW ----------------------------------------------------------------
+
+def metrics_view(request):
+    """
+    Expose the metrics of the process in the Prometheus text format.
+    With METRICS_TOKEN set, the scraper has to send it as an 'Authorization: Bearer <token>' header, otherwise only
+    logged super users can read the metrics.
+    """
+    if settings.METRICS_TOKEN:
+        allowed = hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {settings.METRICS_TOKEN}")
+    else:
+        allowed = request.user.is_superuser
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.expose(), content_type="text/plain; version=0.0.4; charset=utf-8")
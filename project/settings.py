@@ -1,6 +1,6 @@
-import logging
 from pathlib import Path
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -11,15 +11,55 @@ ALLOWED_HOSTS = config("ALLOWED_HOSTS", default="127.0.0.1", cast=lambda v: [s.s
 
 
 # Logging
+# JSON lines written to LOG_FILE by a background thread (see crm/logs.py). 'crm.requests' logs one line per request
+# (see crm/middleware.py), REQUEST_LOG_SAMPLE_RATE keeps only a share of them on busy servers.
+
+LOG_FILE = config("LOG_FILE", default=str(BASE_DIR / "log" / "crm.log"))
+REQUEST_LOG_SAMPLE_RATE = config("REQUEST_LOG_SAMPLE_RATE", default=1.0, cast=float)
+
+# Queries of every request are counted and timed (see crm/middleware.py). The SQL of the requests spending more than
+# SLOW_REQUEST_THRESHOLD milliseconds in the database is logged to 'crm.queries' (0 disables it). SERVER_TIMING adds
+# these timings to every answer, for any client : it is only on by default in DEBUG mode.
+SLOW_REQUEST_THRESHOLD = config("SLOW_REQUEST_THRESHOLD", default=0, cast=int)
+SERVER_TIMING = config("SERVER_TIMING", default=DEBUG, cast=bool)
+
+# Metrics are exposed at /api/v1/metrics (see crm/metrics.py), to the super users or with this bearer token.
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
+    "formatters": {
+        "json": {
+            "()": "crm.logs.JSONFormatter",
+        },
+    },
+    "filters": {
+        "sampling": {
+            "()": "crm.logs.SamplingFilter",
+            "rate": REQUEST_LOG_SAMPLE_RATE,
+        },
+    },
     "handlers": {
         "file": {
-            "class": "logging.FileHandler",
-            "filename": "log/crm.log",
+            "class": "crm.logs.QueueFileHandler",
+            "filename": LOG_FILE,
+            "formatter": "json",
+        },
+    },
+    "loggers": {
+        "django": {
+            "handlers": ["file"],
             "level": "ERROR",
         },
+        "crm": {
+            "handlers": ["file"],
+            "level": "INFO",
+            "propagate": False,
+        },
+        "crm.requests": {
+            "filters": ["sampling"],
+        },
     },
 }
 
@@ -38,11 +78,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'crm.middleware.RequestLogMiddleware',
+    'crm.middleware.MetricsMiddleware',
+    'crm.middleware.QueryTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'crm.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -68,6 +112,25 @@ TEMPLATES = [
 WSGI_APPLICATION = 'project.wsgi.application'
 
 
+# Django REST Framework
+# List endpoints are paginated with a cursor on the primary key (see crm/pagination.py).
+
+REST_FRAMEWORK = {
+    "DEFAULT_PAGINATION_CLASS": "crm.pagination.KeysetPagination",
+    "PAGE_SIZE": config("API_PAGE_SIZE", default=100, cast=int),
+}
+API_MAX_PAGE_SIZE = config("API_MAX_PAGE_SIZE", default=1000, cast=int)
+API_MAX_BULK_SIZE = config("API_MAX_BULK_SIZE", default=10000, cast=int)
+API_BULK_BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 2000
+
+
+# Cache
+# Teams membership is cached (see crm/teams.py). Use a shared cache backend when running several workers.
+
+TEAM_CACHE_TIMEOUT = config("TEAM_CACHE_TIMEOUT", default=300, cast=int)
+
+
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
@@ -79,8 +142,39 @@ DATABASES = {
         'PASSWORD': config("DB_PASSWORD"),
         'HOST': config("DB_HOST"),
         'PORT': config("DB_PORT"),
+        # Persistent connections : reused by the requests of a worker for DB_CONN_MAX_AGE seconds (0 closes them
+        # after every request).
+        'CONN_MAX_AGE': config("DB_CONN_MAX_AGE", default=60, cast=int),
+        # Behind pgbouncer in transaction pooling mode : no server-side cursors, large reads are paginated on the
+        # primary key instead (see crm/db.py).
+        'DISABLE_SERVER_SIDE_CURSORS': config("DB_PGBOUNCER", default=False, cast=bool),
     }
 }
+# Check persistent connections at the start of every request, to replace the ones the server dropped.
+DB_CONN_HEALTH_CHECKS = config("DB_CONN_HEALTH_CHECKS", default=True, cast=bool)
+
+# Read replicas, as a comma separated list of 'host' or 'host:port' (same name, user and password as the primary),
+# with their comma separated weights (one positive integer per replica, 1 by default). The reads of the GET requests
+# go to the replicas in weighted round-robin, everything else to the primary. After a write, the reads of the user
+# stay on the primary for DB_READ_YOUR_WRITES_WINDOW seconds (see crm/routers.py).
+DB_REPLICAS = config("DB_REPLICAS", default="", cast=lambda v: [s.strip() for s in v.split(",") if s.strip()])
+DB_REPLICA_WEIGHTS = config(
+    "DB_REPLICA_WEIGHTS", default="", cast=lambda v: [int(s) for s in v.split(",") if s.strip()]
+)
+DB_READ_YOUR_WRITES_WINDOW = config("DB_READ_YOUR_WRITES_WINDOW", default=5, cast=int)
+if DB_REPLICA_WEIGHTS and len(DB_REPLICA_WEIGHTS) != len(DB_REPLICAS):
+    raise ImproperlyConfigured("DB_REPLICA_WEIGHTS needs one weight per replica of DB_REPLICAS.")
+if any(weight < 1 for weight in DB_REPLICA_WEIGHTS):
+    raise ImproperlyConfigured("DB_REPLICA_WEIGHTS must be positive integers.")
+DATABASE_REPLICAS = {}
+for number, replica in enumerate(DB_REPLICAS, start=1):
+    host, _, port = replica.partition(":")
+    DATABASES[f"replica_{number}"] = {
+        **DATABASES["default"], 'HOST': host, 'PORT': port or DATABASES["default"]["PORT"],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS[f"replica_{number}"] = DB_REPLICA_WEIGHTS[number - 1] if DB_REPLICA_WEIGHTS else 1
+DATABASE_ROUTERS = ["crm.routers.ReplicaRouter"]
 
 
 # Password validation